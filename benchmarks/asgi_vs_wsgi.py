@@ -0,0 +1,211 @@
+"""Compare serving conduit with sync gunicorn workers and over ASGI.
+
+Both setups get the same number of worker processes and serve the same
+SQLite database with 100 articles. While ``--slow-clients`` connections
+trickle their request headers, ``--clients`` clients request article
+lists over keep-alive connections::
+
+    (env) $ pip install uvicorn
+    (env) $ python benchmarks/asgi_vs_wsgi.py --workers 2 --slow-clients 8
+
+Run it from the project root.
+"""
+import argparse
+from http.client import HTTPConnection
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PORT = 8765
+
+
+def create_app():
+    """Create the app with a database in ``CONDUIT_BENCHMARK_DB``."""
+    import morepath
+    from pony.orm import db_session
+
+    import conduit
+    from conduit.app import App
+    from conduit.auth import User
+    from conduit.auth.hashing import setup_hashing
+    from conduit.blog.model import Article
+    from conduit.blog.search import setup_search
+    from conduit.database import db, setup_db
+
+    class BenchmarkApp(App):
+        pass
+
+    BenchmarkApp.init_settings(
+        {
+            "database": {
+                "provider": "sqlite",
+                "filename": os.environ["CONDUIT_BENCHMARK_DB"],
+                "create_db": True,
+            }
+        }
+    )
+    morepath.scan(conduit, ignore=[".run", ".tests"])
+    BenchmarkApp.commit()
+    app = BenchmarkApp()
+    setup_db(app)
+    setup_search(app)
+    setup_hashing(app)
+
+    with db_session:
+        if not User.exists(id=1):
+            author = User(id=1, username="Tester", email="t@example.com", password="-")
+            for i in range(100):
+                Article(
+                    title="Article {}".format(i),
+                    description="About benchmarking",
+                    body="This is a text. " * 100,
+                    author=author,
+                )
+    db.disconnect()
+
+    return app
+
+
+# conduit.run creates the app with the default database on import, so the
+# app is served directly without the /api prefix
+
+
+def serve_wsgi():
+    return create_app()
+
+
+def serve_asgi():
+    from conduit.asgi import ASGIAdapter
+
+    app = create_app()
+    return ASGIAdapter(app, **app.settings.asgi.__dict__)
+
+
+def start_server(mode, workers, db_path):
+    env = dict(os.environ, CONDUIT_BENCHMARK_DB=db_path, PYTHONPATH=os.getcwd())
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--bind",
+        "127.0.0.1:{}".format(PORT),
+        "--workers",
+        str(workers),
+        "--timeout",
+        "10",
+        "--log-level",
+        "warning",
+    ]
+    if mode == "asgi":
+        command += ["--worker-class", "uvicorn.workers.UvicornWorker"]
+        command.append("benchmarks.asgi_vs_wsgi:serve_asgi()")
+    else:
+        command.append("benchmarks.asgi_vs_wsgi:serve_wsgi()")
+    server = subprocess.Popen(command, env=env)
+
+    for i in range(100):
+        try:
+            connection = HTTPConnection("127.0.0.1", PORT, timeout=1)
+            connection.request("GET", "/tags")
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The server didn't start")
+
+
+def slow_client(stop):
+    sock = socket.create_connection(("127.0.0.1", PORT))
+    sock.sendall(b"GET /articles HTTP/1.1\r\nHost: localhost\r\n")
+    try:
+        while not stop.is_set():
+            sock.sendall(b"X-Padding: slow\r\n")
+            time.sleep(0.5)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+def client(requests, latencies, errors):
+    connection = HTTPConnection("127.0.0.1", PORT, timeout=30)
+    for i in range(requests):
+        start = time.perf_counter()
+        try:
+            connection.request("GET", "/articles?limit=20&offset={}".format(i % 5))
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            if response.getheader("Connection") == "close":
+                connection.close()
+        except OSError as e:
+            errors.append(e)
+            connection.close()
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def run(mode, args, db_path):
+    server = start_server(mode, args.workers, db_path)
+    stop = threading.Event()
+    slow_clients = [
+        threading.Thread(target=slow_client, args=(stop,))
+        for i in range(args.slow_clients)
+    ]
+    for thread in slow_clients:
+        thread.start()
+    time.sleep(0.5)
+
+    latencies = []
+    errors = []
+    clients = [
+        threading.Thread(target=client, args=(args.requests, latencies, errors))
+        for i in range(args.clients)
+    ]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    stop.set()
+    for thread in slow_clients:
+        thread.join()
+    server.terminate()
+    server.wait()
+
+    latencies.sort()
+    print(
+        "{:<5} {:>8.1f} req/s  p50 {:>7.1f} ms  p99 {:>7.1f} ms  errors {}".format(
+            mode,
+            len(latencies) / duration,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000,
+            len(errors),
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--slow-clients", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "benchmark.db")
+        for mode in ("wsgi", "asgi"):
+            run(mode, args, db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""Benchmark every endpoint in-process against a seeded dataset.
+
+The app runs on a SQLite database in a temporary directory, filled with
+a reproducible dataset of the given size. Each endpoint is requested
+``--iterations`` times through the WSGI app. The latency percentiles, the
+number of SQL queries per request and the peak memory allocated per
+request are reported::
+
+    (env) $ python benchmarks/endpoints.py --articles 1000 --output before.json
+
+Results written with ``--output`` can be compared with a later run. The
+comparison exits with status 1 when an endpoint got slower by more than
+``--threshold`` or needs more queries::
+
+    (env) $ python benchmarks/endpoints.py --articles 1000 --compare before.json
+
+Run it from the project root.
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+
+import morepath
+from argon2 import PasswordHasher
+from pony.orm import db_session
+from webtest import TestApp as Client
+
+import conduit
+from conduit.app import App
+from conduit.auth import User
+from conduit.auth.hashing import setup_hashing
+from conduit.blog.model import Article, Comment, Tag
+from conduit.blog.search import setup_search
+from conduit.database import db, setup_db
+
+PASSWORD = "benchmark"
+
+
+def create_app(db_path):
+    class BenchmarkApp(App):
+        pass
+
+    BenchmarkApp.init_settings(
+        {"database": {"provider": "sqlite", "filename": db_path, "create_db": True}}
+    )
+    morepath.scan(conduit, ignore=[".run", ".tests"])
+    BenchmarkApp.commit()
+    app = BenchmarkApp()
+    setup_db(app)
+    setup_search(app)
+    setup_hashing(app)
+
+    return app
+
+
+@db_session
+def seed(users, articles, comments, tags, follows, favorites, rng):
+    """Fill the database with a dataset of the given size."""
+    password = PasswordHasher().hash(PASSWORD)
+    tag_entities = [Tag(tagname="tag{}".format(i)) for i in range(tags)]
+    user_entities = [
+        User(
+            username="user{}".format(i),
+            email="user{}@example.com".format(i),
+            password=password,
+            bio="I write about benchmarks",
+        )
+        for i in range(users)
+    ]
+    for user in user_entities:
+        others = [other for other in user_entities if other is not user]
+        user.follows = rng.sample(others, min(follows, len(others)))
+
+    now = datetime.utcnow()
+    for i in range(articles):
+        created_at = now - timedelta(minutes=i)
+        article = Article(
+            slug="article-{}".format(i),
+            title="Article {}".format(i),
+            description="About benchmarking",
+            body="This is a text about benchmarking. " * 50,
+            author=rng.choice(user_entities),
+            created_at=created_at,
+            updated_at=created_at,
+            tag_list=rng.sample(tag_entities, min(3, tags)),
+            favorited=rng.sample(user_entities, min(favorites, users)),
+        )
+        for j in range(comments):
+            Comment(
+                body="A comment about benchmarking.",
+                author=rng.choice(user_entities),
+                article=article,
+                created_at=created_at + timedelta(seconds=j),
+            )
+
+    Tag.repair_articles_counts()
+    Article.repair_favorites_counts()
+
+
+def login(c, email):
+    response = c.post_json(
+        "/users/login", {"user": {"email": email, "password": PASSWORD}}
+    )
+    return {"Authorization": response.headers["Authorization"]}
+
+
+def endpoints(args):
+    """Return ``(name, request)`` pairs in the order they are run.
+
+    ``request(c, i, state)`` makes the request for iteration ``i``.
+    ``state`` passes values like the created article between the
+    requests of an iteration.
+    """
+    auth = {}
+
+    def article(i):
+        return "article-{}".format(i % args.articles)
+
+    def user(i):
+        return "user{}".format(1 + i % (args.users - 1))
+
+    def new_article(i):
+        return {
+            "article": {
+                "title": "Benchmark {}".format(i),
+                "description": "About benchmarking",
+                "body": "This is a text about benchmarking. " * 50,
+                "tagList": ["tag1", "benchmark"],
+            }
+        }
+
+    def create_article(c, i, state):
+        response = c.post_json("/articles", new_article(i), headers=auth, status=201)
+        state["slug"] = response.json["article"]["slug"]
+        return response
+
+    def add_comment(c, i, state):
+        response = c.post_json(
+            "/articles/{}/comments".format(article(i)),
+            {"comment": {"body": "A benchmark comment."}},
+            headers=auth,
+            status=201,
+        )
+        state["comment"] = response.json["comment"]["id"]
+        return response
+
+    def register(c, i, state):
+        username = "bench{}".format(i)
+        user = {
+            "username": username,
+            "email": username + "@example.com",
+            "password": PASSWORD,
+        }
+        return c.post_json("/users", {"user": user}, status=201)
+
+    def log_in(c, i, state):
+        auth.update(login(c, "user0@example.com"))
+
+    return [
+        ("register", register),
+        ("login", log_in),
+        ("current user", lambda c, i, s: c.get("/user", headers=auth)),
+        (
+            "update user",
+            lambda c, i, s: c.put_json(
+                "/user", {"user": {"bio": "Bio {}".format(i)}}, headers=auth
+            ),
+        ),
+        (
+            "profile",
+            lambda c, i, s: c.get("/profiles/" + user(i), headers=auth),
+        ),
+        (
+            "follow",
+            lambda c, i, s: c.post("/profiles/{}/follow".format(user(i)), headers=auth),
+        ),
+        (
+            "unfollow",
+            lambda c, i, s: c.delete(
+                "/profiles/{}/follow".format(user(i)), headers=auth
+            ),
+        ),
+        ("articles", lambda c, i, s: c.get("/articles", headers=auth)),
+        ("articles anonymous", lambda c, i, s: c.get("/articles")),
+        (
+            "articles by tag",
+            lambda c, i, s: c.get(
+                "/articles?tag=tag{}".format(i % args.tags), headers=auth
+            ),
+        ),
+        (
+            "articles by author",
+            lambda c, i, s: c.get("/articles?author=" + user(i), headers=auth),
+        ),
+        (
+            "articles favorited",
+            lambda c, i, s: c.get("/articles?favorited=" + user(i), headers=auth),
+        ),
+        (
+            "articles offset",
+            lambda c, i, s: c.get(
+                "/articles?offset={}".format(args.articles // 2), headers=auth
+            ),
+        ),
+        ("feed", lambda c, i, s: c.get("/articles/feed", headers=auth)),
+        (
+            "search",
+            lambda c, i, s: c.get(
+                "/articles/search?q=article+{}".format(i % args.articles),
+                headers=auth,
+            ),
+        ),
+        ("create article", create_article),
+        (
+            "article",
+            lambda c, i, s: c.get("/articles/" + article(i), headers=auth),
+        ),
+        (
+            "update article",
+            lambda c, i, s: c.put_json(
+                "/articles/" + s["slug"],
+                {"article": {"body": "An updated text."}},
+                headers=auth,
+            ),
+        ),
+        (
+            "favorite",
+            lambda c, i, s: c.post(
+                "/articles/{}/favorite".format(article(i)), headers=auth
+            ),
+        ),
+        (
+            "unfavorite",
+            lambda c, i, s: c.delete(
+                "/articles/{}/favorite".format(article(i)), headers=auth
+            ),
+        ),
+        (
+            "comments",
+            lambda c, i, s: c.get(
+                "/articles/{}/comments".format(article(i)), headers=auth
+            ),
+        ),
+        ("add comment", add_comment),
+        (
+            "delete comment",
+            lambda c, i, s: c.delete(
+                "/articles/{}/comments/{}".format(article(i), s["comment"]),
+                headers=auth,
+            ),
+        ),
+        (
+            "delete article",
+            lambda c, i, s: c.delete("/articles/" + s["slug"], headers=auth),
+        ),
+        ("tags", lambda c, i, s: c.get("/tags")),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def run(c, args):
+    requests = endpoints(args)
+    latencies = {name: [] for name, request in requests}
+    queries = {name: [] for name, request in requests}
+    allocations = {name: 0 for name, request in requests}
+
+    for i in range(args.warmup + args.iterations + 1):
+        state = {}
+        # the last iteration traces the allocations, which slows it down
+        trace = i == args.warmup + args.iterations
+        for name, request in requests:
+            db.merge_local_stats()
+            if trace:
+                # a fresh start per request resets the peak, reset_peak()
+                # needs Python 3.9
+                tracemalloc.start()
+            start = perf_counter()
+            request(c, i, state)
+            elapsed = perf_counter() - start
+            if trace:
+                allocations[name] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            elif i >= args.warmup:
+                latencies[name].append(elapsed)
+                stats = db.local_stats.get(None)
+                queries[name].append(stats.db_count if stats else 0)
+
+    results = {}
+    for name, request in requests:
+        timings = sorted(latencies[name])
+        results[name] = {
+            "p50_ms": percentile(timings, 0.5) * 1000,
+            "p90_ms": percentile(timings, 0.9) * 1000,
+            "p99_ms": percentile(timings, 0.99) * 1000,
+            "mean_ms": sum(timings) / len(timings) * 1000,
+            "queries": max(queries[name]),
+            "alloc_peak_kib": allocations[name] / 1024,
+        }
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(
+        "{:<20} {:>9} {:>9} {:>9} {:>8} {:>11}".format(
+            "endpoint", "p50 ms", "p90 ms", "p99 ms", "queries", "alloc KiB"
+        )
+    )
+    for name, result in results.items():
+        print(
+            "{:<20} {p50_ms:>9.2f} {p90_ms:>9.2f} {p99_ms:>9.2f} {queries:>8} "
+            "{alloc_peak_kib:>11.1f}".format(name, **result)
+        )
+
+
+def compare(results, baseline, threshold):
+    """Print the changes against ``baseline`` and return the regressions."""
+    regressions = []
+    print(
+        "\n{:<20} {:>13} {:>9} {:>11}".format(
+            "endpoint", "baseline p50", "change", "queries"
+        )
+    )
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        change = result["p50_ms"] / before["p50_ms"] - 1
+        slower = change > threshold
+        more_queries = result["queries"] > before["queries"]
+        print(
+            "{:<20} {:>13.2f} {:>+8.0%} {:>5} -> {:<3}{}".format(
+                name,
+                before["p50_ms"],
+                change,
+                before["queries"],
+                result["queries"],
+                "  REGRESSION" if slower or more_queries else "",
+            )
+        )
+        if slower or more_queries:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--articles", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=5, help="per article")
+    parser.add_argument("--tags", type=int, default=20)
+    parser.add_argument("--follows", type=int, default=10, help="per user")
+    parser.add_argument("--favorites", type=int, default=3, help="per article")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with this JSON result file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative p50 slowdown counted as regression",
+    )
+    args = parser.parse_args()
+
+    dataset = {
+        "users": args.users,
+        "articles": args.articles,
+        "comments": args.comments,
+        "tags": args.tags,
+        "follows": args.follows,
+        "favorites": args.favorites,
+        "seed": args.seed,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(os.path.join(tmp, "benchmark.db"))
+        seed(
+            args.users,
+            args.articles,
+            args.comments,
+            args.tags,
+            args.follows,
+            args.favorites,
+            random.Random(args.seed),
+        )
+        results = run(Client(app), args)
+        db.disconnect()
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "dataset": dataset,
+                    "iterations": args.iterations,
+                    "endpoints": results,
+                },
+                output,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            baseline = json.load(baseline)
+        if baseline["dataset"] != dataset:
+            print("\nThe baseline was run with another dataset:", baseline["dataset"])
+        regressions = compare(results, baseline["endpoints"], args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
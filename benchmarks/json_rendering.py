@@ -0,0 +1,84 @@
+"""Benchmark rendering a list of 100 articles to JSON.
+
+Compares the old strftime based datetime formatting with
+``datetime_to_isoformat`` and the available JSON encoders::
+
+    (env) $ python benchmarks/json_rendering.py
+"""
+from datetime import datetime, timedelta
+from timeit import repeat
+from types import SimpleNamespace
+
+from conduit.blog.view import _article_json
+from conduit.rendering import json_encoders
+from conduit.utils import datetime_to_isoformat
+
+
+def strftime_to_isoformat(date_time):
+    return date_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def make_articles(count=100):
+    author = SimpleNamespace(username="Tester", bio="My life", image="me.png")
+    created_at = datetime(2017, 10, 21, 13, 17, 45, 123456)
+    return [
+        SimpleNamespace(
+            slug="test-text-{}".format(i),
+            title="Test text {}".format(i),
+            description="About testing",
+            body="This is a text test. " * 50,
+            created_at=created_at + timedelta(minutes=i),
+            updated_at=created_at + timedelta(minutes=i, seconds=30),
+            author=author,
+        )
+        for i in range(count)
+    ]
+
+
+def dump_articles(articles):
+    return {
+        "articles": [
+            _article_json(
+                article,
+                tag_list=["test", "text"],
+                favorited=False,
+                favorites_count=3,
+                following=False,
+            )
+            for article in articles
+        ],
+        "articlesCount": len(articles),
+    }
+
+
+def report(name, func, number=200):
+    best = min(repeat(func, number=number, repeat=5)) / number
+    print("{:<40} {:>8.1f} µs".format(name, best * 1e6))
+    return best
+
+
+def main():
+    articles = make_articles()
+    dates = [article.created_at for article in articles]
+
+    print("Formatting 100 datetimes")
+    old = report("strftime", lambda: [strftime_to_isoformat(d) for d in dates])
+    new = report(
+        "datetime_to_isoformat", lambda: [datetime_to_isoformat(d) for d in dates]
+    )
+    print("speedup: {:.1f}x\n".format(old / new))
+
+    content = dump_articles(articles)
+    print("Encoding a 100 article list payload")
+    baseline = None
+    for name, (module, encode) in reversed(list(json_encoders.items())):
+        if module is None:
+            print("{:<40} not installed".format(name))
+            continue
+        timing = report(name, lambda: encode(content))
+        baseline = baseline or timing
+        print("speedup: {:.1f}x".format(baseline / timing))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,10 @@
 # flake8: noqa
 
-from .app import App, ProductionApp, TestApp
+from .app import App
+
+
+def __getattr__(name):
+    # ProductionApp and TestApp load their settings on first access
+    from . import app
+
+    return getattr(app, name)
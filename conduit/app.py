@@ -1,21 +1,221 @@
-import yaml
+import hmac
+import os
+import time
 
+import morepath
 from more.jwtauth import JWTIdentityPolicy
 from more.pony import PonyApp
+from more.pony.app import pony_tween_factory
 from more.cors import CORSApp
+from pony.orm import TransactionError
+from pony.orm.dbapiprovider import IntegrityError
+from webob import Response
+from webob.exc import HTTPNotFound, HTTPUnauthorized
 
 from conduit.auth import AuthApp
 from conduit.blog import BlogApp
+from conduit.auth.hashing import password_hasher
+from conduit.cache import invalidations
+from conduit.blog.model import article_counts, tag_clouds
+from conduit.database import (
+    connection_pool,
+    db,
+    query_origin,
+    replica_connection_pools,
+    replica_session,
+)
+from conduit.metrics import metrics
+from conduit.profiling import db_stats
+from conduit.utils import load_yaml
 
 
 class App(PonyApp, AuthApp, BlogApp, CORSApp):
     pass
 
 
-with open("conduit/settings/default.yml") as defaults:
-    defaults_dict = yaml.safe_load(defaults)
+def load_settings(name):
+    """Load ``settings/<name>.yml`` from the package data."""
+    return load_yaml("conduit", "settings/{}.yml".format(name))
 
-App.init_settings(defaults_dict)
+
+App.init_settings(load_settings("default"))
+
+
+def retry_on_conflict(exception):
+    """Whether to retry the transaction of a request after ``exception``.
+
+    Besides the transaction errors of failed optimistic checks this retries
+    when a concurrent transaction took the same article slug.
+    """
+    if isinstance(exception, IntegrityError):
+        return "slug" in str(exception)
+
+    return isinstance(exception, TransactionError)
+
+
+@App.setting(section="pony", name="retry_exceptions")
+def get_retry_exceptions():
+    return retry_on_conflict
+
+
+@App.tween_factory(under=pony_tween_factory, over=morepath.EXCVIEW)
+def reset_request_tween_factory(app, handler):
+    """Reset the request when the Pony tween retries the transaction."""
+
+    def reset_request_tween(request):
+        if getattr(request, "attempted", False):
+            request.reset()
+        request.attempted = True
+        return handler(request)
+
+    return reset_request_tween
+
+
+@App.tween_factory(under=reset_request_tween_factory, over=morepath.EXCVIEW)
+def replica_tween_factory(app, handler):
+    """Serve safe requests from a replica when replicas are configured.
+
+    After a successful write the client gets a cookie, which routes its
+    requests to the primary for the next ``read_your_writes`` seconds, so
+    it sees its own changes before they reach the replicas.
+    """
+    settings = app.settings.replicas
+    if not settings.databases:
+        return handler
+
+    def replica_tween(request):
+        if request.method in ("GET", "HEAD", "OPTIONS"):
+            try:
+                read_primary = float(request.cookies[settings.cookie]) > time.time()
+            except (KeyError, ValueError):
+                read_primary = False
+            if not read_primary:
+                with replica_session():
+                    return handler(request)
+            return handler(request)
+
+        response = handler(request)
+        if response.status_code < 400:
+            response.set_cookie(
+                settings.cookie,
+                str(int(time.time() + settings.read_your_writes)),
+                max_age=settings.read_your_writes,
+                httponly=True,
+            )
+        return response
+
+    return replica_tween
+
+
+def record_process_metrics(app):
+    """Copy the statistics of the caches and pools to the metrics."""
+    caches = {
+        "article_counts": article_counts,
+        "tag_clouds": tag_clouds,
+        "article_responses": app.article_responses,
+    }
+    for name, cache in caches.items():
+        metrics.set("conduit_cache_hits_total", {"cache": name}, cache.hits)
+        metrics.set("conduit_cache_misses_total", {"cache": name}, cache.misses)
+
+    pools = {"primary": connection_pool}
+    for i, pool in enumerate(replica_connection_pools):
+        pools["replica{}".format(i)] = pool
+    for name, pool in pools.items():
+        if not pool.size:
+            continue
+        stats = pool.stats()
+        labels = {"pool": name}
+        for state in ("size", "in_use", "idle"):
+            metrics.set(
+                "conduit_db_pool_connections", dict(labels, state=state), stats[state]
+            )
+        for stat in ("waits", "timeouts", "opened", "closed"):
+            metrics.set("conduit_db_pool_{}_total".format(stat), labels, stats[stat])
+        metrics.set("conduit_db_pool_wait_seconds_total", labels, stats["wait_time"])
+
+    stats = password_hasher.stats()
+    metrics.set("conduit_password_hashing_calls_total", {}, stats["calls"])
+    metrics.set("conduit_password_hashing_rejected_total", {}, stats["rejected"])
+    metrics.set("conduit_password_hashing_seconds_total", {}, stats["hash_time"])
+
+
+@App.tween_factory(over=pony_tween_factory)
+def metrics_tween_factory(app, handler):
+    """Count the requests, their latency and SQL queries by view."""
+
+    def metrics_tween(request):
+        if not metrics.enabled:
+            return handler(request)
+
+        queries = db_stats(db)[0]
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = handler(request)
+            status = response.status_code
+            return response
+        finally:
+            duration = time.perf_counter() - start
+            model, view = getattr(request, "view_labels", None) or ("none", "")
+            labels = {"model": model, "view": view, "method": request.method}
+            metrics.inc("conduit_requests_total", dict(labels, status=str(status)))
+            metrics.observe("conduit_request_duration_seconds", labels, duration)
+            metrics.inc("conduit_sql_queries_total", labels, db_stats(db)[0] - queries)
+            metrics.sync(lambda: record_process_metrics(app))
+
+    return metrics_tween
+
+
+@App.tween_factory(under=metrics_tween_factory, over=pony_tween_factory)
+def invalidations_tween_factory(app, handler):
+    """Drop the cache entries changed by a request after its commit."""
+
+    def invalidations_tween(request):
+        with invalidations.deferred():
+            return handler(request)
+
+    return invalidations_tween
+
+
+@App.tween_factory(under=metrics_tween_factory, over=pony_tween_factory)
+def slow_query_tween_factory(app, handler):
+    """Attribute the slow queries to the request running them."""
+    if not app.settings.slow_queries.threshold:
+        return handler
+
+    def slow_query_tween(request):
+        with query_origin(request):
+            return handler(request)
+
+    return slow_query_tween
+
+
+class MetricsEndpoint:
+    pass
+
+
+@App.path(model=MetricsEndpoint, path="_metrics")
+def get_metrics_endpoint():
+    return MetricsEndpoint()
+
+
+@App.json(model=MetricsEndpoint)
+def metrics_endpoint(self, request):
+    if not metrics.enabled:
+        raise HTTPNotFound()
+
+    authorization = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(authorization, ("Bearer " + metrics.token).encode()):
+        raise HTTPUnauthorized()
+
+    record_process_metrics(request.app)
+    return Response(
+        text=metrics.exposition(),
+        content_type="text/plain",
+        charset="utf-8",
+        content_type_params={"version": "0.0.4"},
+    )
 
 
 @App.identity_policy()
@@ -29,21 +229,34 @@ def verify_identity(identity):
     return True
 
 
-class ProductionApp(App):
-    pass
+environments = {"production": "ProductionApp", "test": "TestApp"}
 
 
-with open("conduit/settings/production.yml") as settings:
-    settings_dict = yaml.safe_load(settings)
+def _environment_app(environment):
+    name = environments[environment]
+    app_class = globals().get(name)
+    if app_class is None:
+        app_class = type(name, (App,), {"__module__": __name__})
+        app_class.init_settings(load_settings(environment))
+        globals()[name] = app_class
 
-ProductionApp.init_settings(settings_dict)
+    return app_class
 
 
-class TestApp(App):
-    pass
+def __getattr__(name):
+    # ProductionApp and TestApp are created on first access, so only the
+    # settings of the environment in use are loaded
+    for environment, app_name in environments.items():
+        if name == app_name:
+            return _environment_app(environment)
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
-with open("conduit/settings/test.yml") as settings:
-    settings_dict = yaml.safe_load(settings)
+def get_app_class():
+    """Return the App class for the ``RUN_ENV`` environment variable."""
+    environment = os.getenv("RUN_ENV")
+    if environment not in environments:
+        return App
 
-TestApp.init_settings(settings_dict)
+    return _environment_app(environment)
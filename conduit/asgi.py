@@ -0,0 +1,153 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import os
+import sys
+
+
+def _wsgi_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        if name in environ and name != "CONTENT_LENGTH":
+            value = environ[name] + "," + value
+        environ[name] = value
+
+    return environ
+
+
+def _call_wsgi(wsgi_app, environ):
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [int(status.split(" ", 1)[0]), headers]
+
+    result = wsgi_app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    status, headers = response
+    return status, headers, body
+
+
+class ASGIAdapter:
+    """Serves a WSGI application over ASGI.
+
+    The request body is read on the event loop, then the WSGI application
+    runs on a pool of at most ``threads`` threads. This keeps the Pony
+    ``db_session`` and the password hashing of a request on a single
+    thread. Meanwhile the server can hold many slow or idle keep-alive
+    connections without a thread per connection. Request bodies larger
+    than ``max_body_size`` bytes are rejected with ``413``.
+    """
+
+    def __init__(self, wsgi_app, threads=8, max_body_size=1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_body_size = max_body_size
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # the servers fork the workers after importing the application
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                self.threads, thread_name_prefix="conduit"
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope type: " + scope["type"])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > self.max_body_size:
+                await self.send_response(send, 413, [], b"")
+                return
+            if not message.get("more_body", False):
+                break
+
+        environ = _wsgi_environ(scope, b"".join(chunks))
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(
+            self._get_executor(), _call_wsgi, self.wsgi_app, environ
+        )
+        await self.send_response(send, status, headers, body)
+
+    async def send_response(self, send, status, headers, body):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def __getattr__(name):
+    # the application is created on first access, as conduit.run sets up
+    # the database on import
+    if name == "application":
+        from conduit import run
+
+        application = ASGIAdapter(run.application, **run.app.settings.asgi.__dict__)
+        globals()["application"] = application
+        return application
+
+    raise AttributeError(name)
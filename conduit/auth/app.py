@@ -1,5 +1,27 @@
 import morepath
+from morepath import NO_IDENTITY, reify
 
+from conduit.rendering import App as JsonApp
+from .model import User
 
-class App(morepath.App):
-    pass
+
+class Request(morepath.Request):
+    @reify
+    def current_user(self):
+        """The logged in User, resolved once per request.
+
+        ``None`` if the request has no identity or the user doesn't exist.
+        """
+        if self.identity == NO_IDENTITY:
+            return None
+
+        return User.get(email=self.identity.userid)
+
+    def reset(self):
+        super().reset()
+        # the user was loaded in the transaction which is retried
+        self.__dict__.pop("current_user", None)
+
+
+class App(JsonApp):
+    request_class = Request
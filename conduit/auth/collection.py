@@ -1,11 +1,9 @@
-from argon2 import PasswordHasher
-
+from .hashing import password_hasher
 from .model import User
 
 
 class UserCollection:
     def add(self, username, email, password):
-        ph = PasswordHasher()
-        password_hash = ph.hash(password)
+        password_hash = password_hasher.hash(password)
 
         return User(username=username, email=email, password=password_hash)
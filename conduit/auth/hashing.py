@@ -0,0 +1,126 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+
+from conduit.profiling import record
+
+
+_hasher = PasswordHasher()
+
+
+def _hash(password):
+    return _hasher.hash(password)
+
+
+def _verify(password_hash, password):
+    try:
+        return _hasher.verify(password_hash, password)
+    except VerifyMismatchError:
+        return False
+
+
+class HashingBusy(Exception):
+    """Raised when no hashing slot became free within the timeout."""
+
+
+class PasswordHashingService:
+    """Runs argon2 hashing and verification with capped concurrency.
+
+    With ``workers`` set the work is done in a process pool, so it
+    doesn't hold the GIL of the request worker. At most ``max_pending``
+    calls are in flight per process, further calls wait up to ``timeout``
+    seconds for a slot and then raise :class:`HashingBusy`.
+    """
+
+    def __init__(self, workers=0, max_pending=32, timeout=5):
+        self._lock = Lock()
+        self._executor = None
+        self._pid = None
+        self.calls = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.hash_time = 0.0
+        self.configure(workers, max_pending, timeout)
+
+    def configure(self, workers=0, max_pending=32, timeout=5):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(max_pending)
+        self.shutdown()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            # gunicorn forks the workers after loading the app, so every
+            # worker process needs its own pool
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _drop_executor(self, executor):
+        with self._lock:
+            # another thread may have replaced the broken pool already
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _submit(self, func, *args):
+        executor = self._get_executor()
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool:
+            # a pool process died, e.g. killed by the OOM killer
+            self._drop_executor(executor)
+            return self._get_executor().submit(func, *args).result()
+
+    def _run(self, func, *args):
+        start = perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.rejected += 1
+            raise HashingBusy
+        acquired = perf_counter()
+        try:
+            if self.workers:
+                return self._submit(func, *args)
+            return func(*args)
+        finally:
+            self._slots.release()
+            finished = perf_counter()
+            self.calls += 1
+            self.wait_time += acquired - start
+            self.hash_time += finished - acquired
+            record("hash", finished - start)
+
+    def hash(self, password):
+        return self._run(_hash, password)
+
+    def verify(self, password_hash, password):
+        """Return whether ``password`` matches ``password_hash``."""
+        return self._run(_verify, password_hash, password)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "wait_time": self.wait_time,
+            "hash_time": self.hash_time,
+        }
+
+
+password_hasher = PasswordHashingService()
+
+
+def setup_hashing(app):
+    password_hasher.configure(**app.settings.hashing.__dict__)
@@ -1,8 +1,8 @@
 from datetime import datetime
-from argon2 import PasswordHasher
 from pony.orm import Required, Optional, Set
 
 from conduit.database import db
+from .hashing import password_hasher
 
 
 class Login:
@@ -24,13 +24,13 @@ class User(db.Entity):
     articles = Set("Article", reverse="author")
     favorites = Set("Article", reverse="favorited")
     comments = Set("Comment")
+    timeline = Set("TimelineEntry")
 
     def update(self, payload={}):
         update_payload = {}
         for attribute, value in payload.items():
             if attribute == "password":
-                ph = PasswordHasher()
-                password_hash = ph.hash(value)
+                password_hash = password_hasher.hash(value)
                 update_payload["password"] = password_hash
             else:
                 update_payload[attribute] = value
@@ -13,11 +13,10 @@ def get_login():
 
 @App.path(model=User, path="user")
 def get_current_user(request):
-    current_user = request.identity
-    if current_user == NO_IDENTITY:
+    if request.identity == NO_IDENTITY:
         raise HTTPUnauthorized
 
-    return User.get(email=current_user.userid)
+    return request.current_user
 
 
 @App.path(model=UserCollection, path="users")
@@ -1,21 +1,19 @@
 from datetime import datetime
 
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
-import yaml
-
 import morepath
 from more.cerberus import loader
 
+from conduit.conditional import not_modified
 from conduit.permissions import ViewPermission, EditPermission
+from conduit.utils import load_yaml
 from .app import App
 from .collection import UserCollection
+from .hashing import password_hasher
 from .model import Login, User, Profile
 from .validator import EmailValidator
 
 
-with open("conduit/auth/schema.yml") as schema:
-    schema = yaml.safe_load(schema)
+schema = load_yaml("conduit.auth", "schema.yml")
 
 login_validator = loader(schema["login"])
 user_validator = loader(schema["user"], EmailValidator)
@@ -39,16 +37,10 @@ def login(self, request, json):
     email = u["email"]
     password = u["password"]
 
-    ph = PasswordHasher()
     user = User.get(email=email)
     credentials_valid = False
     if user:
-        try:
-            ph.verify(user.password, password)
-        except VerifyMismatchError:
-            pass
-        else:
-            credentials_valid = True
+        credentials_valid = password_hasher.verify(user.password, password)
 
     if credentials_valid:
         user.last_login = datetime.utcnow()
@@ -143,6 +135,9 @@ def user_update(self, request, json):
 
     else:
         self.update(u)
+        if u.keys() & {"username", "bio", "image"}:
+            # the article lists show the author profiles
+            request.app.clear_article_responses()
         authtype, token = request.headers["Authorization"].split(" ", 1)
 
         return _dump_user_json(self, token)
@@ -163,31 +158,11 @@ def _dump_profile_json(profile, current_user):
 
 @App.json(model=Profile)
 def profile_default(self, request):
-    try:
-        current_user = User.get(email=request.identity.userid)
-    except ValueError:
-        current_user = None
-
-    return _dump_profile_json(self, current_user)
-
-
-@App.json(
-    model=Profile, name="follow", request_method="POST", permission=EditPermission
-)
-def profile_follow(self, request):
-    current_user = User.get(email=request.identity.userid)
-    if current_user not in self.profile.followers:
-        self.profile.followers.add(current_user)
-
-    return _dump_profile_json(self, current_user)
-
-
-@App.json(
-    model=Profile, name="follow", request_method="DELETE", permission=EditPermission
-)
-def profile_unfollow(self, request):
-    current_user = User.get(email=request.identity.userid)
-    if current_user in self.profile.followers:
-        self.profile.followers.remove(current_user)
-
-    return _dump_profile_json(self, current_user)
+    current_user = request.current_user
+    profile = _dump_profile_json(self, current_user)
+    version = (current_user.id if current_user else None, profile)
+    response = not_modified(request, version)
+    if response is not None:
+        return response
+
+    return profile
@@ -1,5 +1,19 @@
-import morepath
+from morepath import reify
 
+from conduit.cache import LRUCache, SQLiteCache, invalidations
+from conduit.rendering import App as JsonApp
 
-class App(morepath.App):
-    pass
+
+class App(JsonApp):
+    @reify
+    def article_responses(self):
+        """Rendered article lists for anonymous requests by query string."""
+        settings = self.settings.response_cache
+        if settings.backend == "sqlite":
+            return SQLiteCache(settings.path, settings.maxsize, settings.ttl)
+
+        return LRUCache(settings.maxsize, settings.ttl)
+
+    def clear_article_responses(self):
+        """Clear the cached article lists once the transaction commits."""
+        invalidations.clear(self.article_responses)
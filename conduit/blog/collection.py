@@ -1,18 +1,113 @@
-from pony.orm import desc
+from pony.orm import desc, select
 
 from conduit.auth import User
-from .model import Article, Comment, Tag
+from conduit.utils import encode_cursor
+from . import search
+from .model import Article, Comment, Tag, TimelineEntry, article_counts, tag_clouds
+
+
+def _cached_count(key, query):
+    count = article_counts.get(key)
+    if count is None:
+        count = query.count()
+        article_counts.set(key, count)
+
+    return count
+
+
+def _seek(query, direction, created_at, id, timeline):
+    if timeline:
+        # the entries are ordered by the id of their article
+        if direction == "prev":
+            return query.filter(
+                lambda x: x.created_at > created_at
+                or (x.created_at == created_at and x.article.id > id)
+            )
+        return query.filter(
+            lambda x: x.created_at < created_at
+            or (x.created_at == created_at and x.article.id < id)
+        )
+
+    if direction == "prev":
+        return query.filter(
+            lambda x: x.created_at > created_at
+            or (x.created_at == created_at and x.id > id)
+        )
+    return query.filter(
+        lambda x: x.created_at < created_at
+        or (x.created_at == created_at and x.id < id)
+    )
+
+
+def _paginate(query, entity, limit, offset, cursor):
+    """Return a page of ``query`` sorted from newest to oldest.
+
+    With a cursor the page seeks on ``(created_at, id)`` instead of
+    skipping ``offset`` rows, so deep pages are as fast as the first one.
+    Timeline entries seek on ``(created_at, article)``. One row more than
+    ``limit`` is fetched to tell if the page has a successor in the seek
+    direction, so this returns ``(items, has_more)``.
+    """
+    timeline = entity is TimelineEntry
+    id_attr = entity.article if timeline else entity.id
+    if cursor:
+        direction, created_at, id = cursor
+        query = _seek(query, direction, created_at, id, timeline)
+        if direction == "prev":
+            query = query.sort_by(entity.created_at, id_attr)
+        else:
+            query = query.sort_by(desc(entity.created_at), desc(id_attr))
+        offset = 0
+    else:
+        direction = "next"
+        query = query.sort_by(desc(entity.created_at), desc(id_attr))
+
+    if limit:
+        query = query.limit(limit + 1, offset=offset)
+
+    items = query[:]
+    has_more = bool(limit) and len(items) > limit
+    if has_more:
+        del items[limit:]
+    if direction == "prev":
+        items.reverse()
+
+    return items, has_more
+
+
+def _page_cursors(items, has_more, offset, cursor):
+    """Return the cursors of the pages before and after ``items``."""
+    if not items:
+        return None, None
+
+    if cursor and cursor[0] == "prev":
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = bool(cursor or offset), has_more
+
+    first, last = items[0], items[-1]
+    prev_cursor = (
+        encode_cursor(first.created_at, first.id, "prev") if has_prev else None
+    )
+    next_cursor = encode_cursor(last.created_at, last.id) if has_next else None
+
+    return prev_cursor, next_cursor
 
 
 class ArticleCollection:
-    def __init__(self, tag, author, favorited, limit, offset):
+    def __init__(
+        self, tag, author, favorited, limit, offset, cursor=None, timeline=False
+    ):
         self.tag = Tag.get(tagname=tag) if tag else None
         self.author = User.get(username=author) if author else None
         self.favorited = User.get(username=favorited) if favorited else None
         self.limit = limit
         self.offset = offset
+        self.cursor = cursor
+        self.timeline = timeline
+        self.has_more = False
 
-    def query(self):
+    def select(self):
         result = Article.select()
         if self.tag:
             result = result.where(lambda a: self.tag in a.tag_list)
@@ -20,56 +115,164 @@ class ArticleCollection:
             result = result.where(lambda a: a.author == self.author)
         if self.favorited:
             result = result.where(lambda a: self.favorited in a.favorited)
-        result = result.sort_by(desc(Article.created_at))
-        if self.limit:
-            result = result.limit(self.limit, offset=self.offset)
 
-        return result[:]
+        return result
 
-    def add(self, title, description, body, author, tag_list):
-        tags = []
-        if tag_list:
-            for tagname in tag_list:
-                tag = Tag.get(tagname=tagname)
-                if not tag:
-                    tag = Tag(tagname=tagname)
-                tags.append(tag)
+    def query(self):
+        articles, self.has_more = _paginate(
+            self.select().prefetch(Article.author, Article.description, Article.body),
+            Article,
+            self.limit,
+            self.offset,
+            self.cursor,
+        )
+
+        return articles
 
+    def cursors(self, articles):
+        """Return the prev and next cursors for the page of ``query``."""
+        return _page_cursors(articles, self.has_more, self.offset, self.cursor)
+
+    def count(self):
+        key = (
+            "articles",
+            self.tag.id if self.tag else None,
+            self.author.id if self.author else None,
+            self.favorited.id if self.favorited else None,
+        )
+
+        return _cached_count(key, self.select())
+
+    def add(self, title, description, body, author, tag_list):
         article = Article(
             title=title,
             description=description,
             body=body,
             author=author,
-            tag_list=tags,
+            tag_list=Tag.get_or_create(tag_list or []),
         )
         article.flush()
+        Tag.update_usage(article.tag_list, 1)
+        if self.timeline:
+            TimelineEntry.fan_out(article)
 
         return article
 
 
 class ArticleFeed:
-    def __init__(self, user, limit, offset):
+    def __init__(self, user, limit, offset, cursor=None, timeline=False):
         self.user = user
         self.limit = limit
         self.offset = offset
+        self.cursor = cursor
+        self.timeline = timeline
+        self.has_more = False
+
+    def select(self):
+        if self.timeline:
+            return TimelineEntry.select(lambda e: e.user == self.user)
+
+        return Article.select(lambda a: self.user in a.author.followers)
 
     def query(self):
-        result = Article.select(lambda a: self.user in a.author.followers)
-        result = result.sort_by(desc(Article.created_at))
-        if self.limit:
-            result = result.limit(self.limit, offset=self.offset)
+        if self.timeline:
+            return self._timeline_query()
+
+        articles, self.has_more = _paginate(
+            self.select().prefetch(Article.author, Article.description, Article.body),
+            Article,
+            self.limit,
+            self.offset,
+            self.cursor,
+        )
+
+        return articles
+
+    def _timeline_query(self):
+        """Return a page of the timeline, seeking on its index.
+
+        The entries carry the creation time of their article, so a page
+        is a range scan of ``(user, created_at, article)``. The articles
+        of the page are loaded with one more query.
+        """
+        entries, self.has_more = _paginate(
+            self.select(),
+            TimelineEntry,
+            self.limit,
+            self.offset,
+            self.cursor,
+        )
+        ids = [entry.article.id for entry in entries]
+        articles = {
+            article.id: article
+            for article in Article.select(lambda a: a.id in ids).prefetch(
+                Article.author, Article.description, Article.body
+            )
+        }
 
-        return result[:]
+        return [articles[id] for id in ids]
+
+    def cursors(self, articles):
+        """Return the prev and next cursors for the page of ``query``."""
+        return _page_cursors(articles, self.has_more, self.offset, self.cursor)
+
+    def count(self):
+        return _cached_count(("feed", self.user.id), self.select())
+
+
+class ArticleSearch:
+    """The articles matching a full-text query, best matches first."""
+
+    def __init__(self, text, limit, offset):
+        self.text = text
+        self.limit = limit
+        self.offset = offset
+
+    def query(self):
+        ids = search.search(self.text, self.limit, self.offset)
+        if not ids:
+            return []
+
+        articles = {
+            article.id: article
+            for article in Article.select(lambda a: a.id in ids).prefetch(
+                Article.author, Article.description, Article.body
+            )
+        }
+        return [articles[id] for id in ids if id in articles]
+
+    def count(self):
+        return search.count(self.text)
 
 
 class CommentCollection:
-    def __init__(self, article):
+    def __init__(self, article, limit=20, cursor=None):
         self.article = article
+        self.limit = limit
+        self.cursor = cursor
+        self.has_more = False
+
+    def select(self):
+        return Comment.select(lambda c: c.article == self.article)
 
     def query(self):
-        return Comment.select(lambda c: c.article == self.article).sort_by(
-            desc(Comment.created_at)
-        )[:]
+        """Return a page of comments with their authors and bodies loaded."""
+        comments, self.has_more = _paginate(
+            self.select().prefetch(Comment.author, Comment.body),
+            Comment,
+            self.limit,
+            0,
+            self.cursor,
+        )
+
+        return comments
+
+    def cursors(self, comments):
+        """Return the prev and next cursors for the page of ``query``."""
+        return _page_cursors(comments, self.has_more, 0, self.cursor)
+
+    def count(self):
+        return _cached_count(("comments", self.article.id), self.select())
 
     def add(self, body, author):
         comment = Comment(body=body, author=author, article=self.article)
@@ -79,5 +282,27 @@ class CommentCollection:
 
 
 class TagCollection:
+    def __init__(self, limit=0):
+        self.limit = limit
+
     def query(self):
-        return Tag.select().sort_by(Tag.tagname)[:]
+        """Return ``(tagname, articles_count)`` pairs.
+
+        With a limit these are the most used tags, otherwise all tags in
+        alphabetical order. The result is cached until tags of articles
+        change.
+        """
+        tags = tag_clouds.get(self.limit)
+        if tags is None:
+            if self.limit:
+                query = select(
+                    (t.tagname, t.articles_count) for t in Tag if t.articles_count > 0
+                ).sort_by(lambda name, count: (desc(count), name))
+                tags = query.limit(self.limit)
+            else:
+                query = select((t.tagname, t.articles_count) for t in Tag)
+                tags = query.sort_by(1)[:]
+            tags = list(tags)
+            tag_clouds.set(self.limit, tags)
+
+        return tags
@@ -1,14 +1,39 @@
 from datetime import datetime
-from slugify import UniqueSlugify
-from pony.orm import PrimaryKey, Required, Optional, Set, LongStr
+from slugify import Slugify
+from pony.orm import (
+    PrimaryKey,
+    Required,
+    Optional,
+    Set,
+    LongStr,
+    composite_index,
+    flush,
+    select,
+)
+from pony.orm.core import CacheIndexError
 
 from conduit.auth import User
+from conduit.cache import LRUCache, invalidations
 from conduit.database import db
+from . import search
+
+
+# article and comment counts by filter, cleared whenever they are written
+article_counts = LRUCache(maxsize=1024, ttl=60)
+
+# tag clouds by limit, cleared whenever the tags of articles change
+tag_clouds = LRUCache(maxsize=32, ttl=60)
+
+slugify_url = Slugify(to_lower=True, stop_words=("a", "an", "the"), max_length=200)
+
+# names of views on the article collection, which can't be used as slugs
+reserved_slugs = {"feed", "search"}
 
 
 class Article(db.Entity):
     _table_ = "articles"
 
+    id = PrimaryKey(int, auto=True)
     slug = Optional(str, 200, unique=True, nullable=True, default=None)
     title = Required(str, 255)
     description = Required(LongStr)
@@ -17,50 +42,153 @@ class Article(db.Entity):
     updated_at = Required(datetime, 0, default=datetime.utcnow)
     author = Required(User, reverse="articles")
     favorited = Set(User, reverse="favorites")
+    favorites_count = Required(int, default=0, volatile=True)
     comments = Set("Comment")
     tag_list = Set("Tag")
+    timeline_entries = Set("TimelineEntry")
+    composite_index(created_at, id)
 
-    def _unique_check(self, text, uids):
-        if text in uids:
-            return False
-        return not self.__class__.exists(slug=text)
+    @classmethod
+    def colliding_slugs(cls, slug):
+        """Return the query of ``slug`` and the slugs numbering it.
 
-    def _slugify_url_unique(self, text):
-        slugify_url_unique = UniqueSlugify(
-            unique_check=self._unique_check, uids=["feed"]
-        )
-        slugify_url_unique.to_lower = True
-        slugify_url_unique.stop_words = ("a", "an", "the")
-        slugify_url_unique.max_length = 200
-        return slugify_url_unique(text)
+        The numbered slugs are matched by the range of strings starting with
+        ``slug + "-"``, as "." follows "-". Unlike a LIKE pattern passed as
+        parameter the range is searched in the index of the slugs.
+        """
+        first, after = slug + "-", slug + "."
+        return select(
+            a.slug
+            for a in cls
+            if a.slug == slug or (a.slug >= first and a.slug < after)
+        ).without_distinct()
+
+    def _set_unique_slug(self, text):
+        """Set a unique slug for ``text``.
+
+        All slugs colliding with the slug of ``text`` are fetched with one
+        query and the first free numbered suffix is appended. If a
+        concurrent transaction takes the same slug, the unique constraint
+        fails and the transaction is retried.
+        """
+        slug = slugify_url(text)
+        taken = set(self.colliding_slugs(slug))
+        # the article can keep its own slug
+        taken.discard(self.slug)
+        taken |= reserved_slugs
+
+        unique_slug = slug
+        count = 0
+        while True:
+            if unique_slug not in taken:
+                try:
+                    self.slug = unique_slug
+                    return
+                except CacheIndexError:
+                    # taken by an article of this transaction not yet stored
+                    pass
+            count += 1
+            unique_slug = "{}-{}".format(slug, count)
 
     def before_insert(self):
         if not self.slug:
-            self.slug = self._slugify_url_unique(self.title)
+            self._set_unique_slug(self.title)
+
+    def after_insert(self):
+        invalidations.clear(article_counts)
+        search.index_article(self)
 
     def before_update(self):
-        self.updated_at = datetime.utcnow()
+        if getattr(self, "_text_changed", False):
+            self._text_changed = False
+            search.index_article(self)
+
+    def before_delete(self):
+        search.unindex_article(self.id)
+
+    def after_delete(self):
+        invalidations.clear(article_counts)
 
     def update(self, payload={}):
         update_payload = {}
         for attribute, value in payload.items():
             if attribute == "tagList":
-                tags = []
-                for tagname in value:
-                    tag = Tag.get(tagname=tagname)
-                    if not tag:
-                        tag = Tag(tagname=tagname)
-                    tags.append(tag)
+                tags = Tag.get_or_create(value)
+                Tag.update_usage(set(self.tag_list) - set(tags), -1)
+                Tag.update_usage(set(tags) - set(self.tag_list), 1)
+                # the counts of the articles by tag change
+                invalidations.clear(article_counts)
                 update_payload["tag_list"] = tags
             else:
                 update_payload[attribute] = value
 
             if attribute == "title" and value != self.title:
-                self.slug = self._slugify_url_unique(value)
+                self._set_unique_slug(value)
 
+        self.updated_at = datetime.utcnow()
         self.set(**update_payload)
+        # other updates, like favorites, don't touch the search index
+        if {"title", "description", "body"} & set(payload):
+            self._text_changed = True
+
+    def _update_favorites_count(self, delta):
+        """Add ``delta`` to the favorites count and reload it.
+
+        The count is changed in the database directly, so concurrent
+        favorites of a popular article don't conflict.
+        """
+        quote_name = db.provider.quote_name
+        db.execute(
+            "UPDATE {articles} SET {favorites_count} = {favorites_count} + $delta "
+            "WHERE {article_id} = $id".format(
+                articles=quote_name(self._table_),
+                favorites_count=quote_name(Article.favorites_count.column),
+                article_id=quote_name(Article.id.column),
+            ),
+            {},
+            {"delta": delta, "id": self.id},
+        )
+        # the count is volatile, so loading the article again updates it
+        Article.select(lambda a: a.id == self.id)[:]
+
+    def favorite(self, user):
+        """Add ``user`` to the favorites and keep the counter in sync."""
+        if user not in self.favorited:
+            self.favorited.add(user)
+            self._update_favorites_count(1)
+            invalidations.pop(article_counts, ("articles", None, None, user.id))
+
+    def unfavorite(self, user):
+        if user in self.favorited:
+            self.favorited.remove(user)
+            self._update_favorites_count(-1)
+            invalidations.pop(article_counts, ("articles", None, None, user.id))
+
+    @classmethod
+    def repair_favorites_counts(cls):
+        """Recompute all favorites counts from the favorites table."""
+        quote_name = db.provider.quote_name
+        db.execute(
+            "UPDATE {articles} SET {favorites_count} = ("
+            "SELECT COUNT(*) FROM {favorites} "
+            "WHERE {favorites}.{article} = {articles}.{article_id})".format(
+                articles=quote_name(cls._table_),
+                favorites_count=quote_name(cls.favorites_count.column),
+                article_id=quote_name(cls.id.column),
+                favorites=quote_name(cls.favorited.table),
+                article=quote_name(User.favorites.columns[0]),
+            )
+        )
+
+    @classmethod
+    def rebuild_search_index(cls):
+        """Recreate the full-text search index from all articles."""
+        search.rebuild_index(cls)
 
     def remove(self):
+        Tag.update_usage(self.tag_list, -1)
+        # one statement instead of Pony's cascade deleting entry by entry
+        TimelineEntry.select(lambda e: e.article == self).delete(bulk=True)
         self.delete()
 
 
@@ -73,6 +201,13 @@ class Comment(db.Entity):
     updated_at = Required(datetime, 0, default=datetime.utcnow)
     author = Required(User)
     article = Required(Article)
+    composite_index(created_at, id)
+
+    def after_insert(self):
+        invalidations.pop(article_counts, ("comments", self.article.id))
+
+    def before_delete(self):
+        invalidations.pop(article_counts, ("comments", self.article.id))
 
     def remove(self):
         self.delete()
@@ -81,5 +216,162 @@ class Comment(db.Entity):
 class Tag(db.Entity):
     _table_ = "tags"
 
-    tagname = Required(str, 255)
+    tagname = Required(str, 255, unique=True)
     articles = Set(Article)
+    articles_count = Required(int, default=0, index=True, volatile=True)
+
+    @classmethod
+    def get_or_create(cls, tagnames):
+        """Return the tags with the given names, creating the missing ones.
+
+        The existing tags are fetched with one query and the missing ones
+        are inserted with a single statement, which skips tags created
+        concurrently by another transaction.
+        """
+        tagnames = list(dict.fromkeys(tagnames))
+        if not tagnames:
+            return []
+
+        tags = {tag.tagname: tag for tag in cls.select(lambda t: t.tagname in tagnames)}
+        missing = [tagname for tagname in tagnames if tagname not in tags]
+        if missing:
+            quote_name = db.provider.quote_name
+            params = {
+                "tagname{}".format(i): tagname for i, tagname in enumerate(missing)
+            }
+            db.execute(
+                "INSERT INTO {tags} ({tagname}, {articles_count}) VALUES {values} "
+                "ON CONFLICT ({tagname}) DO NOTHING".format(
+                    tags=quote_name(cls._table_),
+                    tagname=quote_name(cls.tagname.column),
+                    articles_count=quote_name(cls.articles_count.column),
+                    values=", ".join("(${}, 0)".format(param) for param in params),
+                ),
+                {},
+                params,
+            )
+            for tag in cls.select(lambda t: t.tagname in missing):
+                tags[tag.tagname] = tag
+
+        return [tags[tagname] for tagname in tagnames]
+
+    @classmethod
+    def update_usage(cls, tags, delta):
+        """Add ``delta`` to the articles count of ``tags``.
+
+        The counts are changed in the database directly, so concurrent
+        updates of popular tags don't conflict.
+        """
+        params = {"tag{}".format(i): tag.id for i, tag in enumerate(tags)}
+        if not params:
+            return
+
+        quote_name = db.provider.quote_name
+        params["delta"] = delta
+        db.execute(
+            "UPDATE {tags} SET {articles_count} = {articles_count} + $delta "
+            "WHERE {tag_id} IN ({tag_ids})".format(
+                tags=quote_name(cls._table_),
+                articles_count=quote_name(cls.articles_count.column),
+                tag_id=quote_name(cls.id.column),
+                tag_ids=", ".join("$" + param for param in params if param != "delta"),
+            ),
+            {},
+            params,
+        )
+        invalidations.clear(tag_clouds)
+
+    @classmethod
+    def repair_articles_counts(cls):
+        """Recompute all articles counts from the article tags table."""
+        quote_name = db.provider.quote_name
+        db.execute(
+            "UPDATE {tags} SET {articles_count} = ("
+            "SELECT COUNT(*) FROM {article_tags} "
+            "WHERE {article_tags}.{tag} = {tags}.{tag_id})".format(
+                tags=quote_name(cls._table_),
+                articles_count=quote_name(cls.articles_count.column),
+                tag_id=quote_name(cls.id.column),
+                article_tags=quote_name(cls.articles.table),
+                tag=quote_name(Article.tag_list.columns[0]),
+            )
+        )
+        invalidations.clear(tag_clouds)
+
+
+class TimelineEntry(db.Entity):
+    """An article in the feed of a follower of its author.
+
+    The timeline is filled when articles are created, so reading a feed
+    only needs the entries of one user instead of joining the articles
+    with the whole follow graph.
+    """
+
+    _table_ = "timeline"
+
+    user = Required(User)
+    article = Required(Article)
+    # copied from the article, so a feed page is a range scan of the index
+    created_at = Required(datetime, 0)
+    PrimaryKey(user, article)
+    composite_index(user, created_at, article)
+
+    @staticmethod
+    def _sql_names():
+        quote_name = db.provider.quote_name
+        return {
+            "timeline": quote_name(TimelineEntry._table_),
+            "user": quote_name(TimelineEntry.user.column),
+            "article": quote_name(TimelineEntry.article.column),
+            "articles": quote_name(Article._table_),
+            "article_id": quote_name(Article.id.column),
+            "created_at": quote_name(TimelineEntry.created_at.column),
+            "article_created_at": quote_name(Article.created_at.column),
+            "author": quote_name(Article.author.column),
+            "follows": quote_name(User.follows.table),
+            "follower": quote_name(User.followers.columns[0]),
+            "followed": quote_name(User.follows.columns[0]),
+        }
+
+    @classmethod
+    def fan_out(cls, article):
+        """Add a new article to the timelines of the author's followers."""
+        flush()
+        db.execute(
+            "INSERT INTO {timeline} ({user}, {article}, {created_at}) "
+            "SELECT {follows}.{follower}, {articles}.{article_id}, "
+            "{articles}.{article_created_at} "
+            "FROM {articles} JOIN {follows} "
+            "ON {follows}.{followed} = {articles}.{author} "
+            "WHERE {articles}.{article_id} = $(article.id)".format(**cls._sql_names())
+        )
+
+    @classmethod
+    def backfill(cls, user, author):
+        """Add the articles of a newly followed author to the timeline."""
+        flush()
+        db.execute(
+            "INSERT INTO {timeline} ({user}, {article}, {created_at}) "
+            "SELECT $(user.id), {article_id}, {article_created_at} FROM {articles} "
+            "WHERE {author} = $(author.id)".format(**cls._sql_names())
+        )
+
+    @classmethod
+    def trim(cls, user, author):
+        """Remove the articles of an unfollowed author from the timeline."""
+        cls.select(lambda e: e.user == user and e.article.author == author).delete(
+            bulk=True
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """Recreate all timelines from the articles and the follow graph."""
+        invalidations.clear(article_counts)
+        cls.select().delete(bulk=True)
+        db.execute(
+            "INSERT INTO {timeline} ({user}, {article}, {created_at}) "
+            "SELECT {follows}.{follower}, {articles}.{article_id}, "
+            "{articles}.{article_created_at} "
+            "FROM {articles} JOIN {follows} "
+            "ON {follows}.{followed} = {articles}.{author}".format(**cls._sql_names())
+        )
@@ -1,25 +1,68 @@
 from morepath import NO_IDENTITY
-from webob.exc import HTTPUnauthorized
+from webob.exc import HTTPBadRequest, HTTPUnauthorized
 
-from conduit.auth import User
+from conduit.utils import decode_cursor
 from .app import App
-from .collection import ArticleCollection, ArticleFeed, CommentCollection, TagCollection
+from .collection import (
+    ArticleCollection,
+    ArticleFeed,
+    ArticleSearch,
+    CommentCollection,
+    TagCollection,
+)
 from .model import Article, Comment
 
 
+def _get_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPBadRequest
+
+
 @App.path(model=ArticleCollection, path="articles")
-def get_article_collection(tag="", author="", favorited="", limit=10, offset=0):
-    return ArticleCollection(tag, author, favorited, limit, offset)
+def get_article_collection(
+    app, tag="", author="", favorited="", limit=10, offset=0, cursor=""
+):
+    return ArticleCollection(
+        tag,
+        author,
+        favorited,
+        limit,
+        offset,
+        _get_cursor(cursor),
+        timeline=app.settings.feed.timeline,
+    )
 
 
 @App.path(model=ArticleFeed, path="articles/feed")
-def get_article_feed(request, limit=10, offset=0):
-    current_user = request.identity
-    if current_user == NO_IDENTITY:
+def get_article_feed(app, request, limit=10, offset=0, cursor=""):
+    if request.identity == NO_IDENTITY:
         raise HTTPUnauthorized
-    user = User.get(email=current_user.userid)
 
-    return ArticleFeed(user, limit, offset)
+    return ArticleFeed(
+        request.current_user,
+        limit,
+        offset,
+        _get_cursor(cursor),
+        timeline=app.settings.feed.timeline,
+    )
+
+
+@App.path(model=ArticleSearch, path="articles/search")
+def get_article_search(app, q="", limit=0, offset=0):
+    if offset < 0:
+        raise HTTPBadRequest
+
+    settings = app.settings.search
+    # the page size is bounded, so one request can't load all matches
+    if limit <= 0:
+        limit = settings.limit
+    limit = min(limit, settings.max_limit)
+
+    return ArticleSearch(q, limit, offset)
 
 
 @App.path(model=Article, path="articles/{slug}")
@@ -28,21 +71,28 @@ def get_article(slug=""):
 
 
 @App.path(model=CommentCollection, path="articles/{slug}/comments")
-def get_comment_collection(slug=""):
+def get_comment_collection(app, slug="", limit=0, cursor=""):
     article = Article.get(slug=slug)
     if not article:
         return None
-    return CommentCollection(article)
+
+    settings = app.settings.comments
+    # the page size is bounded, so one request can't load all comments
+    if limit <= 0:
+        limit = settings.limit
+    limit = min(limit, settings.max_limit)
+
+    return CommentCollection(article, limit, _get_cursor(cursor))
 
 
 @App.path(model=Comment, path="articles/{slug}/comments/{id}")
 def get_comment(slug="", id=0):
-    article = Article.get(slug=slug)
-    if not article or not Comment.exists(id=id):
-        return None
-    return Comment[id]
+    return Comment.select(lambda c: c.id == id and c.article.slug == slug).first()
 
 
 @App.path(model=TagCollection, path="tags")
-def get_tag_collection():
-    return TagCollection()
+def get_tag_collection(limit=0):
+    if limit < 0:
+        raise HTTPBadRequest
+
+    return TagCollection(limit)
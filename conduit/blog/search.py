@@ -0,0 +1,145 @@
+"""Full-text search of the articles.
+
+SQLite keeps the index in an FTS5 table, Postgres in a table of
+``tsvector`` documents with a GIN index. Both are kept in sync by the
+insert and delete hooks and the ``update`` method of
+:class:`conduit.blog.model.Article`.
+"""
+import re
+
+from pony.orm import db_session
+
+from conduit.database import db
+
+TABLE = "article_search"
+
+# the title weighs more than the description, which weighs more than the body
+_SQLITE = {
+    "create": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+        "USING fts5(title, description, body, tokenize='porter unicode61')"
+    ],
+    "remove": "DELETE FROM {table} WHERE rowid = $id",
+    "add": "INSERT INTO {table} (rowid, title, description, body) "
+    "VALUES ($id, $title, $description, $body)",
+    "search": "SELECT rowid FROM {table} WHERE {table} MATCH $query "
+    "ORDER BY bm25({table}, 10.0, 5.0, 1.0), rowid DESC "
+    "LIMIT $limit OFFSET $offset",
+    "count": "SELECT COUNT(*) FROM {table} WHERE {table} MATCH $query",
+    "rebuild": "INSERT INTO {table} (rowid, title, description, body) "
+    "SELECT {id}, {title}, {description}, {body} FROM {articles}",
+}
+
+_DOCUMENT = (
+    "setweight(to_tsvector('english', {title}), 'A') "
+    "|| setweight(to_tsvector('english', {description}), 'B') "
+    "|| setweight(to_tsvector('english', {body}), 'C')"
+)
+
+_POSTGRES = {
+    "create": [
+        "CREATE TABLE IF NOT EXISTS {table} "
+        "(article INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_{table}__document "
+        "ON {table} USING GIN (document)",
+    ],
+    "remove": "DELETE FROM {table} WHERE article = $id",
+    "add": "INSERT INTO {table} (article, document) VALUES ($id, "
+    + _DOCUMENT.format(title="$title", description="$description", body="$body")
+    + ") ON CONFLICT (article) DO UPDATE SET document = EXCLUDED.document",
+    "search": "SELECT article FROM {table}, plainto_tsquery('english', $query) q "
+    "WHERE document @@ q ORDER BY ts_rank(document, q) DESC, article DESC "
+    "LIMIT $limit OFFSET $offset",
+    "count": "SELECT COUNT(*) FROM {table} "
+    "WHERE document @@ plainto_tsquery('english', $query)",
+    "rebuild": "INSERT INTO {table} (article, document) SELECT {id}, "
+    + _DOCUMENT
+    + " FROM {articles}",
+}
+
+
+def _statements():
+    if db.provider.dialect == "PostgreSQL":  # pragma: no cover
+        return _POSTGRES
+    return _SQLITE
+
+
+def _sql(name):
+    return _statements()[name].format(table=TABLE)
+
+
+def _match_query(text):
+    """Return the FTS5 query matching all words of ``text``."""
+    if db.provider.dialect == "PostgreSQL":  # pragma: no cover
+        return text
+    return " ".join('"{}"'.format(word) for word in re.findall(r"\w+", text))
+
+
+def create_index():
+    for sql in _statements()["create"]:
+        db.execute(sql.format(table=TABLE))
+
+
+def index_article(article):
+    """Add ``article`` to the index or replace its entry."""
+    params = {
+        "id": article.id,
+        "title": article.title,
+        "description": article.description,
+        "body": article.body,
+    }
+    if db.provider.dialect != "PostgreSQL":
+        # FTS5 has no upsert
+        db.execute(_sql("remove"), {}, params)
+    db.execute(_sql("add"), {}, params)
+
+
+def rebuild_index(entity):
+    """Recreate the index from all rows of the article ``entity``.
+
+    The rows are copied with a single statement, so this is fast even for
+    the millions of articles of a bulk load.
+    """
+    quote_name = db.provider.quote_name
+    clear_index()
+    db.execute(
+        _statements()["rebuild"].format(
+            table=TABLE,
+            articles=quote_name(entity._table_),
+            id=quote_name(entity.id.column),
+            title=quote_name(entity.title.column),
+            description=quote_name(entity.description.column),
+            body=quote_name(entity.body.column),
+        )
+    )
+
+
+def unindex_article(article_id):
+    db.execute(_sql("remove"), {}, {"id": article_id})
+
+
+def clear_index():
+    db.execute("DELETE FROM {}".format(TABLE))
+
+
+def search(text, limit, offset):
+    """Return the ids of the articles matching ``text``, best first."""
+    query = _match_query(text)
+    if not query:
+        return []
+
+    params = {"query": query, "limit": limit, "offset": offset}
+    return db.select(_sql("search"), {}, params)
+
+
+def count(text):
+    query = _match_query(text)
+    if not query:
+        return 0
+
+    return db.select(_sql("count"), {}, {"query": query})[0]
+
+
+def setup_search(app):
+    with db_session:
+        create_index()
@@ -1,58 +1,258 @@
-import yaml
+from collections import defaultdict
 
+from morepath import NO_IDENTITY
 from more.cerberus import loader
+from pony.orm import select
+from webob import Response
 
+from conduit.conditional import etag_not_modified, not_modified
 from conduit.permissions import EditPermission
 from conduit.auth import User
-from conduit.utils import datetime_to_isoformat
+from conduit.auth.model import Profile
+from conduit.cache import invalidations
+from conduit.utils import datetime_to_isoformat, load_yaml
 from .app import App
-from .collection import ArticleCollection, ArticleFeed, CommentCollection, TagCollection
-from .model import Article, Comment
+from .collection import (
+    ArticleCollection,
+    ArticleFeed,
+    ArticleSearch,
+    CommentCollection,
+    TagCollection,
+)
+from .model import Article, Comment, TimelineEntry, article_counts
 
 
-with open("conduit/blog/schema.yml") as schema:
-    schema = yaml.safe_load(schema)
+schema = load_yaml("conduit.blog", "schema.yml")
 
 article_validator = loader(schema["article"])
 comment_validator = loader(schema["comment"])
 
 
-def _dump_article_json(article, current_user=None):
+def _article_json(article, tag_list, favorited, favorites_count, following):
     return {
-        "article": {
-            "slug": article.slug,
-            "title": article.title,
-            "description": article.description,
-            "body": article.body,
-            "tagList": [tag.tagname for tag in article.tag_list],
-            "createdAt": datetime_to_isoformat(article.created_at),
-            "updatedAt": datetime_to_isoformat(article.updated_at),
-            "favorited": current_user in article.favorited if current_user else False,
-            "favoritesCount": len(article.favorited),
-            "author": {
-                "username": article.author.username,
-                "bio": article.author.bio,
-                "image": article.author.image,
-                "following": current_user in article.author.followers
-                if current_user
-                else False,
-            },
-        }
+        "slug": article.slug,
+        "title": article.title,
+        "description": article.description,
+        "body": article.body,
+        "tagList": tag_list,
+        "createdAt": datetime_to_isoformat(article.created_at),
+        "updatedAt": datetime_to_isoformat(article.updated_at),
+        "favorited": favorited,
+        "favoritesCount": favorites_count,
+        "author": {
+            "username": article.author.username,
+            "bio": article.author.bio,
+            "image": article.author.image,
+            "following": following,
+        },
     }
 
 
+def _article_version(article):
+    return (
+        article.id,
+        article.updated_at,
+        article.favorites_count,
+        article.author.username,
+        article.author.bio,
+        article.author.image,
+    )
+
+
+def _article_flags(article, current_user):
+    """Return whether the current user favorited the article and follows
+    its author."""
+    if not current_user:
+        return False, False
+
+    return current_user in article.favorited, current_user in article.author.followers
+
+
+def _dump_article_json(article, current_user=None, flags=None):
+    favorited, following = flags or _article_flags(article, current_user)
+
+    return {
+        "article": _article_json(
+            article,
+            tag_list=[tag.tagname for tag in article.tag_list],
+            favorited=favorited,
+            favorites_count=article.favorites_count,
+            following=following,
+        )
+    }
+
+
+def _articles_flags(articles, current_user):
+    """Return the ids of the articles favorited by the current user and of
+    the authors followed by them, with one query each."""
+    if not articles or not current_user:
+        return set(), set()
+
+    article_ids = [article.id for article in articles]
+    author_ids = list({article.author.id for article in articles})
+    favorited = set(
+        select(
+            a.id for a in Article if a.id in article_ids and current_user in a.favorited
+        )
+    )
+    following = set(
+        select(u.id for u in User if u.id in author_ids and current_user in u.followers)
+    )
+
+    return favorited, following
+
+
+def _articles_not_modified(request, articles, count, current_user, flags):
+    favorited, following = flags
+    version = (
+        count,
+        [_article_version(article) for article in articles],
+        current_user.id if current_user else None,
+        sorted(favorited),
+        sorted(following),
+    )
+    last_modified = max((article.updated_at for article in articles), default=None)
+
+    return not_modified(request, version, last_modified)
+
+
+def _dump_articles_json(articles, current_user=None, flags=None):
+    """Serialize a page of articles with a fixed number of queries.
+
+    Tags, author profiles and the flags depending on the current user are
+    loaded for the whole page at once instead of per row.
+    """
+    if not articles:
+        return []
+
+    article_ids = [article.id for article in articles]
+
+    tag_lists = defaultdict(list)
+    for article_id, tagname in select(
+        (a.id, t.tagname) for a in Article for t in a.tag_list if a.id in article_ids
+    ):
+        tag_lists[article_id].append(tagname)
+
+    favorited, following = flags or _articles_flags(articles, current_user)
+
+    return [
+        _article_json(
+            article,
+            tag_list=tag_lists[article.id],
+            favorited=article.id in favorited,
+            favorites_count=article.favorites_count,
+            following=article.author.id in following,
+        )
+        for article in articles
+    ]
+
+
+def _articles_cache_key(collection, request):
+    """Return the response cache key of an article list request.
+
+    Only anonymous requests are cached, for others ``None`` is returned.
+    The key is built from the parsed parameters, so the order of the query
+    parameters and omitted defaults don't matter.
+    """
+    if request.identity != NO_IDENTITY:
+        return None
+
+    return (
+        collection.tag.id if collection.tag else None,
+        collection.author.id if collection.author else None,
+        collection.favorited.id if collection.favorited else None,
+        collection.limit,
+        collection.offset,
+        collection.cursor,
+    )
+
+
+def _cached_articles_response(request, key):
+    cached = request.app.article_responses.get(key)
+    if cached is None:
+        return None
+
+    body, etag, last_modified = cached
+    response = etag_not_modified(request, etag, last_modified)
+    if response is None:
+        response = Response(body=body, content_type="application/json")
+    response.headers["X-Cache"] = "HIT"
+
+    return response
+
+
+def _store_articles_response(request, key):
+    @request.after
+    def store(response):
+        response.headers["X-Cache"] = "MISS"
+        if response.status_code == 200:
+            request.app.article_responses.set(
+                key, (response.body, response.etag, response.last_modified)
+            )
+
+
 @App.json(model=ArticleCollection)
 def article_collection_default(self, request):
-    articles = [request.view(article)["article"] for article in self.query()]
+    cache_key = _articles_cache_key(self, request)
+    if cache_key is not None:
+        response = _cached_articles_response(request, cache_key)
+        if response is not None:
+            return response
+
+    articles = self.query()
+    count = self.count()
+    current_user = request.current_user
+    flags = _articles_flags(articles, current_user)
+    response = _articles_not_modified(request, articles, count, current_user, flags)
+    if cache_key is not None:
+        # registered after the validators, so that they are stored too
+        _store_articles_response(request, cache_key)
+    if response is not None:
+        return response
+
+    prev_cursor, next_cursor = self.cursors(articles)
 
-    return {"articles": articles, "articlesCount": len(articles)}
+    return {
+        "articles": _dump_articles_json(articles, flags=flags),
+        "articlesCount": count,
+        "prevCursor": prev_cursor,
+        "nextCursor": next_cursor,
+    }
 
 
 @App.json(model=ArticleFeed)
 def article_feed_default(self, request):
-    articles = [request.view(article)["article"] for article in self.query()]
+    articles = self.query()
+    count = self.count()
+    flags = _articles_flags(articles, self.user)
+    response = _articles_not_modified(request, articles, count, self.user, flags)
+    if response is not None:
+        return response
+
+    prev_cursor, next_cursor = self.cursors(articles)
+
+    return {
+        "articles": _dump_articles_json(articles, flags=flags),
+        "articlesCount": count,
+        "prevCursor": prev_cursor,
+        "nextCursor": next_cursor,
+    }
+
+
+@App.json(model=ArticleSearch)
+def article_search_default(self, request):
+    articles = self.query()
+    count = self.count()
+    current_user = request.current_user
+    flags = _articles_flags(articles, current_user)
+    response = _articles_not_modified(request, articles, count, current_user, flags)
+    if response is not None:
+        return response
 
-    return {"articles": articles, "articlesCount": len(articles)}
+    return {
+        "articles": _dump_articles_json(articles, flags=flags),
+        "articlesCount": count,
+    }
 
 
 @App.json(
@@ -67,7 +267,7 @@ def article_add(self, request, json):
     description = a["description"]
     body = a["body"]
     tag_list = a.get("tagList", [])
-    current_user = User.get(email=request.identity.userid)
+    current_user = request.current_user
 
     article = self.add(
         title=title,
@@ -76,6 +276,7 @@ def article_add(self, request, json):
         author=current_user,
         tag_list=tag_list,
     )
+    request.app.clear_article_responses()
 
     @request.after
     def remember(response):
@@ -86,12 +287,17 @@ def article_add(self, request, json):
 
 @App.json(model=Article)
 def article_default(self, request):
-    try:
-        current_user = User.get(email=request.identity.userid)
-    except ValueError:
-        current_user = None
+    current_user = request.current_user
+    flags = _article_flags(self, current_user)
+    version = (
+        _article_version(self),
+        current_user.id if current_user else None,
+    ) + flags
+    response = not_modified(request, version, self.updated_at)
+    if response is not None:
+        return response
 
-    return _dump_article_json(self, current_user)
+    return _dump_article_json(self, flags=flags)
 
 
 @App.json(
@@ -102,7 +308,8 @@ def article_default(self, request):
 )
 def article_update(self, request, json):
     self.update(json["article"])
-    current_user = User.get(email=request.identity.userid)
+    request.app.clear_article_responses()
+    current_user = request.current_user
 
     return _dump_article_json(self, current_user)
 
@@ -110,15 +317,16 @@ def article_update(self, request, json):
 @App.json(model=Article, request_method="DELETE", permission=EditPermission)
 def article_remove(self, request):
     self.remove()
+    request.app.clear_article_responses()
 
 
 @App.json(
     model=Article, name="favorite", request_method="POST", permission=EditPermission
 )
 def article_favorite(self, request):
-    current_user = User.get(email=request.identity.userid)
-    if current_user not in self.favorited:
-        self.favorited.add(current_user)
+    current_user = request.current_user
+    self.favorite(current_user)
+    request.app.clear_article_responses()
 
     return _dump_article_json(self, current_user)
 
@@ -127,35 +335,83 @@ def article_favorite(self, request):
     model=Article, name="favorite", request_method="DELETE", permission=EditPermission
 )
 def article_unfavorite(self, request):
-    current_user = User.get(email=request.identity.userid)
-    if current_user in self.favorited:
-        self.favorited.remove(current_user)
+    current_user = request.current_user
+    self.unfavorite(current_user)
+    request.app.clear_article_responses()
 
     return _dump_article_json(self, current_user)
 
 
-def _dump_comment_json(comment, current_user=None):
+def _comment_json(comment, following):
     return {
-        "comment": {
-            "id": comment.id,
-            "body": comment.body,
-            "createdAt": datetime_to_isoformat(comment.created_at),
-            "updatedAt": datetime_to_isoformat(comment.updated_at),
-            "author": {
-                "username": comment.author.username,
-                "bio": comment.author.bio,
-                "image": comment.author.image,
-                "following": current_user in comment.author.followers
-                if current_user
-                else False,
-            },
-        }
+        "id": comment.id,
+        "body": comment.body,
+        "createdAt": datetime_to_isoformat(comment.created_at),
+        "updatedAt": datetime_to_isoformat(comment.updated_at),
+        "author": {
+            "username": comment.author.username,
+            "bio": comment.author.bio,
+            "image": comment.author.image,
+            "following": following,
+        },
     }
 
 
+def _dump_comment_json(comment, current_user=None):
+    following = current_user in comment.author.followers if current_user else False
+
+    return {"comment": _comment_json(comment, following)}
+
+
+def _comments_following(comments, current_user):
+    """Return the ids of the comment authors followed by the current user."""
+    if not comments or not current_user:
+        return set()
+
+    author_ids = list({comment.author.id for comment in comments})
+
+    return set(
+        select(u.id for u in User if u.id in author_ids and current_user in u.followers)
+    )
+
+
 @App.json(model=CommentCollection)
 def comment_collection_default(self, request):
-    return {"comments": [request.view(comment)["comment"] for comment in self.query()]}
+    comments = self.query()
+    count = self.count()
+    current_user = request.current_user
+    following = _comments_following(comments, current_user)
+    version = (
+        count,
+        [
+            (
+                comment.id,
+                comment.updated_at,
+                comment.author.username,
+                comment.author.bio,
+                comment.author.image,
+            )
+            for comment in comments
+        ],
+        current_user.id if current_user else None,
+        sorted(following),
+    )
+    last_modified = max((comment.updated_at for comment in comments), default=None)
+    response = not_modified(request, version, last_modified)
+    if response is not None:
+        return response
+
+    prev_cursor, next_cursor = self.cursors(comments)
+
+    return {
+        "comments": [
+            _comment_json(comment, comment.author.id in following)
+            for comment in comments
+        ],
+        "commentsCount": count,
+        "prevCursor": prev_cursor,
+        "nextCursor": next_cursor,
+    }
 
 
 @App.json(
@@ -167,9 +423,10 @@ def comment_collection_default(self, request):
 def comment_add(self, request, json):
     c = json["comment"]
     body = c["body"]
-    current_user = User.get(email=request.identity.userid)
+    current_user = request.current_user
 
     comment = self.add(body=body, author=current_user)
+    request.app.clear_article_responses()
 
     @request.after
     def remember(response):
@@ -180,19 +437,63 @@ def comment_add(self, request, json):
 
 @App.json(model=Comment, internal=True)
 def comment_default(self, request):
-    try:
-        current_user = User.get(email=request.identity.userid)
-    except ValueError:
-        current_user = None
-
-    return _dump_comment_json(self, current_user)
+    return _dump_comment_json(self, request.current_user)
 
 
 @App.json(model=Comment, request_method="DELETE", permission=EditPermission)
 def comment_remove(self, request):
     self.remove()
+    request.app.clear_article_responses()
+
+
+def _dump_profile_json(profile, following):
+    return {
+        "profile": {
+            "username": profile.profile.username,
+            "bio": profile.profile.bio,
+            "image": profile.profile.image,
+            "following": following,
+        }
+    }
+
+
+# following changes the feed, so the views are part of the blog
+@App.json(
+    model=Profile, name="follow", request_method="POST", permission=EditPermission
+)
+def profile_follow(self, request):
+    current_user = request.current_user
+    if current_user not in self.profile.followers:
+        self.profile.followers.add(current_user)
+        invalidations.pop(article_counts, ("feed", current_user.id))
+        if request.app.settings.feed.timeline:
+            TimelineEntry.backfill(current_user, self.profile)
+
+    return _dump_profile_json(self, True)
+
+
+@App.json(
+    model=Profile, name="follow", request_method="DELETE", permission=EditPermission
+)
+def profile_unfollow(self, request):
+    current_user = request.current_user
+    if current_user in self.profile.followers:
+        self.profile.followers.remove(current_user)
+        invalidations.pop(article_counts, ("feed", current_user.id))
+        if request.app.settings.feed.timeline:
+            TimelineEntry.trim(current_user, self.profile)
+
+    return _dump_profile_json(self, False)
 
 
 @App.json(model=TagCollection)
 def tag_collection_default(self, request):
-    return {"tags": [tag.tagname for tag in self.query()]}
+    tags = self.query()
+    response = not_modified(request, tags)
+    if response is not None:
+        return response
+
+    return {
+        "tags": [tagname for tagname, count in tags],
+        "tagCounts": dict(tags),
+    }
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import pickle
+import sqlite3
+from threading import Lock, local
+from time import monotonic, time
+
+
+class LRUCache:
+    """Bounded in-memory cache dropping the least recently used entries.
+
+    With a ``ttl`` (in seconds) entries expire, which bounds how long a
+    worker can serve a value that was invalidated in another worker.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < monotonic()):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+
+        expires = monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """Cache stored in a local SQLite file, shared by all worker processes.
+
+    Has the same interface as :class:`LRUCache`. Values are pickled, so
+    the file must only be writable by the application. When the cache
+    grows beyond ``maxsize`` the oldest entries are dropped.
+    """
+
+    def __init__(self, path, maxsize=128, ttl=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, stored REAL, expires REAL)"
+            )
+
+    def _connect(self):
+        # connections can't be shared between threads or forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key, default=None):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value FROM cache WHERE key = ? "
+                "AND (expires IS NULL OR expires >= ?)",
+                (repr(key), time()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+
+        now = time()
+        expires = now + self.ttl if self.ttl else None
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (repr(key), pickle.dumps(value), now, expires),
+            )
+            connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                "ORDER BY stored DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def pop(self, key):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM cache WHERE key = ?", (repr(key),))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM cache")
+
+
+class Invalidations:
+    """Drops cache entries once the transaction writing them commits.
+
+    Within :meth:`deferred`, which the app wraps around the transaction of
+    each request, the entries are collected and dropped when it ends.
+    Dropped before the commit, a concurrent request could cache the old
+    values again until they expire. Outside of it they are dropped at once.
+    """
+
+    def __init__(self):
+        self._local = local()
+
+    def _pending(self):
+        return getattr(self._local, "pending", None)
+
+    @contextmanager
+    def deferred(self):
+        if self._pending() is not None:
+            yield
+            return
+
+        self._local.pending = []
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            for cache, key in pending:
+                if key is None:
+                    cache.clear()
+                else:
+                    cache.pop(key)
+
+    def clear(self, cache):
+        pending = self._pending()
+        if pending is None:
+            cache.clear()
+        else:
+            pending.append((cache, None))
+
+    def pop(self, cache, key):
+        pending = self._pending()
+        if pending is None:
+            cache.pop(key)
+        else:
+            pending.append((cache, key))
+
+
+invalidations = Invalidations()
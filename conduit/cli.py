@@ -0,0 +1,168 @@
+"""Maintenance commands for conduit.
+
+The commands use the settings of the App selected by ``RUN_ENV``.
+"""
+import argparse
+
+import morepath
+from pony.orm import db_session
+
+import conduit
+from conduit.app import get_app_class
+from conduit.blog.model import Article, Tag, TimelineEntry
+from conduit.blog.search import setup_search
+from conduit.database import setup_db
+from conduit.dataset import DatasetGenerator, hash_password, load_dataset
+from conduit.startup import measure_startup
+from conduit.upgrade import upgrade
+
+
+def at_least(minimum):
+    """Return an argument type parsing integers not below ``minimum``."""
+
+    def parse(value):
+        number = int(value)
+        if minimum is not None and number < minimum:
+            raise argparse.ArgumentTypeError(
+                "{} is less than {}".format(number, minimum)
+            )
+        return number
+
+    return parse
+
+
+def setup_app():  # pragma: no cover
+    morepath.scan(conduit, ignore=[".run", ".tests"])
+
+    app_class = get_app_class()
+    app_class.commit()
+    app = app_class()
+
+    setup_db(app)
+    setup_search(app)
+
+    return app
+
+
+@db_session
+def rebuild_timeline(args):
+    TimelineEntry.rebuild()
+
+
+@db_session
+def repair_favorites_counts(args):
+    Article.repair_favorites_counts()
+
+
+@db_session
+def repair_tag_counts(args):
+    Tag.repair_articles_counts()
+
+
+@db_session
+def rebuild_search_index(args):
+    Article.rebuild_search_index()
+
+
+def generate(args):
+    generator = DatasetGenerator(
+        users=args.users,
+        articles=args.articles,
+        comments=args.comments,
+        favorites=args.favorites,
+        follows=args.follows,
+        tags=args.tags,
+        days=args.days,
+        password_hash=hash_password(args.password),
+        seed=args.seed,
+    )
+    load_dataset(generator, args.batch_size, timeline=args.timeline)
+
+
+def upgrade_database(args):  # pragma: no cover
+    # the app isn't set up, Pony would reject the tables before the upgrade
+    app_class = get_app_class()
+    app_class.commit()
+    upgrade(app_class().settings.database.__dict__.copy())
+
+
+def startup_report(args):  # pragma: no cover
+    print(measure_startup(args.imports))
+
+
+def main(argv=None):  # pragma: no cover
+    parser = argparse.ArgumentParser(prog="conduit", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_timeline_parser = subparsers.add_parser(
+        "rebuild-timeline",
+        help="recreate the feed timelines from the articles and follows",
+    )
+    rebuild_timeline_parser.set_defaults(func=rebuild_timeline)
+
+    repair_favorites_counts_parser = subparsers.add_parser(
+        "repair-favorites-counts",
+        help="recompute the favorites counts of the articles",
+    )
+    repair_favorites_counts_parser.set_defaults(func=repair_favorites_counts)
+
+    repair_tag_counts_parser = subparsers.add_parser(
+        "repair-tag-counts",
+        help="recompute the number of articles using each tag",
+    )
+    repair_tag_counts_parser.set_defaults(func=repair_tag_counts)
+
+    rebuild_search_index_parser = subparsers.add_parser(
+        "rebuild-search-index",
+        help="recreate the full-text search index of the articles",
+    )
+    rebuild_search_index_parser.set_defaults(func=rebuild_search_index)
+
+    generate_parser = subparsers.add_parser(
+        "generate",
+        help="fill the empty database with a synthetic dataset",
+    )
+    for option, default, minimum, help in [
+        ("--users", 1000, 1, "number of users"),
+        ("--articles", 5000, 0, "number of articles"),
+        ("--comments", 20000, 0, "number of comments"),
+        ("--favorites", 20000, 0, "approximate number of favorites"),
+        ("--follows", 20, 0, "average number of users a user follows"),
+        ("--tags", 200, 0, "number of tags"),
+        ("--days", 365, 0, "the articles are spread over this many days"),
+        ("--batch-size", 10000, 1, "number of rows inserted per transaction"),
+        ("--seed", 0, None, "seed of the random generator"),
+    ]:
+        generate_parser.add_argument(
+            option, type=at_least(minimum), default=default, help=help
+        )
+    generate_parser.add_argument(
+        "--password",
+        default="conduit-password",
+        help="password of all generated users",
+    )
+    generate_parser.set_defaults(func=generate)
+
+    upgrade_database_parser = subparsers.add_parser(
+        "upgrade-database",
+        help="add the columns and indexes of this version to an existing database",
+    )
+    upgrade_database_parser.set_defaults(func=upgrade_database, setup=False)
+
+    startup_report_parser = subparsers.add_parser(
+        "startup-report",
+        help="start the app in a new process and report the startup times",
+    )
+    startup_report_parser.add_argument(
+        "--imports",
+        type=int,
+        default=10,
+        help="number of the slowest imports to list",
+    )
+    startup_report_parser.set_defaults(func=startup_report, setup=False)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "setup", True):
+        app = setup_app()
+        args.timeline = app.settings.feed.timeline
+    args.func(args)
@@ -0,0 +1,37 @@
+from hashlib import blake2b
+
+from webob import Response
+
+
+def make_etag(version):
+    """Hash a version tuple of plain values into an ETag value."""
+    return blake2b(repr(version).encode(), digest_size=16).hexdigest()
+
+
+def not_modified(request, version, last_modified=None):
+    """Add validators to the response and check the request against them.
+
+    ``version`` is a tuple of plain values that changes whenever the
+    content does, including anything that depends on the current user.
+    The response gets a weak ETag derived from it and, if given,
+    ``last_modified`` as Last-Modified.
+
+    Returns a ``304 Not Modified`` response when the ``If-None-Match``
+    header matches, which the view can return instead of serializing the
+    content. Otherwise returns ``None``.
+    """
+    return etag_not_modified(request, make_etag(version), last_modified)
+
+
+def etag_not_modified(request, etag, last_modified=None):
+    """Like :func:`not_modified` with an already computed ETag value."""
+
+    @request.after
+    def set_validators(response):
+        response.etag = (etag, False)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.vary = ("Authorization",)
+
+    if etag in request.if_none_match:
+        return Response(status=304)
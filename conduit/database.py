@@ -1,3 +1,421 @@
-from pony.orm import Database
+from contextlib import contextmanager
+import json
+import logging
+import os
+import random
+from threading import BoundedSemaphore, Lock, local
+from time import monotonic, perf_counter, time
+
+from pony.orm import Database as PonyDatabase
+from pony.orm.dbapiprovider import Pool
+
+from conduit.cache import LRUCache
+
+logger = logging.getLogger("conduit.slow_queries")
+
+_origin = local()
+
+
+@contextmanager
+def query_origin(request):
+    """Attribute the slow queries of this thread to ``request``."""
+    _origin.request = request
+    try:
+        yield
+    finally:
+        _origin.request = None
+
+
+def _origin_info():
+    request = getattr(_origin, "request", None)
+    if request is None:
+        return {}
+
+    model, view = getattr(request, "view_labels", None) or ("none", "")
+    return {
+        "method": request.method,
+        "path": request.path,
+        "model": model,
+        "view": view,
+    }
+
+
+def explain_sql(provider, sql):
+    """Return the statement showing the plan of ``sql`` or ``None``.
+
+    Postgres runs the statement for ``EXPLAIN ANALYZE``, so only the plans
+    of selects are analyzed.
+    """
+    if provider.dialect == "SQLite":
+        return "EXPLAIN QUERY PLAN " + sql
+    if provider.dialect == "PostgreSQL":  # pragma: no cover
+        if sql.lstrip().upper().startswith("SELECT"):
+            return "EXPLAIN ANALYZE " + sql
+        return "EXPLAIN " + sql
+    return None  # pragma: no cover
+
+
+class SlowQueryLog:
+    """Logs the SQL statements taking longer than ``threshold`` seconds.
+
+    The statement, its arguments, its duration and the request it ran for
+    are logged as a JSON line to the ``conduit.slow_queries`` logger. With
+    ``explain`` the query plan is added, but each statement is explained
+    at most once per ``explain_interval`` seconds.
+    """
+
+    def __init__(self, threshold=0, explain=False, explain_interval=60):
+        self.configure(threshold, explain, explain_interval)
+
+    def configure(self, threshold=0, explain=False, explain_interval=60):
+        self.threshold = threshold
+        self.explain = explain
+        self.explained = LRUCache(maxsize=1024, ttl=explain_interval)
+
+    def check(self, provider, cursor, sql, arguments, duration):
+        if not self.threshold or duration < self.threshold:
+            return
+
+        entry = {
+            "sql": sql,
+            "arguments": arguments,
+            "duration_ms": round(duration * 1000, 3),
+            **_origin_info(),
+        }
+        if self.explain and cursor is not None and type(arguments) is not list:
+            if self.explained.get(sql) is None:
+                self.explained.set(sql, True)
+                entry["plan"] = self._plan(provider, cursor.connection, sql, arguments)
+        logger.warning(json.dumps(entry, default=str))
+
+    def _plan(self, provider, con, sql, arguments):
+        explain = explain_sql(provider, sql)
+        if explain is None:  # pragma: no cover
+            return None
+
+        # the plan runs in the transaction of the request, on Postgres a
+        # failed EXPLAIN would abort it and EXPLAIN ANALYZE runs the select
+        savepoint = provider.dialect == "PostgreSQL"
+        cursor = con.cursor()
+        if savepoint:
+            cursor.execute("SAVEPOINT conduit_explain")
+        try:
+            provider.execute(cursor, explain, arguments)
+            return [str(row[-1]) for row in cursor.fetchall()]
+        except Exception as e:
+            return ["EXPLAIN failed: {}".format(e)]
+        finally:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT conduit_explain")
+                cursor.execute("RELEASE SAVEPOINT conduit_explain")
+
+
+slow_query_log = SlowQueryLog()
+
+
+class Database(PonyDatabase):
+    """Pony database passing the duration of each query to the slow query log."""
+
+    def _update_local_stat(self, sql, query_start_time):
+        self._dblocal.last_duration = time() - query_start_time
+        super()._update_local_stat(sql, query_start_time)
+
+    def _exec_sql(
+        self, sql, arguments=None, returning_id=False, start_transaction=False
+    ):
+        result = super()._exec_sql(sql, arguments, returning_id, start_transaction)
+        cursor = None if returning_id else result
+        slow_query_log.check(
+            self.provider, cursor, sql, arguments, self._dblocal.last_duration
+        )
+        return result
+
 
 db = Database()
+
+
+class PoolTimeout(Exception):
+    """Raised when no database connection became free within the timeout."""
+
+
+class _Connection:
+    def __init__(self, con):
+        self.con = con
+        self.created = self.last_used = monotonic()
+
+
+class ConnectionPool:
+    """Database connections shared by the threads of a worker process.
+
+    At most ``size`` connections are open, further requests wait up to
+    ``timeout`` seconds for a connection and then raise
+    :class:`PoolTimeout`. Connections idle for more than ``max_idle``
+    seconds or older than ``recycle`` seconds are closed instead of being
+    reused.
+    """
+
+    def __init__(self, size=0, timeout=10, max_idle=300, recycle=3600):
+        self._lock = Lock()
+        self.configure(size, timeout, max_idle, recycle)
+
+    def configure(self, size=0, timeout=10, max_idle=300, recycle=3600):
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.recycle = recycle
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._slots = BoundedSemaphore(self.size or 1)
+        self._idle = []
+        self.in_use = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.opened = 0
+        self.closed = 0
+
+    def _check_pid(self):
+        # the connections of the parent can't be used in a forked worker
+        if self._pid != os.getpid():
+            self._reset()
+
+    def acquire(self, connect):
+        """Return a ``(connection, is_new)`` tuple.
+
+        ``connect`` is called to open a new connection if no idle one can
+        be reused.
+        """
+        with self._lock:
+            self._check_pid()
+        start = perf_counter()
+        if not self._slots.acquire(blocking=False):
+            self.waits += 1
+            acquired = self._slots.acquire(timeout=self.timeout)
+            self.wait_time += perf_counter() - start
+            if not acquired:
+                self.timeouts += 1
+                raise PoolTimeout
+
+        now = monotonic()
+        with self._lock:
+            self.in_use += 1
+            while self._idle:
+                connection = self._idle.pop()
+                if (
+                    now - connection.last_used <= self.max_idle
+                    and now - connection.created <= self.recycle
+                ):
+                    return connection, False
+                self._close(connection)
+
+        try:
+            connection = _Connection(connect())
+        except Exception:
+            self._discard()
+            raise
+        self.opened += 1
+
+        return connection, True
+
+    def release(self, connection):
+        with self._lock:
+            if self._pid == os.getpid():
+                connection.last_used = monotonic()
+                self._idle.append(connection)
+                self.in_use -= 1
+                self._slots.release()
+
+    def drop(self, connection):
+        self._close(connection)
+        self._discard()
+
+    def _close(self, connection):
+        self.closed += 1
+        try:
+            connection.con.close()
+        except Exception:
+            pass
+
+    def _discard(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self.in_use -= 1
+                self._slots.release()
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "in_use": self.in_use,
+            "idle": len(self._idle),
+            "waits": self.waits,
+            "wait_time": self.wait_time,
+            "timeouts": self.timeouts,
+            "opened": self.opened,
+            "closed": self.closed,
+        }
+
+
+class PooledConnections(Pool):
+    """Pony pool taking the connections from a :class:`ConnectionPool`.
+
+    Pony keeps one connection per thread open for the lifetime of the
+    thread. This pool only holds a connection for the duration of a
+    ``db_session`` and hands it back afterwards. The provider's own pool
+    is still used to open, reset and close the connections.
+    """
+
+    def __init__(self, provider_pool, connection_pool):  # called in each thread
+        self.provider_pool = provider_pool
+        self.connection_pool = connection_pool
+        self.connection = None
+        self.con = None
+
+    def _connect(self):
+        provider_pool = self.provider_pool
+        provider_pool._connect()
+        con, provider_pool.con = provider_pool.con, None
+        return con
+
+    def connect(self):
+        if self.con is not None:
+            return self.con, False
+
+        self.connection, is_new = self.connection_pool.acquire(self._connect)
+        self.con = self.connection.con
+        return self.con, is_new
+
+    def release(self, con):
+        assert con is self.con
+        provider_pool = self.provider_pool
+        provider_pool.con = con
+        try:
+            # rolls back and resets the connection, drops it on errors
+            provider_pool.release(con)
+        except Exception:
+            self.drop(con)
+            raise
+        provider_pool.con = None
+        self.connection_pool.release(self.connection)
+        self.connection = self.con = None
+
+    def drop(self, con):
+        assert con is self.con
+        self.provider_pool.con = None
+        self.connection_pool.drop(self.connection)
+        self.connection = self.con = None
+
+    def disconnect(self):
+        if self.con is not None:
+            self.drop(self.con)
+
+
+def use_connection_pool(database, connection_pool):
+    """Let ``database`` take its connections from ``connection_pool``."""
+    # close the connection Pony opened for inspecting the database
+    database.disconnect()
+    database.provider.pool = PooledConnections(database.provider.pool, connection_pool)
+
+
+_routing = local()
+
+
+@contextmanager
+def replica_session():
+    """Route the database sessions of this thread to a replica."""
+    _routing.replica = True
+    try:
+        yield
+    finally:
+        _routing.replica = False
+
+
+def _set_read_only(con):
+    if hasattr(con, "set_session"):  # psycopg2
+        con.set_session(readonly=True)
+    else:
+        con.execute("PRAGMA query_only = ON")
+
+
+class ReplicaRouter(Pool):
+    """Pony pool routing each ``db_session`` to the primary or a replica.
+
+    Sessions started inside :func:`replica_session` get a read-only
+    connection to a randomly chosen replica, all others go to the primary.
+    """
+
+    def __init__(self, primary, replicas):  # called in each thread
+        self.primary = primary
+        self.replicas = replicas
+        self.current = None
+
+    def connect(self):
+        if self.current is None:
+            if getattr(_routing, "replica", False):
+                self.current = random.choice(self.replicas)
+            else:
+                self.current = self.primary
+
+        con, is_new = self.current.connect()
+        if is_new and self.current is not self.primary:
+            _set_read_only(con)
+        return con, is_new
+
+    def release(self, con):
+        current, self.current = self.current, None
+        current.release(con)
+
+    def drop(self, con):
+        current, self.current = self.current, None
+        current.drop(con)
+
+    def disconnect(self):
+        self.current = None
+        for pool in [self.primary] + self.replicas:
+            pool.disconnect()
+
+
+def replica_pool(params):
+    """Return a Pony pool connecting to the database in ``params``."""
+    replica = Database()
+    replica.bind(**params)
+    replica.disconnect()
+    return replica.provider.pool
+
+
+def use_replicas(database, replica_pools):
+    """Let ``database`` serve the replica sessions from ``replica_pools``."""
+    database.provider.pool = ReplicaRouter(database.provider.pool, replica_pools)
+
+
+connection_pool = ConnectionPool()
+replica_connection_pools = []
+
+
+def setup_db(app):
+    db_params = app.settings.database.__dict__.copy()
+    pool_settings = app.settings.connection_pool.__dict__
+    use_pool = pool_settings["size"] and db_params.get("filename") != ":memory:"
+    if use_pool and db_params["provider"] == "sqlite":
+        # pooled connections move between threads
+        db_params.setdefault("check_same_thread", False)
+    db.bind(**db_params)
+
+    if use_pool:
+        connection_pool.configure(**pool_settings)
+        use_connection_pool(db, connection_pool)
+
+    replica_pools = []
+    for replica_params in app.settings.replicas.databases:
+        pool = replica_pool(dict(db_params, **replica_params))
+        if use_pool:
+            replica_connection_pools.append(ConnectionPool(**pool_settings))
+            pool = PooledConnections(pool, replica_connection_pools[-1])
+        replica_pools.append(pool)
+    if replica_pools:
+        use_replicas(db, replica_pools)
+
+    db.generate_mapping(create_tables=True)
+
+    slow_query_log.configure(**app.settings.slow_queries.__dict__)
@@ -0,0 +1,368 @@
+"""Generate large synthetic datasets and bulk load them."""
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+import random
+from time import perf_counter
+
+from argon2 import PasswordHasher
+from pony.orm import commit, db_session
+
+from conduit.auth import User
+from conduit.blog.model import Article, Comment, Tag, TimelineEntry
+from conduit.database import db
+
+WORDS = (
+    "api async backend benchmark build cache change cloud code commit config "
+    "container data database debug deploy design docker error event feature "
+    "framework function git graph http index interface java javascript json "
+    "kernel lambda latency library linux log memory message migration model "
+    "module network node object performance pipeline pony python query queue "
+    "react release request response rest route rust schema security server "
+    "service session shell socket sql stack storage stream system test thread "
+    "token type update user version view web worker"
+).split()
+
+NAMES = (
+    "alex anna ben chen david elena emma felix hana ivan jan julia kim lars "
+    "lea luca maria max mia noah olga omar paul rosa sam sara tom vera yuki zoe"
+).split()
+
+
+def _zipf_cum_weights(count, exponent=1.0):
+    """Cumulative weights making low indexes much more likely."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def _choose(rng, cum_weights):
+    """Choose an index with the given cumulative weights."""
+    return bisect(cum_weights, rng.random() * cum_weights[-1])
+
+
+def _power_law_degree(rng, mean, maximum):
+    # Pareto with shape 2 has mean 2, so half the mean scales it
+    return min(maximum, int(rng.paretovariate(2) * mean / 2))
+
+
+class DatasetGenerator:
+    """Generates the rows of a synthetic dataset.
+
+    Authors, followed users, tags and favorited articles are picked from
+    power-law distributions, so a few users have most followers and a few
+    articles most favorites. With the same ``seed`` the same rows are
+    generated. All users share the password hash of ``password_hash``.
+    """
+
+    def __init__(
+        self,
+        users=1000,
+        articles=5000,
+        comments=20000,
+        favorites=20000,
+        follows=20,
+        tags=200,
+        days=365,
+        password_hash="",
+        seed=0,
+    ):
+        self.users = users
+        self.articles = articles
+        self.comments = comments
+        self.favorites = favorites
+        self.follows = follows
+        self.tags = tags
+        self.password_hash = password_hash
+        self.rng = random.Random(seed)
+        self.end = datetime.utcnow().replace(microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        # texts are picked from pools, generating each one is too slow
+        self.paragraphs = [self.sentence(40, 120) for i in range(200)]
+        self.sentences = [self.sentence(5, 40) for i in range(1000)]
+        self._popular_articles = None
+
+    def sentence(self, min_words, max_words):
+        rng = self.rng
+        words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+        return " ".join(words).capitalize() + "."
+
+    def timestamp(self, start):
+        return start + timedelta(
+            seconds=self.rng.randint(0, int((self.end - start).total_seconds()))
+        )
+
+    def user_rows(self):
+        for id in range(1, self.users + 1):
+            username = "{}{}".format(self.rng.choice(NAMES), id)
+            yield (
+                id,
+                username,
+                username + "@example.com",
+                self.password_hash,
+                self.start - timedelta(days=self.rng.randint(0, 365)),
+                self.rng.choice(self.sentences)[:300],
+                "",
+            )
+
+    def tag_rows(self):
+        names = set()
+        for id in range(1, self.tags + 1):
+            name = self.rng.choice(WORDS)
+            if name in names:
+                name = "{}-{}".format(name, self.rng.choice(WORDS))
+            if name in names:
+                name = "{}-{}".format(name, id)
+            names.add(name)
+            yield id, name, 0
+
+    def follow_rows(self):
+        """Yield ``(follower, followed)`` user ids."""
+        popularity = _zipf_cum_weights(self.users)
+        for follower in range(1, self.users + 1):
+            degree = _power_law_degree(self.rng, self.follows, self.users - 1)
+            followed = {_choose(self.rng, popularity) + 1 for i in range(degree)}
+            followed.discard(follower)
+            for id in sorted(followed):
+                yield follower, id
+
+    def article_rows(self):
+        """Yield the articles with the ids of their tags."""
+        rng = self.rng
+        authors = _zipf_cum_weights(self.users, 0.8)
+        # the most prolific authors aren't the most followed users
+        author_ids = list(range(1, self.users + 1))
+        rng.shuffle(author_ids)
+        tag_popularity = _zipf_cum_weights(self.tags)
+        step = (self.end - self.start) / max(self.articles, 1)
+        for id in range(1, self.articles + 1):
+            title = self.sentence(3, 8)[:-1]
+            created_at = self.start + step * id
+            row = (
+                id,
+                "{}-{}".format(title.lower().replace(" ", "-")[:180], id),
+                title,
+                self.sentence(8, 20),
+                "\n\n".join(rng.sample(self.paragraphs, rng.randint(2, 6))),
+                created_at,
+                created_at,
+                author_ids[_choose(rng, authors)],
+                0,
+            )
+            tag_ids = set()
+            if self.tags:
+                tag_ids = {_choose(rng, tag_popularity) + 1 for i in range(3)}
+            yield row, sorted(tag_ids)
+
+    def popular_articles(self):
+        """Return the article ids in the order of their popularity."""
+        if self._popular_articles is None:
+            self._popular_articles = list(range(1, self.articles + 1))
+            self.rng.shuffle(self._popular_articles)
+        return self._popular_articles
+
+    def favorite_rows(self):
+        """Yield ``(user, article)`` ids."""
+        popularity = _zipf_cum_weights(self.articles)
+        popular_articles = self.popular_articles()
+        mean = self.favorites / self.users
+        for user in range(1, self.users + 1):
+            degree = _power_law_degree(self.rng, mean, self.articles)
+            articles = {
+                popular_articles[_choose(self.rng, popularity)] for i in range(degree)
+            }
+            for article in sorted(articles):
+                yield user, article
+
+    def comment_rows(self):
+        rng = self.rng
+        popularity = _zipf_cum_weights(self.articles)
+        popular_articles = self.popular_articles()
+        step = (self.end - self.start) / max(self.articles, 1)
+        for id in range(1, self.comments + 1):
+            article = popular_articles[_choose(rng, popularity)]
+            created_at = self.timestamp(self.start + step * article)
+            yield (
+                id,
+                rng.choice(self.sentences),
+                created_at,
+                created_at,
+                rng.randint(1, self.users),
+                article,
+            )
+
+
+def _bulk_insert(table, columns, rows, batch_size, converters={}):
+    """Insert ``rows`` in transactions of ``batch_size`` rows."""
+    provider = db.provider
+    quote_name = provider.quote_name
+    sql = "INSERT INTO {} ({}) VALUES ".format(
+        quote_name(table), ", ".join(quote_name(column) for column in columns)
+    )
+    if provider.dialect == "PostgreSQL":  # pragma: no cover
+        from psycopg2.extras import execute_values
+
+        def insert(cursor, batch):
+            execute_values(cursor, sql + "%s", batch, page_size=batch_size)
+
+    else:
+        placeholder = "?" if provider.paramstyle == "qmark" else "%s"
+        sql += "({})".format(", ".join([placeholder] * len(columns)))
+
+        def insert(cursor, batch):
+            cursor.executemany(sql, batch)
+
+    rows = iter(rows)
+    count = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return count
+        if converters:
+            batch = [
+                tuple(
+                    converters[i](value) if i in converters else value
+                    for i, value in enumerate(row)
+                )
+                for row in batch
+            ]
+        with db_session(immediate=True):
+            insert(db.get_connection().cursor(), batch)
+            commit()
+        count += len(batch)
+
+
+def _entity_insert(entity, attrs, rows, batch_size):
+    columns = [getattr(entity, attr).column for attr in attrs]
+    converters = {
+        i: getattr(entity, attr).converters[0].val2dbval
+        for i, attr in enumerate(attrs)
+        if getattr(entity, attr).py_type is datetime
+    }
+    return _bulk_insert(entity._table_, columns, rows, batch_size, converters)
+
+
+def _set_insert(attr, rows, batch_size):
+    """Insert ``(owner, item)`` id pairs of a many-to-many ``attr``."""
+    columns = [attr.reverse.columns[0], attr.columns[0]]
+    return _bulk_insert(attr.table, columns, rows, batch_size)
+
+
+def _reset_sequences(entities):  # pragma: no cover
+    # the rows got explicit ids, so the id sequences have to catch up
+    quote_name = db.provider.quote_name
+    with db_session:
+        for entity in entities:
+            db.execute(
+                "SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                "(SELECT MAX({id}) FROM {quoted}))".format(
+                    table=entity._table_,
+                    id=quote_name(entity.id.column),
+                    quoted=quote_name(entity._table_),
+                )
+            )
+
+
+def load_dataset(generator, batch_size=10000, timeline=False, report=print):
+    """Bulk load the rows of ``generator`` into the empty database.
+
+    ``report`` is called with a progress message after each table.
+    """
+    with db_session:
+        if User.select().exists():
+            raise ValueError("The database already contains users")
+
+    def step(name, load):
+        start = perf_counter()
+        count = load()
+        report(
+            "{:<12} {:>10} rows {:>8.1f} s".format(name, count, perf_counter() - start)
+        )
+
+    def load_articles():
+        # the tags are inserted batch by batch with their articles, so they
+        # aren't all kept in memory
+        rows = generator.article_rows()
+        count = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return count
+            count += _entity_insert(
+                Article,
+                [
+                    "id",
+                    "slug",
+                    "title",
+                    "description",
+                    "body",
+                    "created_at",
+                    "updated_at",
+                    "author",
+                    "favorites_count",
+                ],
+                [row for row, tag_ids in batch],
+                batch_size,
+            )
+            _set_insert(
+                Article.tag_list,
+                [(row[0], tag_id) for row, tag_ids in batch for tag_id in tag_ids],
+                batch_size,
+            )
+
+    step(
+        "users",
+        lambda: _entity_insert(
+            User,
+            ["id", "username", "email", "password", "registered", "bio", "image"],
+            generator.user_rows(),
+            batch_size,
+        ),
+    )
+    step(
+        "follows",
+        lambda: _set_insert(User.follows, generator.follow_rows(), batch_size),
+    )
+    step(
+        "tags",
+        lambda: _entity_insert(
+            Tag, ["id", "tagname", "articles_count"], generator.tag_rows(), batch_size
+        ),
+    )
+    step("articles", load_articles)
+    step(
+        "favorites",
+        lambda: _set_insert(User.favorites, generator.favorite_rows(), batch_size),
+    )
+    step(
+        "comments",
+        lambda: _entity_insert(
+            Comment,
+            ["id", "body", "created_at", "updated_at", "author", "article"],
+            generator.comment_rows(),
+            batch_size,
+        ),
+    )
+
+    start = perf_counter()
+    with db_session:
+        Tag.repair_articles_counts()
+        Article.repair_favorites_counts()
+    if db.provider.dialect == "PostgreSQL":  # pragma: no cover
+        _reset_sequences([User, Tag, Article, Comment])
+    report("{:<28} {:>8.1f} s".format("counts", perf_counter() - start))
+
+    # the bulk inserts bypass the hooks keeping the index in sync
+    start = perf_counter()
+    with db_session:
+        Article.rebuild_search_index()
+    report("{:<28} {:>8.1f} s".format("search index", perf_counter() - start))
+
+    if timeline:
+        start = perf_counter()
+        with db_session:
+            TimelineEntry.rebuild()
+        report("{:<28} {:>8.1f} s".format("timeline", perf_counter() - start))
+
+
+def hash_password(password):
+    """Hash ``password`` once for all generated users."""
+    return PasswordHasher().hash(password)
@@ -1,6 +1,8 @@
 from more.cerberus.error import ValidationError
 
 from .app import App
+from .auth.hashing import HashingBusy
+from .database import PoolTimeout
 
 
 @App.json(model=ValidationError)
@@ -12,3 +14,23 @@ def validation_error(self, request):
     errors = list(self.errors.values())[0][0]
 
     return {"errors": errors}
+
+
+@App.json(model=HashingBusy)
+def hashing_busy_error(self, request):
+    @request.after
+    def set_status(response):
+        response.status = 503
+        response.headers["Retry-After"] = "1"
+
+    return {"errors": {"server": ["is busy, please try again later"]}}
+
+
+@App.json(model=PoolTimeout)
+def pool_timeout_error(self, request):
+    @request.after
+    def set_status(response):
+        response.status = 503
+        response.headers["Retry-After"] = "1"
+
+    return {"errors": {"database": ["is busy, please try again later"]}}
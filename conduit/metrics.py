@@ -0,0 +1,357 @@
+import json
+import mmap
+import os
+import struct
+from threading import Lock
+from time import monotonic
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+METRICS = {
+    "conduit_requests_total": (
+        "counter",
+        "Requests by model, view, method and status.",
+    ),
+    "conduit_request_duration_seconds": (
+        "histogram",
+        "Request latency by model, view and method.",
+    ),
+    "conduit_sql_queries_total": (
+        "counter",
+        "SQL queries by model, view and method.",
+    ),
+    "conduit_cache_hits_total": ("counter", "Cache hits by cache."),
+    "conduit_cache_misses_total": ("counter", "Cache misses by cache."),
+    "conduit_db_pool_connections": (
+        "gauge",
+        "Database pool connections by state.",
+    ),
+    "conduit_db_pool_waits_total": ("counter", "Waits for a database connection."),
+    "conduit_db_pool_wait_seconds_total": (
+        "counter",
+        "Time spent waiting for a database connection.",
+    ),
+    "conduit_db_pool_timeouts_total": (
+        "counter",
+        "Requests that got no database connection in time.",
+    ),
+    "conduit_db_pool_opened_total": ("counter", "Opened database connections."),
+    "conduit_db_pool_closed_total": ("counter", "Closed database connections."),
+    "conduit_password_hashing_calls_total": (
+        "counter",
+        "Password hashes and verifications.",
+    ),
+    "conduit_password_hashing_rejected_total": (
+        "counter",
+        "Password hashing calls rejected as busy.",
+    ),
+    "conduit_password_hashing_seconds_total": (
+        "counter",
+        "Time spent hashing and verifying passwords.",
+    ),
+}
+
+_ENTRY = struct.Struct("<I")
+_VALUE = struct.Struct("<d")
+_HEADER_SIZE = 8
+
+
+def _padding(size):
+    return -size % 8
+
+
+class MmapValues:
+    """Float values by key in a memory mapped file.
+
+    Only one process writes to the file, but any process can read it with
+    :func:`read_values`. The file starts with the number of bytes in use,
+    followed by the entries: the length of the key, the key padded to 8
+    bytes and the value as double.
+    """
+
+    def __init__(self, path, initial_size=64 * 1024):
+        self._file = open(path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < initial_size:
+            self._file.truncate(initial_size)
+            size = initial_size
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._positions = {}
+        self._used = _ENTRY.unpack_from(self._mmap, 0)[0]
+        if self._used == 0:
+            self._used = _HEADER_SIZE
+            _ENTRY.pack_into(self._mmap, 0, self._used)
+        for key, value, position in _read_entries(self._mmap, self._used):
+            self._positions[key] = position
+
+    def _grow(self, size):
+        capacity = len(self._mmap)
+        while capacity < size:
+            capacity *= 2
+        self._mmap.close()
+        self._file.truncate(capacity)
+        self._mmap = mmap.mmap(self._file.fileno(), capacity)
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            encoded = key.encode()
+            key_size = _ENTRY.size + len(encoded)
+            key_size += _padding(key_size)
+            end = self._used + key_size + _VALUE.size
+            if end > len(self._mmap):
+                self._grow(end)
+            _ENTRY.pack_into(self._mmap, self._used, len(encoded))
+            start = self._used + _ENTRY.size
+            self._mmap[start : start + len(encoded)] = encoded
+            position = self._used + key_size
+            _VALUE.pack_into(self._mmap, position, 0.0)
+            # the entry is complete before readers can see it
+            self._used = end
+            _ENTRY.pack_into(self._mmap, 0, self._used)
+            self._positions[key] = position
+        return position
+
+    def get(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            return 0.0
+        return _VALUE.unpack_from(self._mmap, position)[0]
+
+    def set(self, key, value):
+        _VALUE.pack_into(self._mmap, self._position(key), value)
+
+    def inc(self, key, amount=1.0):
+        position = self._position(key)
+        value = _VALUE.unpack_from(self._mmap, position)[0]
+        _VALUE.pack_into(self._mmap, position, value + amount)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+def _read_entries(data, used):
+    position = _HEADER_SIZE
+    while position < used:
+        length = _ENTRY.unpack_from(data, position)[0]
+        start = position + _ENTRY.size
+        key = bytes(data[start : start + length]).decode()
+        position = start + length + _padding(_ENTRY.size + length)
+        yield key, _VALUE.unpack_from(data, position)[0], position
+        position += _VALUE.size
+
+
+def read_values(path):
+    """Return the values of a file written by :class:`MmapValues`."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _HEADER_SIZE:
+        return {}
+    used = min(_ENTRY.unpack_from(data, 0)[0], len(data))
+    return {key: value for key, value, position in _read_entries(data, used)}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover
+        pass
+    return True
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join('{}="{}"'.format(name, _escape(value)) for name, value in labels)
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metrics:
+    """Metrics shared by the worker processes through a directory.
+
+    Each process writes its counters and gauges to its own memory mapped
+    files in ``directory``. The exposition sums the values of all files.
+    Counters of exited processes are kept, so they never go backwards,
+    while gauges only count the processes which are still running.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.token = None
+        self._lock = Lock()
+        self._pid = None
+        self._files = {}
+        self._synced = None
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def configure(self, directory=None, token=None):
+        with self._lock:
+            self._close()
+            if directory is not None:
+                os.makedirs(directory, exist_ok=True)
+            self.directory = directory
+            self.token = token
+            self._synced = None
+
+    def _close(self):
+        if self._pid == os.getpid():
+            for values in self._files.values():
+                values.close()
+        self._files = {}
+
+    def _values(self, kind):
+        # forked workers open their own files
+        if self._pid != os.getpid():
+            self._files = {}
+            self._pid = os.getpid()
+        values = self._files.get(kind)
+        if values is None:
+            path = os.path.join(self.directory, "{}_{}.db".format(kind, self._pid))
+            values = self._files[kind] = MmapValues(path)
+        return values
+
+    def _kind(self, name):
+        metric = name
+        for suffix in ("_bucket", "_sum"):
+            if name.endswith(suffix) and name[: -len(suffix)] in METRICS:
+                metric = name[: -len(suffix)]
+        return "gauge" if METRICS[metric][0] == "gauge" else "counter"
+
+    def inc(self, name, labels, amount=1.0):
+        if self.directory is None:
+            return
+        with self._lock:
+            self._values(self._kind(name)).inc(_key(name, labels), amount)
+
+    def set(self, name, labels, value):
+        if self.directory is None:
+            return
+        with self._lock:
+            self._values(self._kind(name)).set(_key(name, labels), value)
+
+    def observe(self, name, labels, value):
+        """Add ``value`` to the histogram ``name``."""
+        for bucket in BUCKETS:
+            if value <= bucket:
+                break
+        self.inc(name + "_bucket", dict(labels, le=_format_value(bucket)))
+        self.inc(name + "_sum", labels, value)
+
+    def sync(self, record, interval=1.0):
+        """Call ``record`` at most every ``interval`` seconds.
+
+        ``record`` sets the values kept elsewhere in the process, like the
+        statistics of the caches and pools.
+        """
+        now = monotonic()
+        if self._synced is None or now - self._synced >= interval:
+            self._synced = now
+            record()
+
+    def collect(self):
+        """Return the values of all processes summed by key."""
+        totals = {}
+        for filename in sorted(os.listdir(self.directory)):
+            kind, sep, pid = filename[: -len(".db")].partition("_")
+            if not filename.endswith(".db") or not pid.isdigit():
+                continue
+            if kind == "gauge" and not _pid_alive(int(pid)):
+                continue
+            path = os.path.join(self.directory, filename)
+            for key, value in read_values(path).items():
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def exposition(self):
+        """Return all metrics in the Prometheus text format."""
+        samples = {}
+        for key, value in self.collect().items():
+            name, labels = json.loads(key)
+            labels = tuple(tuple(label) for label in labels)
+            samples.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for metric, (kind, help) in METRICS.items():
+            if kind == "histogram":
+                metric_lines = self._histogram_lines(metric, samples)
+            else:
+                metric_lines = [
+                    "{}{} {}".format(metric, _format_labels(labels), _format_value(v))
+                    for labels, v in sorted(samples.get(metric, []))
+                ]
+            if metric_lines:
+                lines.append("# HELP {} {}".format(metric, help))
+                lines.append("# TYPE {} {}".format(metric, kind))
+                lines.extend(metric_lines)
+        return "\n".join(lines) + "\n"
+
+    def _histogram_lines(self, metric, samples):
+        series = {}
+        for labels, value in samples.get(metric + "_bucket", []):
+            labels = dict(labels)
+            le = float(labels.pop("le"))
+            buckets = series.setdefault(tuple(sorted(labels.items())), {})
+            buckets[le] = buckets.get(le, 0.0) + value
+        sums = dict(samples.get(metric + "_sum", []))
+
+        lines = []
+        for labels, buckets in sorted(series.items()):
+            count = 0.0
+            for le in BUCKETS:
+                count += buckets.get(le, 0.0)
+                bucket_labels = labels + (("le", _format_value(le)),)
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        metric, _format_labels(bucket_labels), _format_value(count)
+                    )
+                )
+            lines.append(
+                "{}_sum{} {}".format(
+                    metric,
+                    _format_labels(labels),
+                    _format_value(sums.get(labels, 0.0)),
+                )
+            )
+            lines.append(
+                "{}_count{} {}".format(
+                    metric, _format_labels(labels), _format_value(count)
+                )
+            )
+        return lines
+
+
+metrics = Metrics()
+
+
+def setup_metrics(app):
+    settings = app.settings.metrics
+    if settings.enabled:
+        # the workers only share their metrics through the same directory
+        if not settings.directory:
+            raise ValueError("The metrics need a directory")
+        # the token must not be committed with the settings
+        token = os.environ.get("CONDUIT_METRICS_TOKEN")
+        if not token:
+            raise ValueError("The metrics need a CONDUIT_METRICS_TOKEN")
+        metrics.configure(settings.directory, token)
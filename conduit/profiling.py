@@ -0,0 +1,104 @@
+import json
+import logging
+import random
+from threading import local
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+_profiling = local()
+
+
+def record(name, duration):
+    """Add ``duration`` seconds to ``name`` if the request is profiled."""
+    timings = getattr(_profiling, "timings", None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + duration
+
+
+def db_stats(database):
+    """Return the count and time of the SQL queries of this thread."""
+    stats = database.local_stats.get(None)
+    if stats is None or not stats.db_count:
+        return 0, 0.0
+    return stats.db_count, stats.sum_time
+
+
+class ProfilingMiddleware:
+    """WSGI middleware timing a sample of the requests.
+
+    A ``sample_rate`` share of the requests is profiled. For them the
+    time spent in SQL queries of ``database``, in password hashing and in
+    JSON rendering is collected, and the rest is counted as dispatch. The
+    timings are added as ``Server-Timing`` header and logged as JSON to
+    the ``conduit.profiling`` logger.
+    """
+
+    def __init__(self, app, database, sample_rate=1.0, server_timing=True, log=True):
+        self.app = app
+        self.database = database
+        self.sample_rate = sample_rate
+        self.server_timing = server_timing
+        self.log = log
+
+    def __call__(self, environ, start_response):
+        if random.random() >= self.sample_rate:
+            return self.app(environ, start_response)
+
+        response = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+
+        queries, db_time = db_stats(self.database)
+        _profiling.timings = timings = {}
+        start = perf_counter()
+        try:
+            body = self.app(environ, capture_start_response)
+        finally:
+            total = perf_counter() - start
+            _profiling.timings = None
+        end_queries, end_db_time = db_stats(self.database)
+        timings["db"] = end_db_time - db_time
+        queries = end_queries - queries
+
+        status, headers, exc_info = response
+        timings = {
+            "total": total,
+            "dispatch": total - sum(timings.values()),
+            "db": timings["db"],
+            "hash": timings.get("hash", 0.0),
+            "render": timings.get("render", 0.0),
+        }
+        if self.server_timing:
+            headers = headers + [
+                ("Server-Timing", server_timing_header(timings, queries))
+            ]
+        if self.log:
+            logger.info(
+                json.dumps(
+                    {
+                        "method": environ["REQUEST_METHOD"],
+                        "path": environ.get("SCRIPT_NAME", "")
+                        + environ.get("PATH_INFO", ""),
+                        "status": int(status.split(" ", 1)[0]),
+                        "queries": queries,
+                        **{
+                            name + "_ms": round(duration * 1000, 3)
+                            for name, duration in timings.items()
+                        },
+                    }
+                )
+            )
+        start_response(status, headers, exc_info)
+        return body
+
+
+def server_timing_header(timings, queries):
+    metrics = []
+    for name, duration in timings.items():
+        metric = "{};dur={:.2f}".format(name, duration * 1000)
+        if name == "db":
+            metric += ';desc="{} queries"'.format(queries)
+        metrics.append(metric)
+    return ", ".join(metrics)
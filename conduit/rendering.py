@@ -0,0 +1,110 @@
+import json
+from time import perf_counter
+
+import dectate
+import morepath
+from morepath import reify
+from morepath.directive import JsonAction as BaseJsonAction
+from morepath.view import View
+from webob import Response
+
+from conduit.profiling import record
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def _encode_stdlib(content):
+    # the same output as webob's Response.json_body
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def _encode_orjson(content):
+    # cerberus errors can have integer keys, which json turns into strings
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _encode_ujson(content):  # pragma: no cover
+    return ujson.dumps(
+        content, ensure_ascii=False, escape_forward_slashes=False
+    ).encode()
+
+
+json_encoders = {
+    "orjson": (orjson, _encode_orjson),
+    "ujson": (ujson, _encode_ujson),
+    "json": (json, _encode_stdlib),
+}
+
+
+def get_json_encoder(name="auto"):
+    """Return a function encoding JSON content to bytes.
+
+    ``name`` is one of ``orjson``, ``ujson`` or ``json``. With ``auto``
+    the fastest installed encoder is used. If the chosen encoder isn't
+    installed the standard library encoder is used.
+    """
+    if name == "auto":
+        for module, encode in json_encoders.values():
+            if module is not None:
+                return encode
+
+    module, encode = json_encoders[name]
+    if module is None:
+        return _encode_stdlib
+
+    return encode
+
+
+def render_json(content, request):
+    """Render view content to a JSON response with the app's encoder."""
+    start = perf_counter()
+    body = request.app.encode_json(request.app._dump_json(content, request))
+    record("render", perf_counter() - start)
+    return Response(body=body, content_type="application/json")
+
+
+class LabeledView(View):
+    """View noting the model and view name of the request.
+
+    The labels of the first view called are kept, so the error view of
+    a failing view or an embedded view doesn't replace them.
+    """
+
+    def __call__(self, app, obj, request):
+        if getattr(request, "view_labels", None) is None:
+            request.view_labels = (type(obj).__name__, request.view_name or "")
+        return super().__call__(app, obj, request)
+
+
+class JsonAction(BaseJsonAction):
+    def __init__(self, model, render=None, *args, **kwargs):
+        super().__init__(model, render or render_json, *args, **kwargs)
+
+    def perform(self, obj, template_engine_registry, app_class):
+        view = LabeledView(
+            obj,
+            self.render,
+            self.load,
+            self.permission,
+            self.internal,
+            self.code_info,
+        )
+        app_class.get_view.register(view, **self.key_dict())
+
+
+class App(morepath.App):
+    """Renders the ``json`` views with the encoder from the settings."""
+
+    json = dectate.directive(JsonAction)
+
+    @reify
+    def encode_json(self):
+        return get_json_encoder(self.settings.json.encoder)
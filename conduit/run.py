@@ -1,34 +1,48 @@
 import os
+import sys
 
 from webob.dec import wsgify
 from webob.exc import HTTPNotFound
 import morepath
 
-from conduit import App, ProductionApp, TestApp
-from conduit.database import db
+import conduit
+from conduit.app import get_app_class
+from conduit.auth.hashing import setup_hashing
+from conduit.blog.search import setup_search
+from conduit.database import db, setup_db
+from conduit.metrics import setup_metrics
+from conduit.profiling import ProfilingMiddleware
+from conduit.startup import startup_timer
 
 
-def setup_db(app):
-    db_params = app.settings.database.__dict__.copy()
-    db.bind(**db_params)
-    db.generate_mapping(create_tables=True)
+def app_factory():  # pragma: no cover
+    with startup_timer.phase("scan"):
+        morepath.scan(conduit, ignore=[".run", ".tests"])
 
+    with startup_timer.phase("settings"):
+        app_class = get_app_class()
 
-def wsgi_factory():  # pragma: no cover
-    morepath.autoscan()
+    with startup_timer.phase("commit"):
+        app_class.commit()
+        app = app_class()
 
-    if os.getenv("RUN_ENV") == "production":
-        ProductionApp.commit()
-        app = ProductionApp()
-    elif os.getenv("RUN_ENV") == "test":
-        TestApp.commit()
-        app = TestApp()
-    else:
-        App.commit()
-        app = App()
+    with startup_timer.phase("database"):
+        setup_db(app)
+        setup_search(app)
 
-    setup_db(app)
+    with startup_timer.phase("hashing"):
+        setup_hashing(app)
 
+    with startup_timer.phase("metrics"):
+        setup_metrics(app)
+
+    if os.getenv("CONDUIT_STARTUP_REPORT"):
+        print(startup_timer.report(), file=sys.stderr)
+
+    return app
+
+
+def wsgi_factory(app):  # pragma: no cover
     @wsgify
     def run_morepath(request):
         popped = request.path_info_pop()
@@ -37,7 +51,12 @@ def wsgi_factory():  # pragma: no cover
         else:
             raise HTTPNotFound
 
+    profiling = app.settings.profiling.__dict__.copy()
+    if profiling.pop("enabled"):
+        return ProfilingMiddleware(run_morepath, db, **profiling)
+
     return run_morepath
 
 
-application = wsgi_factory()  # pragma: no cover
+app = app_factory()  # pragma: no cover
+application = wsgi_factory(app)  # pragma: no cover
@@ -0,0 +1,94 @@
+"""Timing of the application startup phases."""
+from contextlib import contextmanager
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+
+class StartupTimer:
+    """Records how long each phase of the startup took."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, perf_counter() - start))
+
+    def report(self):
+        """Return the phases in the format of ``python -X importtime``."""
+        lines = ["startup time: self [us] | phase"]
+        for name, duration in self.phases:
+            lines.append("startup time: {:>9} | {}".format(int(duration * 1e6), name))
+        total = sum(duration for name, duration in self.phases)
+        lines.append("startup time: {:>9} | total".format(int(total * 1e6)))
+        return "\n".join(lines)
+
+
+startup_timer = StartupTimer()
+
+
+def parse_import_times(output):
+    """Return ``(module, self, cumulative)`` tuples from ``-X importtime``.
+
+    The times are in microseconds. Only top level imports get a
+    cumulative time, it's ``None`` for nested imports.
+    """
+    import_times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        nested = name.startswith("  ")
+        import_times.append(
+            (name.strip(), int(self_time), None if nested else int(cumulative))
+        )
+
+    return import_times
+
+
+def measure_startup(imports=10):
+    """Start the application in a new interpreter and report the timings.
+
+    Returns the startup phases preceded by the time spent importing and
+    followed by the ``imports`` modules with the highest self time.
+    """
+    env = dict(os.environ, CONDUIT_STARTUP_REPORT="1")
+    start = perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import conduit.run"],
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    process_time = perf_counter() - start
+
+    timer = StartupTimer()
+    for line in result.stderr.splitlines():
+        if line.startswith("startup time:") and "[us]" not in line:
+            duration, name = line[len("startup time:") :].split("|")
+            if name.strip() != "total":
+                timer.phases.append((name.strip(), int(duration) / 1e6))
+
+    import_times = parse_import_times(result.stderr)
+    # conduit.run creates the app on import, so the phases are part of
+    # the cumulative import times
+    imports_time = sum(cumulative or 0 for name, self, cumulative in import_times)
+    imports_time = imports_time / 1e6 - sum(d for name, d in timer.phases)
+    timer.phases.insert(0, ("imports", imports_time))
+
+    lines = [timer.report()]
+    lines.append("startup time: {:>9} | process".format(int(process_time * 1e6)))
+    lines.append("import time:  self [us] | module")
+    for name, self_time, cumulative in sorted(
+        import_times, key=lambda import_time: import_time[1], reverse=True
+    )[:imports]:
+        lines.append("import time:  {:>9} | {}".format(self_time, name))
+
+    return "\n".join(lines)
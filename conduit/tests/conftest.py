@@ -0,0 +1,14 @@
+import pytest
+
+from conduit.blog.model import article_counts, tag_clouds
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with empty process-wide caches.
+
+    The tests recreate the tables, so cached counts and tag clouds of an
+    earlier test would be stale.
+    """
+    article_counts.clear()
+    tag_clouds.clear()
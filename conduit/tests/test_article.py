@@ -90,6 +90,45 @@ def test_article():
     assert "text" in response.json["article"]["tagList"]
 
 
+def test_article_conditional_get():
+    c = Client(App())
+
+    response = c.get("/articles/test-text")
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert response.headers["Last-Modified"] == "Sat, 21 Oct 2017 15:33:35 GMT"
+
+    response = c.get("/articles/test-text", headers={"If-None-Match": etag}, status=304)
+    assert response.headers["ETag"] == etag
+    assert response.body == b""
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    response = c.get(
+        "/articles/test-text", headers=dict(headers, **{"If-None-Match": etag})
+    )
+    assert response.status_code == 200
+    user_etag = response.headers["ETag"]
+
+    c.post("/articles/test-text/favorite", headers=headers)
+
+    response = c.get(
+        "/articles/test-text", headers=dict(headers, **{"If-None-Match": user_etag})
+    )
+    assert response.status_code == 200
+    assert response.json["article"]["favorited"] is True
+
+    response = c.get("/articles/test-text", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["article"]["favoritesCount"] == 1
+
+
 def test_update_article():
     c = Client(App())
 
@@ -132,6 +171,29 @@ def test_update_article():
     assert response.json == {"errors": {"body": ["must be of string type"]}}
 
 
+def test_update_article_tags_counts():
+    c = Client(App())
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    response = c.get("/articles?tag=test", headers=headers)
+    assert response.json["articlesCount"] == 1
+
+    update_article_json = json.dumps({"article": {"tagList": ["other"]}})
+    c.put("/articles/test-text", update_article_json, headers=headers)
+
+    response = c.get("/articles?tag=test", headers=headers)
+    assert response.json["articles"] == []
+    assert response.json["articlesCount"] == 0
+    response = c.get("/articles?tag=other", headers=headers)
+    assert response.json["articlesCount"] == 1
+
+
 def test_delete_article():
     c = Client(App())
 
@@ -2,20 +2,42 @@ import json
 
 from argon2 import PasswordHasher
 import morepath
-from pony.orm import db_session
+import pytest
+from pony.orm import TransactionError, db_session, desc, flush, select
+from pony.orm.core import local
+from pony.orm.dbapiprovider import IntegrityError
 from webtest import TestApp as Client
 
 import conduit
 from conduit import TestApp as App
+from conduit.app import retry_on_conflict
 from conduit.database import db
 from conduit.auth import User
-from conduit.blog.model import Article, Tag
+from conduit.cache import SQLiteCache
+from conduit.blog.model import Article, Tag, TimelineEntry, article_counts, tag_clouds
+from conduit.cli import rebuild_timeline
 from conduit.utils import isoformat_to_datetime
 
 
+class TimelineApp(App):
+    pass
+
+
+TimelineApp.init_settings({"feed": {"timeline": True}})
+
+
+class SQLiteCacheApp(App):
+    pass
+
+
+SQLiteCacheApp.init_settings(
+    {"response_cache": {"backend": "sqlite", "path": ":memory:"}}
+)
+
+
 def setup_module(module):
     morepath.scan(conduit)
-    morepath.commit(App)
+    morepath.commit(App, TimelineApp, SQLiteCacheApp)
 
 
 def setup_function(function):
@@ -62,6 +84,7 @@ def setup_function(function):
             updated_at=isoformat_to_datetime("2017-10-22T15:59:22.000Z"),
             author=User[2],
             favorited=[User[1]],
+            favorites_count=1,
         )
 
 
@@ -152,6 +175,103 @@ def test_add_article():
     }
 
 
+def test_unique_slug():
+    with db_session:
+        for title in ["Hello world", "Hello world", "Hello", "Hello world the"]:
+            Article(
+                title=title,
+                description="Greeting",
+                body="Hello.",
+                author=User[1],
+            )
+
+    with db_session:
+        assert set(select(a.slug for a in Article)) >= {
+            "hello-world",
+            "hello-world-1",
+            "hello",
+            "hello-world-2",
+        }
+        article = Article.get(slug="hello-world-1")
+        Article.get(slug="hello-world").delete()
+        flush()
+
+        db.merge_local_stats()
+        article.update({"title": "Hello world!"})
+        assert db.local_stats[None].db_count == 1
+        assert article.slug == "hello-world"
+
+        article.update({"title": "Hello world"})
+        assert article.slug == "hello-world"
+
+
+def test_colliding_slugs():
+    with db_session:
+        for slug in ["hello", "hello-1", "hello-world", "hello.", "hellow", "help"]:
+            Article(
+                title="Hello",
+                slug=slug,
+                description="Greeting",
+                body="Hello.",
+                author=User[1],
+            )
+        flush()
+
+        assert set(Article.colliding_slugs("hello")) == {
+            "hello",
+            "hello-1",
+            "hello-world",
+        }
+
+        sql = Article.colliding_slugs("hello").get_sql()
+        plan = db.get_connection().execute("EXPLAIN QUERY PLAN " + sql, ["hello"] * 3)
+        details = [row[-1] for row in plan]
+        assert any(detail.startswith("SEARCH") for detail in details)
+        assert not any(detail.startswith("SCAN") for detail in details)
+
+
+def test_add_article_slug_conflict(monkeypatch):
+    c = Client(App())
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    set_unique_slug = Article._set_unique_slug
+    calls = []
+
+    def set_conflicting_slug(self, text):
+        calls.append(text)
+        if len(calls) == 1:
+            # a concurrent transaction stored this slug meanwhile
+            self.slug = "test-text"
+        else:
+            set_unique_slug(self, text)
+
+    monkeypatch.setattr(Article, "_set_unique_slug", set_conflicting_slug)
+
+    new_article = json.dumps(
+        {"article": {"title": "Test text", "description": "Again", "body": "Text."}}
+    )
+    response = c.post("/articles", new_article, headers=headers, status=201)
+    assert response.json["article"]["slug"] == "test-text-1"
+    assert len(calls) == 2
+
+
+def test_retry_on_conflict():
+    slug_error = Exception("UNIQUE constraint failed: articles.slug")
+    email_error = Exception("UNIQUE constraint failed: users.email")
+
+    assert retry_on_conflict(IntegrityError(slug_error))
+    assert not retry_on_conflict(IntegrityError(email_error))
+    assert retry_on_conflict(TransactionError())
+    assert not retry_on_conflict(ValueError())
+
+
 def test_list_articles():
     c = Client(App())
 
@@ -276,10 +396,15 @@ def test_paginate_articles():
     response = c.get("/articles?limit=1")
     assert len(response.json["articles"]) == 1
     assert response.json["articles"][0] == article_2
+    assert response.json["articlesCount"] == 2
 
     response = c.get("/articles?limit=1&offset=1")
     assert len(response.json["articles"]) == 1
     assert response.json["articles"][0] == article_1
+    assert response.json["articlesCount"] == 2
+
+    response = c.get("/articles?tag=test&limit=1")
+    assert response.json["articlesCount"] == 1
 
 
 def test_feed_articles():
@@ -345,3 +470,384 @@ def test_paginate_feed_articles():
 
     response = c.get("/articles/feed?limit=1&offset=1", headers=headers)
     assert len(response.json["articles"]) == 0
+    assert response.json["articlesCount"] == 1
+
+
+def test_articles_count_invalidation():
+    c = Client(App())
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    response = c.get("/articles?favorited=Tester&limit=1")
+    assert response.json["articlesCount"] == 1
+
+    response = c.get("/articles/feed", headers=headers)
+    assert response.json["articlesCount"] == 1
+
+    new_article = json.dumps(
+        {
+            "article": {
+                "title": "New text",
+                "description": "News about testing",
+                "body": "This is a new text.",
+            }
+        }
+    )
+    c.post("/articles", new_article, headers=headers, status=201)
+
+    response = c.get("/articles?limit=1")
+    assert response.json["articlesCount"] == 3
+
+    c.post("/articles/test-text/favorite", headers=headers)
+
+    response = c.get("/articles?favorited=Tester&limit=1")
+    assert response.json["articlesCount"] == 2
+
+    c.delete("/profiles/OtherUser/follow", headers=headers)
+
+    response = c.get("/articles/feed", headers=headers)
+    assert response.json["articlesCount"] == 0
+
+
+def test_list_articles_query_count():
+    c = Client(App())
+
+    with db_session:
+        for i in range(10):
+            Article(
+                title="Extra text",
+                description="More testing",
+                body="This is an extra text.",
+                tag_list=[Tag[1], Tag[2]],
+                author=User[i % 2 + 1],
+                favorited=[User[1], User[2]],
+                favorites_count=2,
+            )
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    # warm up the articles count cache
+    c.get("/articles", headers=headers)
+
+    query_counts = []
+    for limit in (2, 12):
+        db.merge_local_stats()
+        response = c.get("/articles?limit={}".format(limit), headers=headers)
+        assert len(response.json["articles"]) == limit
+        query_counts.append(db.local_stats[None].db_count)
+
+    assert query_counts[0] == query_counts[1]
+    assert response.json["articles"][0]["favoritesCount"] == 2
+    assert response.json["articles"][0]["favorited"] is True
+    assert sorted(response.json["articles"][0]["tagList"]) == ["test", "text"]
+
+
+def test_cursor_paginate_articles():
+    c = Client(App())
+
+    with db_session:
+        Article(
+            id=3,
+            title="Third text",
+            description="Even more about testing",
+            body="This is a third text.",
+            created_at=isoformat_to_datetime("2017-10-22T13:55:34.000Z"),
+            updated_at=isoformat_to_datetime("2017-10-22T13:55:34.000Z"),
+            author=User[2],
+        )
+
+    response = c.get("/articles?limit=1")
+    assert [a["slug"] for a in response.json["articles"]] == ["third-text"]
+    assert response.json["prevCursor"] is None
+    next_cursor = response.json["nextCursor"]
+
+    response = c.get("/articles?limit=1&cursor={}".format(next_cursor))
+    assert [a["slug"] for a in response.json["articles"]] == ["second-text"]
+    assert response.json["articlesCount"] == 3
+    prev_cursor = response.json["prevCursor"]
+    next_cursor = response.json["nextCursor"]
+
+    response = c.get("/articles?limit=2&cursor={}".format(next_cursor))
+    assert [a["slug"] for a in response.json["articles"]] == ["test-text"]
+    assert response.json["nextCursor"] is None
+
+    response = c.get("/articles?limit=1&cursor={}".format(prev_cursor))
+    assert [a["slug"] for a in response.json["articles"]] == ["third-text"]
+    assert response.json["prevCursor"] is None
+
+    response = c.get("/articles?limit=1&offset=1")
+    assert [a["slug"] for a in response.json["articles"]] == ["second-text"]
+    assert response.json["prevCursor"] is not None
+
+    c.get("/articles?cursor=invalid", status=400)
+
+
+def test_timeline_feed_articles():
+    c = Client(TimelineApp())
+
+    rebuild_timeline(None)
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    response = c.get("/articles/feed", headers=headers)
+    assert [a["slug"] for a in response.json["articles"]] == ["second-text"]
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "other_user@example.com", "password": "top_secret_2"}}
+        ),
+    )
+
+    other_headers = {"Authorization": response.headers["Authorization"]}
+
+    new_article = json.dumps(
+        {
+            "article": {
+                "title": "New text",
+                "description": "News about testing",
+                "body": "This is a new text.",
+            }
+        }
+    )
+    c.post("/articles", new_article, headers=other_headers, status=201)
+
+    with db_session:
+        assert TimelineEntry.select().count() == 2
+        TimelineEntry.select(lambda e: e.article.id == 2).delete(bulk=True)
+
+    response = c.get("/articles/feed", headers=headers)
+    assert [a["slug"] for a in response.json["articles"]] == ["new-text"]
+
+    rebuild_timeline(None)
+
+    response = c.get("/articles/feed?limit=1", headers=headers)
+    assert [a["slug"] for a in response.json["articles"]] == ["new-text"]
+    assert response.json["articlesCount"] == 2
+
+    c.delete("/profiles/OtherUser/follow", headers=headers)
+
+    response = c.get("/articles/feed", headers=headers)
+    assert response.json["articles"] == []
+
+    c.post("/profiles/OtherUser/follow", headers=headers)
+
+    response = c.get("/articles/feed", headers=headers)
+    assert [a["slug"] for a in response.json["articles"]] == [
+        "new-text",
+        "second-text",
+    ]
+
+    with db_session:
+        assert TimelineEntry.select().count() == 2
+
+
+def test_timeline_feed_pages():
+    c = Client(TimelineApp())
+    rebuild_timeline(None)
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "other_user@example.com", "password": "top_secret_2"}}
+        ),
+    )
+    other_headers = {"Authorization": response.headers["Authorization"]}
+    for title in ["Third", "Fourth"]:
+        new_article = json.dumps(
+            {"article": {"title": title, "description": "News", "body": "New."}}
+        )
+        c.post("/articles", new_article, headers=other_headers, status=201)
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    response = c.get("/articles/feed?limit=2", headers=headers)
+    assert [a["slug"] for a in response.json["articles"]] == ["fourth", "third"]
+    next_cursor = response.json["nextCursor"]
+
+    response = c.get(
+        "/articles/feed?limit=2&cursor={}".format(next_cursor), headers=headers
+    )
+    assert [a["slug"] for a in response.json["articles"]] == ["second-text"]
+    assert response.json["nextCursor"] is None
+
+    response = c.get(
+        "/articles/feed?limit=2&cursor={}".format(response.json["prevCursor"]),
+        headers=headers,
+    )
+    assert [a["slug"] for a in response.json["articles"]] == ["fourth", "third"]
+
+    with db_session:
+        query = TimelineEntry.select(lambda e: e.user.id == 1).sort_by(
+            desc(TimelineEntry.created_at), desc(TimelineEntry.article)
+        )
+        plan = db.execute("EXPLAIN QUERY PLAN " + query.get_sql()).fetchall()
+        assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+
+def test_remove_article_deletes_timeline_in_bulk():
+    with db_session:
+        for i in range(3, 50):
+            User(
+                id=i,
+                username="Follower{}".format(i),
+                email="follower{}@example.com".format(i),
+                password="-",
+                follows=[User[2]],
+            )
+    rebuild_timeline(None)
+
+    with db_session:
+        article = Article[2]
+        assert article.timeline_entries.count() == 48
+        db.merge_local_stats()
+        article.remove()
+        flush()
+        timeline_deletes = [
+            stat.db_count
+            for sql, stat in db.local_stats.items()
+            if sql and sql.startswith('DELETE FROM "timeline"')
+        ]
+        assert timeline_deletes == [1]
+        assert TimelineEntry.select().count() == 0
+
+
+def test_list_articles_conditional_get():
+    app = App()
+    c = Client(app)
+
+    response = c.get("/articles")
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+    c.get("/articles", headers={"If-None-Match": etag}, status=304)
+    response = c.get("/articles?limit=1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+    with db_session:
+        Article[1].title = "Changed"
+        Article[1].updated_at = isoformat_to_datetime("2017-10-22T10:00:00.000Z")
+    app.article_responses.clear()
+
+    response = c.get("/articles", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("app_class", [App, SQLiteCacheApp])
+def test_anonymous_response_cache(app_class):
+    app = app_class()
+    c = Client(app)
+    if app_class is SQLiteCacheApp:
+        assert isinstance(app.article_responses, SQLiteCache)
+
+    response = c.get("/articles?limit=1&offset=0")
+    assert response.headers["X-Cache"] == "MISS"
+    articles = response.json
+
+    response = c.get("/articles?offset=0&limit=1")
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.json == articles
+    assert response.content_type == "application/json"
+    etag = response.headers["ETag"]
+
+    response = c.get("/articles?limit=1", headers={"If-None-Match": etag}, status=304)
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.headers["ETag"] == etag
+    assert app.article_responses.hits == 2
+    assert app.article_responses.misses == 1
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    response = c.get("/articles?limit=1", headers=headers)
+    assert "X-Cache" not in response.headers
+
+    c.delete("/articles/second-text/favorite", headers=headers)
+
+    response = c.get("/articles?offset=0&limit=1")
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json["articles"][0]["favoritesCount"] == 0
+
+
+def test_response_cache_cleared_after_commit(monkeypatch):
+    app = App()
+    c = Client(app)
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+    sessions = []
+    monkeypatch.setattr(
+        app.article_responses, "clear", lambda: sessions.append(local.db_session)
+    )
+
+    c.delete("/articles/second-text/favorite", headers=headers)
+
+    # a request running meanwhile can't cache the lists of the old rows
+    assert sessions == [None]
+
+
+def test_counts_cleared_after_commit(monkeypatch):
+    c = Client(App())
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+    cleared = []
+    popped = []
+    monkeypatch.setattr(
+        article_counts, "clear", lambda: cleared.append(("counts", local.db_session))
+    )
+    monkeypatch.setattr(
+        tag_clouds, "clear", lambda: cleared.append(("tags", local.db_session))
+    )
+    monkeypatch.setattr(
+        article_counts, "pop", lambda key: popped.append((key, local.db_session))
+    )
+
+    article = {"title": "New", "description": "New", "body": "New"}
+    article["tagList"] = ["news"]
+    c.post("/articles", json.dumps({"article": article}), headers=headers)
+    assert sorted(cleared) == [("counts", None), ("tags", None)]
+
+    # favorites only change the counts of the favorites of the user
+    c.post("/articles/test-text/favorite", headers=headers)
+    assert popped == [(("articles", None, None, 1), None)]
@@ -0,0 +1,190 @@
+import asyncio
+from concurrent.futures import Executor, Future
+import json
+from threading import Lock
+import time
+
+from argon2 import PasswordHasher
+import morepath
+from pony.orm import db_session
+import pytest
+
+import conduit
+from conduit.asgi import ASGIAdapter, application
+from conduit.database import db
+from conduit.auth import User
+from conduit.blog.model import Tag
+
+
+class InlineExecutor(Executor):
+    """Runs the requests in the test thread, which has the in-memory DB."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def setup_module(module):
+    morepath.scan(conduit)
+
+
+def setup_function(function):
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+
+    ph = PasswordHasher()
+
+    with db_session:
+        User(
+            id=1,
+            username="Tester",
+            email="tester@example.com",
+            password=ph.hash("top_secret_1"),
+        )
+        Tag(id=1, tagname="test")
+
+
+def call(app, method, path, body=b"", headers=(), chunk_size=None):
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/json"),
+        ]
+        + list(headers),
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 8000),
+    }
+    chunk_size = chunk_size or len(body) or 1
+    messages = [
+        {
+            "type": "http.request",
+            "body": body[i : i + chunk_size],
+            "more_body": i + chunk_size < len(body),
+        }
+        for i in range(0, max(len(body), 1), chunk_size)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    status = sent[0]["status"]
+    headers = dict(sent[0]["headers"])
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+
+    return status, headers, body
+
+
+def test_asgi_application(monkeypatch):
+    monkeypatch.setattr(application, "_get_executor", InlineExecutor)
+
+    status, headers, body = call(application, "GET", "/api/tags")
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    assert json.loads(body)["tags"] == ["test"]
+
+    login = json.dumps(
+        {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+    ).encode()
+    status, headers, body = call(
+        application, "POST", "/api/users/login", login, chunk_size=10
+    )
+    assert status == 200
+    assert json.loads(body)["user"]["username"] == "Tester"
+
+    status, headers, body = call(
+        application,
+        "GET",
+        "/api/user",
+        headers=[(b"authorization", headers[b"authorization"])],
+    )
+    assert status == 200
+    assert json.loads(body)["user"]["email"] == "tester@example.com"
+
+    status, headers, body = call(application, "GET", "/other")
+    assert status == 404
+
+
+def test_asgi_max_body_size():
+    app = ASGIAdapter(application.wsgi_app, max_body_size=10)
+
+    status, headers, body = call(app, "POST", "/api/users/login", b"x" * 11)
+    assert status == 413
+
+    with pytest.raises(ValueError):
+        asyncio.run(app({"type": "websocket"}, None, None))
+
+
+def slow_wsgi_app(environ, start_response):
+    with slow_wsgi_app.lock:
+        slow_wsgi_app.running += 1
+        slow_wsgi_app.max_running = max(
+            slow_wsgi_app.max_running, slow_wsgi_app.running
+        )
+    time.sleep(0.05)
+    with slow_wsgi_app.lock:
+        slow_wsgi_app.running -= 1
+
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [environ["PATH_INFO"].encode()]
+
+
+slow_wsgi_app.lock = Lock()
+slow_wsgi_app.running = 0
+slow_wsgi_app.max_running = 0
+
+
+def test_asgi_thread_pool():
+    app = ASGIAdapter(slow_wsgi_app, threads=2)
+
+    async def request(path):
+        messages = [{"type": "http.request", "body": b""}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": b""}
+        await app(dict(scope, headers=[]), receive, send)
+        return sent[1]["body"]
+
+    async def requests():
+        return await asyncio.gather(*[request("/{}".format(i)) for i in range(6)])
+
+    assert asyncio.run(requests()) == [b"/0", b"/1", b"/2", b"/3", b"/4", b"/5"]
+    assert slow_wsgi_app.max_running == 2
+    app.shutdown()
+
+
+def test_asgi_lifespan():
+    app = ASGIAdapter(slow_wsgi_app, threads=2)
+    call(app, "GET", "/api/tags")
+    executor = app._executor
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    asyncio.run(app({"type": "lifespan"}, receive, send))
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert executor._shutdown
+    assert app._executor is None
@@ -94,7 +94,10 @@ def test_list_article_comments():
                     "following": False,
                 },
             },
-        ]
+        ],
+        "commentsCount": 2,
+        "prevCursor": None,
+        "nextCursor": None,
     }
 
     c.get("/articles/NotExist/comments", status=404)
@@ -103,6 +106,80 @@ def test_list_article_comments():
     assert response.json == comments
 
 
+def test_list_article_comments_query_count():
+    c = Client(App())
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "some_user@example.com", "password": "top_secret_2"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    query_counts = []
+    for i in range(2):
+        db.merge_local_stats()
+        response = c.get("/articles/test-text/comments", headers=headers)
+        query_counts.append(db.local_stats[None].db_count)
+        with db_session:
+            for j in range(5):
+                Comment(body="More.", author=User[i + 1], article=Article[1])
+
+    assert query_counts[0] == query_counts[1]
+    following = [
+        comment["author"]["following"] for comment in response.json["comments"]
+    ]
+    assert following[-2:] == [False, True]
+
+
+def test_paginate_article_comments():
+    c = Client(App())
+
+    with db_session:
+        for i in range(150):
+            Comment(body="Comment {}".format(i), author=User[1], article=Article[1])
+
+    response = c.get("/articles/test-text/comments")
+    assert len(response.json["comments"]) == 20
+    assert response.json["commentsCount"] == 152
+    assert response.json["comments"][0]["body"] == "Comment 149"
+
+    response = c.get("/articles/test-text/comments?limit=1000")
+    assert len(response.json["comments"]) == 100
+
+    response = c.get("/articles/test-text/comments?limit=100")
+    next_cursor = response.json["nextCursor"]
+    response = c.get("/articles/test-text/comments?limit=100&cursor=" + next_cursor)
+    assert len(response.json["comments"]) == 52
+    assert response.json["nextCursor"] is None
+    assert response.json["comments"][-1]["body"] == "Cool text."
+
+    prev_cursor = response.json["prevCursor"]
+    response = c.get("/articles/test-text/comments?limit=3&cursor=" + prev_cursor)
+    bodies = [comment["body"] for comment in response.json["comments"]]
+    assert bodies == ["Comment 52", "Comment 51", "Comment 50"]
+
+    c.get("/articles/test-text/comments?cursor=invalid", status=400)
+
+
+def test_list_article_comments_conditional_get():
+    c = Client(App())
+
+    response = c.get("/articles/test-text/comments")
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"] == "Sat, 21 Oct 2017 17:54:45 GMT"
+
+    c.get("/articles/test-text/comments", headers={"If-None-Match": etag}, status=304)
+
+    with db_session:
+        Comment[2].delete()
+
+    response = c.get("/articles/test-text/comments", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json["comments"]) == 1
+
+
 def test_add_article_comment():
     c = Client(App())
 
@@ -167,6 +244,15 @@ def test_article_comment_is_internal():
 def test_delete_article_comment():
     c = Client(App())
 
+    with db_session:
+        Article(
+            id=2,
+            title="Other text",
+            description="About more testing",
+            body="This is another text test.",
+            author=User[1],
+        )
+
     c.delete("/articles/test-text/comments/1", status=403)
 
     response = c.post(
@@ -178,6 +264,11 @@ def test_delete_article_comment():
 
     headers = {"Authorization": response.headers["Authorization"]}
 
+    with db_session:
+        assert Comment.exists(id=1)
+
+    c.delete("/articles/other-text/comments/1", headers=headers, status=404)
+
     with db_session:
         assert Comment.exists(id=1)
 
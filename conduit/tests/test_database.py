@@ -0,0 +1,292 @@
+from contextlib import contextmanager
+import json
+import logging
+from threading import Barrier, Thread
+import time
+
+import morepath
+from pony.orm import Database, db_session
+from pony.orm.dbapiprovider import OperationalError
+import pytest
+from webtest import TestApp as Client
+
+import conduit
+from conduit import TestApp as App
+from conduit.database import (
+    ConnectionPool,
+    PoolTimeout,
+    db,
+    replica_pool,
+    replica_session,
+    slow_query_log,
+    use_connection_pool,
+    use_replicas,
+)
+
+
+class ReplicaApp(App):
+    pass
+
+
+ReplicaApp.init_settings({"replicas": {"databases": [{"filename": "replica.db"}]}})
+
+
+def setup_module(module):
+    morepath.scan(conduit)
+    morepath.commit(App, ReplicaApp)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database()
+    database.bind(
+        "sqlite", str(tmp_path / "pool.db"), create_db=True, check_same_thread=False
+    )
+    yield database
+    database.disconnect()
+
+
+def test_connection_pool(database):
+    pool = ConnectionPool(size=2, timeout=5)
+    use_connection_pool(database, pool)
+    holding = Barrier(3)
+    results = []
+
+    @db_session
+    def query(hold):
+        results.append(database.select("SELECT 1")[0])
+        if hold:
+            holding.wait()
+            time.sleep(0.05)
+
+    threads = [Thread(target=query, args=(True,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    holding.wait()
+    # both connections are in use, so the third thread has to wait
+    threads.append(Thread(target=query, args=(False,)))
+    threads[-1].start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [1, 1, 1]
+    stats = pool.stats()
+    assert stats["opened"] == 2
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 2
+    assert stats["waits"] == 1
+    assert stats["wait_time"] > 0
+
+    with db_session:
+        database.select("SELECT 1")
+    assert pool.stats()["opened"] == 2
+
+
+def test_connection_pool_recycle(database):
+    pool = ConnectionPool(size=1, recycle=0)
+    use_connection_pool(database, pool)
+
+    for i in range(3):
+        with db_session:
+            database.select("SELECT 1")
+
+    assert pool.stats()["opened"] == 3
+    assert pool.stats()["closed"] == 2
+
+
+def test_connection_pool_timeout(database):
+    pool = ConnectionPool(size=1, timeout=0.01)
+    use_connection_pool(database, pool)
+    errors = []
+
+    @db_session
+    def query():
+        try:
+            database.select("SELECT 1")
+        except PoolTimeout as e:
+            errors.append(e)
+
+    with db_session:
+        database.select("SELECT 1")
+        thread = Thread(target=query)
+        thread.start()
+        thread.join()
+
+    assert len(errors) == 1
+    assert pool.stats()["timeouts"] == 1
+    assert pool.stats()["in_use"] == 0
+
+
+class BusyPool:
+    def connect(self):
+        raise PoolTimeout
+
+
+def test_pool_timeout_error(monkeypatch):
+    monkeypatch.setattr(db.provider, "pool", BusyPool())
+
+    response = Client(App()).get("/tags", status=503)
+    assert response.headers["Retry-After"] == "1"
+    assert response.json == {
+        "errors": {"database": ["is busy, please try again later"]}
+    }
+
+
+def test_replica_router(tmp_path):
+    databases = {}
+    for name in ("primary", "replica"):
+        databases[name] = Database()
+        databases[name].bind("sqlite", str(tmp_path / (name + ".db")), create_db=True)
+        with db_session:
+            databases[name].execute("CREATE TABLE server (name TEXT)")
+            databases[name].insert("server", name=name)
+        databases[name].disconnect()
+    database = databases["primary"]
+    replica_params = {"provider": "sqlite", "filename": str(tmp_path / "replica.db")}
+    use_replicas(database, [replica_pool(replica_params)])
+
+    with db_session:
+        assert database.select("name FROM server") == ["primary"]
+    with replica_session(), db_session:
+        assert database.select("name FROM server") == ["replica"]
+    with db_session:
+        database.insert("server", name="primary")
+
+    with pytest.raises(OperationalError):
+        with replica_session(), db_session:
+            database.insert("server", name="replica")
+
+    database.disconnect()
+
+
+def test_read_your_writes(monkeypatch):
+    sessions = []
+
+    @contextmanager
+    def record_replica_session():
+        sessions.append("replica")
+        yield
+
+    monkeypatch.setattr(conduit.app, "replica_session", record_replica_session)
+    c = Client(ReplicaApp())
+
+    c.get("/tags")
+    assert sessions == ["replica"]
+    assert "conduit_primary" not in c.cookies
+
+    new_user_json = json.dumps(
+        {
+            "user": {
+                "username": "ReplicaUser",
+                "email": "replica_user@example.com",
+                "password": "top_secret",
+            }
+        }
+    )
+    c.post("/users", new_user_json, status=201)
+    assert float(c.cookies["conduit_primary"]) > time.time()
+
+    c.get("/tags")
+    assert sessions == ["replica"]
+
+    c.set_cookie("conduit_primary", str(int(time.time() - 1)))
+    c.get("/tags")
+    assert sessions == ["replica", "replica"]
+
+
+@pytest.fixture
+def slow_queries():
+    slow_query_log.configure(threshold=1e-9, explain=True)
+    yield slow_query_log
+    slow_query_log.configure()
+
+
+def test_slow_query_log(slow_queries, caplog):
+    c = Client(App())
+
+    with caplog.at_level(logging.WARNING, logger="conduit.slow_queries"):
+        c.get("/articles?tag=dragons")
+        c.get("/articles?tag=dragons")
+
+    entries = [json.loads(record.getMessage()) for record in caplog.records]
+    tag_query = [entry for entry in entries if "dragons" in entry["arguments"]]
+    assert len(tag_query) == 2
+    assert tag_query[0]["method"] == "GET"
+    assert tag_query[0]["path"] == "/articles"
+    assert tag_query[0]["duration_ms"] >= 0
+    assert tag_query[0]["plan"] == [
+        "SEARCH tags USING INDEX sqlite_autoindex_tags_1 (tagname=?)"
+    ]
+    # the plan of a statement is captured once per interval
+    assert "plan" not in tag_query[1]
+    # queries of the path functions run before the view is known
+    assert tag_query[0]["model"] == "none"
+    count_query = [entry for entry in entries if "COUNT(*)" in entry["sql"]]
+    assert count_query[0]["model"] == "ArticleCollection"
+
+
+def test_slow_query_threshold(caplog):
+    slow_query_log.configure(threshold=60)
+    try:
+        with caplog.at_level(logging.WARNING, logger="conduit.slow_queries"):
+            with db_session:
+                db.select("SELECT 1")
+    finally:
+        slow_query_log.configure()
+
+    assert not caplog.records
+
+
+class ExplainCursor:
+    def __init__(self, statements, error):
+        self.statements = statements
+        self.error = error
+
+    def execute(self, sql, arguments=None):
+        self.statements.append(sql)
+        if sql.startswith("EXPLAIN") and self.error:
+            raise self.error
+
+    def fetchall(self):
+        return [("Seq Scan on articles",)]
+
+
+class ExplainConnection:
+    def __init__(self, error=None):
+        self.statements = []
+        self.error = error
+
+    def cursor(self):
+        return ExplainCursor(self.statements, self.error)
+
+
+class PostgresProvider:
+    dialect = "PostgreSQL"
+
+    def execute(self, cursor, sql, arguments):
+        cursor.execute(sql, arguments)
+
+
+def test_explain_in_savepoint():
+    con = ExplainConnection()
+    plan = slow_query_log._plan(PostgresProvider(), con, "SELECT * FROM articles", {})
+
+    assert plan == ["Seq Scan on articles"]
+    assert con.statements == [
+        "SAVEPOINT conduit_explain",
+        "EXPLAIN ANALYZE SELECT * FROM articles",
+        "ROLLBACK TO SAVEPOINT conduit_explain",
+        "RELEASE SAVEPOINT conduit_explain",
+    ]
+
+    # a failed plan leaves the transaction of the request usable
+    con = ExplainConnection(error=ValueError("syntax error"))
+    plan = slow_query_log._plan(PostgresProvider(), con, "DELETE FROM articles", {})
+
+    assert plan == ["EXPLAIN failed: syntax error"]
+    assert con.statements == [
+        "SAVEPOINT conduit_explain",
+        "EXPLAIN DELETE FROM articles",
+        "ROLLBACK TO SAVEPOINT conduit_explain",
+        "RELEASE SAVEPOINT conduit_explain",
+    ]
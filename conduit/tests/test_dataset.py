@@ -0,0 +1,90 @@
+import json
+
+import morepath
+from pony.orm import count, db_session, select
+import pytest
+from webtest import TestApp as Client
+
+import conduit
+from conduit import TestApp as App
+from conduit.auth import User
+from conduit.blog.model import Article, Comment, Tag
+from conduit.cli import main
+from conduit.database import db
+from conduit.dataset import DatasetGenerator, hash_password, load_dataset
+
+
+def setup_module(module):
+    morepath.scan(conduit)
+    morepath.commit(App)
+
+
+def setup_function(function):
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+
+
+def make_generator(seed=0):
+    return DatasetGenerator(
+        users=20,
+        articles=50,
+        comments=100,
+        favorites=60,
+        follows=4,
+        tags=10,
+        password_hash=hash_password("top_secret"),
+        seed=seed,
+    )
+
+
+def test_load_dataset():
+    messages = []
+    load_dataset(make_generator(), batch_size=16, report=messages.append)
+
+    assert len(messages) == 8
+    with db_session:
+        assert count(u for u in User) == 20
+        assert count(a for a in Article) == 50
+        assert count(c for c in Comment) == 100
+        assert count(t for t in Tag) == 10
+        assert select(u for u in User if u.follows).exists()
+        for article in Article.select():
+            assert article.favorites_count == len(article.favorited)
+            assert 1 <= len(article.tag_list) <= 3
+        for tag in Tag.select():
+            assert tag.articles_count == len(tag.articles)
+        email = User[1].email
+
+    c = Client(App())
+    response = c.post(
+        "/users/login",
+        json.dumps({"user": {"email": email, "password": "top_secret"}}),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+    response = c.get("/articles", headers=headers)
+    assert response.json["articlesCount"] == 50
+
+    new_article = json.dumps(
+        {"article": {"title": "New", "description": "New", "body": "New"}}
+    )
+    c.post("/articles", new_article, headers=headers, status=201)
+
+    with pytest.raises(ValueError):
+        load_dataset(make_generator())
+
+
+def test_dataset_generator_seed():
+    assert list(make_generator().follow_rows()) == list(make_generator().follow_rows())
+    assert list(make_generator().favorite_rows()) != list(
+        make_generator(seed=1).favorite_rows()
+    )
+
+
+def test_generate_arguments(capsys):
+    with pytest.raises(SystemExit):
+        main(["generate", "--users", "0"])
+    assert "0 is less than 1" in capsys.readouterr().err
+
+    with pytest.raises(SystemExit):
+        main(["generate", "--comments", "-1"])
+    assert "-1 is less than 0" in capsys.readouterr().err
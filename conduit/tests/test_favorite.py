@@ -10,6 +10,7 @@ from conduit import TestApp as App
 from conduit.database import db
 from conduit.auth import User
 from conduit.blog.model import Article, Tag
+from conduit.cli import repair_favorites_counts
 from conduit.utils import isoformat_to_datetime
 
 
@@ -96,3 +97,50 @@ def test_article_unfavorite():
 
     response = c.delete("/articles/test-text/favorite", headers=headers)
     assert response.json["article"]["favorited"] is False
+
+
+def test_favorites_count():
+    c = Client(App())
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    response = c.post("/articles/test-text/favorite", headers=headers)
+    assert response.json["article"]["favoritesCount"] == 1
+    assert response.json["article"]["updatedAt"] == "2017-10-21T15:33:35.000Z"
+
+    response = c.post("/articles/test-text/favorite", headers=headers)
+    assert response.json["article"]["favoritesCount"] == 1
+
+    with db_session:
+        Article[1].favorites_count = 5
+
+    repair_favorites_counts(None)
+
+    with db_session:
+        assert Article[1].favorites_count == 1
+
+    response = c.delete("/articles/test-text/favorite", headers=headers)
+    assert response.json["article"]["favoritesCount"] == 0
+
+
+def test_concurrent_favorites():
+    with db_session:
+        article = Article[1]
+        assert article.favorites_count == 0
+        # another transaction favorites the loaded article meanwhile
+        db.execute('UPDATE "articles" SET "favorites_count" = 3 WHERE "id" = 1')
+
+        article.favorite(User[1])
+        assert article.favorites_count == 4
+
+    with db_session:
+        assert Article[1].favorites_count == 4
+        Article[1].unfavorite(User[1])
+        assert Article[1].favorites_count == 3
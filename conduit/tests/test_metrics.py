@@ -0,0 +1,207 @@
+import json
+import os
+
+from argon2 import PasswordHasher
+import morepath
+from pony.orm import db_session
+import pytest
+from webtest import TestApp as Client
+
+import conduit
+from conduit import TestApp as App
+from conduit.auth import User
+from conduit.auth.hashing import password_hasher
+from conduit.blog.model import tag_clouds
+from conduit.database import db
+from conduit.metrics import Metrics, MmapValues, metrics, read_values, setup_metrics
+
+
+def setup_module(module):
+    morepath.scan(conduit)
+    morepath.commit(App)
+
+
+def setup_function(function):
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+
+    with db_session:
+        User(
+            id=1,
+            username="Tester",
+            email="tester@example.com",
+            password=PasswordHasher().hash("top_secret_1"),
+        )
+
+
+@pytest.fixture
+def enabled_metrics(tmpdir):
+    metrics.configure(str(tmpdir), "secret")
+    yield metrics
+    metrics.configure(None)
+
+
+def samples(text):
+    lines = [line for line in text.splitlines() if not line.startswith("#")]
+    return dict(line.rsplit(" ", 1) for line in lines)
+
+
+def test_mmap_values(tmpdir):
+    path = str(tmpdir.join("counter_1.db"))
+    values = MmapValues(path, initial_size=64)
+    values.inc("a")
+    values.inc("a", 2.5)
+    values.set("b", 7)
+    for i in range(20):
+        values.inc("key {}".format(i))
+
+    assert values.get("a") == 3.5
+    assert read_values(path)["a"] == 3.5
+    assert read_values(path)["b"] == 7.0
+    assert len(read_values(path)) == 22
+    values.close()
+
+    # a process reopening its file continues its values
+    values = MmapValues(path, initial_size=64)
+    values.inc("a")
+    assert read_values(path)["a"] == 4.5
+    values.close()
+
+
+def test_aggregation_across_processes(tmpdir):
+    directory = str(tmpdir)
+    metrics = Metrics()
+    metrics.configure(directory)
+    labels = {"model": "Article", "view": "", "method": "GET"}
+    metrics.inc("conduit_requests_total", dict(labels, status="200"))
+    metrics.observe("conduit_request_duration_seconds", labels, 0.02)
+    metrics.set("conduit_db_pool_connections", {"pool": "primary"}, 2)
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        metrics.inc("conduit_requests_total", dict(labels, status="200"), 2)
+        metrics.observe("conduit_request_duration_seconds", labels, 3)
+        metrics.set("conduit_db_pool_connections", {"pool": "primary"}, 5)
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert sorted(os.listdir(directory)) == sorted(
+        [
+            "counter_{}.db".format(os.getpid()),
+            "counter_{}.db".format(pid),
+            "gauge_{}.db".format(os.getpid()),
+            "gauge_{}.db".format(pid),
+        ]
+    )
+    text = metrics.exposition()
+    values = samples(text)
+    assert "# TYPE conduit_request_duration_seconds histogram" in text
+    assert (
+        values[
+            'conduit_requests_total{method="GET",model="Article",status="200",view=""}'
+        ]
+        == "3.0"
+    )
+    histogram = (
+        'conduit_request_duration_seconds_{}{{method="GET",model="Article",view=""{}}}'
+    )
+    assert values[histogram.format("bucket", ',le="0.01"')] == "0.0"
+    assert values[histogram.format("bucket", ',le="0.025"')] == "1.0"
+    assert values[histogram.format("bucket", ',le="5.0"')] == "2.0"
+    assert values[histogram.format("bucket", ',le="+Inf"')] == "2.0"
+    assert values[histogram.format("count", "")] == "2.0"
+    assert values[histogram.format("sum", "")] == "3.02"
+    # the gauges of exited processes are dropped
+    assert values['conduit_db_pool_connections{pool="primary"}'] == "2.0"
+
+
+def test_metrics_endpoint(enabled_metrics):
+    c = Client(App())
+
+    c.get("/tags")
+    c.get("/articles/missing", status=404)
+    login_json = json.dumps(
+        {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+    )
+    c.post("/users/login", login_json)
+    c.get("/not/found", status=404)
+
+    response = c.get("/_metrics", headers={"Authorization": "Bearer secret"})
+
+    assert response.content_type == "text/plain"
+    assert response.headers["Content-Type"].endswith("version=0.0.4")
+    values = samples(response.text)
+    assert (
+        values[
+            'conduit_requests_total{method="GET",model="TagCollection",'
+            'status="200",view=""}'
+        ]
+        == "1.0"
+    )
+    assert (
+        values['conduit_requests_total{method="GET",model="none",status="404",view=""}']
+        == "2.0"
+    )
+    assert (
+        values['conduit_sql_queries_total{method="POST",model="Login",view=""}']
+        == "2.0"
+    )
+    # the statistics of the process since its start
+    assert values['conduit_cache_misses_total{cache="tag_clouds"}'] == str(
+        float(tag_clouds.misses)
+    )
+    assert values["conduit_password_hashing_calls_total"] == str(
+        float(password_hasher.stats()["calls"])
+    )
+
+
+def test_metrics_endpoint_needs_token(enabled_metrics):
+    c = Client(App())
+
+    c.get("/_metrics", status=401)
+    c.get("/_metrics", headers={"Authorization": "Bearer wrong"}, status=401)
+    c.get("/_metrics", headers={"Authorization": "Bearer sécret"}, status=401)
+
+
+def test_metrics_endpoint_disabled():
+    c = Client(App())
+
+    c.get("/_metrics", headers={"Authorization": "Bearer secret"}, status=404)
+
+
+def test_setup_metrics(tmpdir, monkeypatch):
+    class DisabledApp(App):
+        pass
+
+    class MissingDirectoryApp(App):
+        pass
+
+    class EnabledApp(App):
+        pass
+
+    MissingDirectoryApp.init_settings({"metrics": {"enabled": True}})
+    EnabledApp.init_settings(
+        {"metrics": {"enabled": True, "directory": str(tmpdir.join("metrics"))}}
+    )
+    morepath.commit(DisabledApp, MissingDirectoryApp, EnabledApp)
+
+    setup_metrics(DisabledApp())
+    assert not metrics.enabled
+
+    monkeypatch.setenv("CONDUIT_METRICS_TOKEN", "secret")
+    with pytest.raises(ValueError):
+        setup_metrics(MissingDirectoryApp())
+    assert not metrics.enabled
+
+    monkeypatch.delenv("CONDUIT_METRICS_TOKEN")
+    with pytest.raises(ValueError):
+        setup_metrics(EnabledApp())
+    assert not metrics.enabled
+
+    monkeypatch.setenv("CONDUIT_METRICS_TOKEN", "secret")
+    setup_metrics(EnabledApp())
+    try:
+        assert metrics.directory == str(tmpdir.join("metrics"))
+        assert metrics.token == "secret"
+    finally:
+        metrics.configure(None)
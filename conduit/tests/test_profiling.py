@@ -0,0 +1,73 @@
+import json
+import logging
+
+from argon2 import PasswordHasher
+import morepath
+from pony.orm import db_session
+from webtest import TestApp as Client
+
+import conduit
+from conduit import TestApp as App
+from conduit.auth import User
+from conduit.database import db
+from conduit.profiling import ProfilingMiddleware, server_timing_header
+
+
+def setup_module(module):
+    morepath.scan(conduit)
+    morepath.commit(App)
+
+
+def setup_function(function):
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+
+    with db_session:
+        User(
+            id=1,
+            username="Tester",
+            email="tester@example.com",
+            password=PasswordHasher().hash("top_secret_1"),
+        )
+
+
+def test_profiling_middleware(caplog):
+    c = Client(ProfilingMiddleware(App(), db))
+    login_json = json.dumps(
+        {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+    )
+
+    with caplog.at_level(logging.INFO, logger="conduit.profiling"):
+        response = c.post("/users/login", login_json)
+
+    metrics = dict(
+        metric.split(";", 1) for metric in response.headers["Server-Timing"].split(", ")
+    )
+    assert list(metrics) == ["total", "dispatch", "db", "hash", "render"]
+    assert metrics["db"].endswith('desc="2 queries"')
+
+    log = json.loads(caplog.records[-1].getMessage())
+    assert log["method"] == "POST"
+    assert log["path"] == "/users/login"
+    assert log["status"] == 200
+    assert log["queries"] == 2
+    assert log["hash_ms"] > 0
+    assert log["render_ms"] > 0
+    assert log["total_ms"] >= log["db_ms"] + log["hash_ms"] + log["render_ms"]
+
+
+def test_profiling_sample_rate(caplog):
+    c = Client(ProfilingMiddleware(App(), db, sample_rate=0))
+
+    with caplog.at_level(logging.INFO, logger="conduit.profiling"):
+        response = c.get("/tags")
+
+    assert "Server-Timing" not in response.headers
+    assert not caplog.records
+
+
+def test_server_timing_header():
+    timings = {"total": 0.0125, "db": 0.002}
+    assert server_timing_header(timings, 3) == (
+        'total;dur=12.50, db;dur=2.00;desc="3 queries"'
+    )
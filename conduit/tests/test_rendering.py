@@ -0,0 +1,91 @@
+from datetime import datetime
+import json
+
+import morepath
+from pony.orm import db_session
+from webtest import TestApp as Client
+
+import conduit
+from conduit import TestApp as App
+from conduit.database import db
+from conduit.auth import User
+from conduit.blog.model import Article
+from conduit.rendering import (
+    _encode_orjson,
+    _encode_stdlib,
+    get_json_encoder,
+    json_encoders,
+)
+from conduit.utils import datetime_to_isoformat
+
+
+class StdlibJsonApp(App):
+    pass
+
+
+StdlibJsonApp.init_settings({"json": {"encoder": "json"}})
+
+
+def setup_module(module):
+    morepath.scan(conduit)
+    morepath.commit(App, StdlibJsonApp)
+
+
+def setup_function(function):
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+
+    with db_session:
+        User(
+            id=1,
+            username="Tester",
+            email="tester@example.com",
+            password="secret",
+            bio="Ünïcode and </script>",
+        )
+        Article(
+            id=1,
+            title="Test text",
+            description="About testing",
+            body="This is a text test.",
+            author=User[1],
+        )
+
+
+def test_datetime_to_isoformat():
+    for date_time in [
+        datetime(2017, 10, 21, 13, 17, 45),
+        datetime(2017, 10, 21, 13, 17, 45, 999999),
+        datetime(2017, 1, 2, 3, 4, 5, 1000),
+        datetime(2017, 1, 2, 3, 4, 5, 999),
+    ]:
+        expected = date_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        assert datetime_to_isoformat(date_time) == expected
+
+
+def test_get_json_encoder(monkeypatch):
+    assert get_json_encoder() is _encode_orjson
+    assert get_json_encoder("orjson") is _encode_orjson
+    assert get_json_encoder("json") is _encode_stdlib
+
+    monkeypatch.setitem(json_encoders, "orjson", (None, _encode_orjson))
+    assert get_json_encoder("orjson") is _encode_stdlib
+
+
+def test_json_encoders():
+    content = {"tags": ["a", "ü"], "errors": {0: ["is invalid"]}, "count": 1.5}
+    for encode in [_encode_orjson, _encode_stdlib]:
+        assert json.loads(encode(content)) == json.loads(json.dumps(content))
+
+
+def test_render_json():
+    response = Client(App()).get("/articles")
+    stdlib_response = Client(StdlibJsonApp()).get("/articles")
+
+    assert response.content_type == "application/json"
+    assert stdlib_response.content_type == "application/json"
+    assert response.json == stdlib_response.json
+    assert (
+        stdlib_response.body
+        == json.dumps(stdlib_response.json, separators=(",", ":")).encode()
+    )
@@ -0,0 +1,196 @@
+import json
+
+from argon2 import PasswordHasher
+import morepath
+from pony.orm import db_session
+from webtest import TestApp as Client
+
+import conduit
+from conduit import TestApp as App
+from conduit.auth import User
+from conduit.blog import search
+from conduit.blog.model import Article
+from conduit.cli import rebuild_search_index
+from conduit.database import db
+
+
+def setup_module(module):
+    morepath.scan(conduit)
+    morepath.commit(App)
+
+
+def setup_function(function):
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+
+    with db_session:
+        # the index isn't a table of the entities, so it isn't dropped
+        search.clear_index()
+        User(
+            id=1,
+            username="Tester",
+            email="tester@example.com",
+            password=PasswordHasher().hash("top_secret_1"),
+        )
+        Article(
+            id=1,
+            title="Training dragons",
+            description="How to train your dragon",
+            body="Dragons like fish.",
+            author=User[1],
+        )
+        Article(
+            id=2,
+            title="Cooking fish",
+            description="Recipes for dragons",
+            body="Fish needs salt.",
+            author=User[1],
+        )
+        Article(
+            id=3,
+            title="Gardening",
+            description="Growing vegetables",
+            body="Water the plants.",
+            author=User[1],
+        )
+
+
+def login(c):
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    return {"Authorization": response.headers["Authorization"]}
+
+
+def titles(response):
+    return [article["title"] for article in response.json["articles"]]
+
+
+def test_search_ranks_title_matches_first():
+    c = Client(App())
+
+    response = c.get("/articles/search?q=dragon")
+
+    # the stemmed "dragon" matches "dragons" too
+    assert titles(response) == ["Training dragons", "Cooking fish"]
+    assert response.json["articlesCount"] == 2
+    assert response.json["articles"][0]["author"]["username"] == "Tester"
+
+
+def test_search_matches_all_words():
+    c = Client(App())
+
+    response = c.get("/articles/search?q=fish+salt")
+
+    assert titles(response) == ["Cooking fish"]
+    assert response.json["articlesCount"] == 1
+
+
+def test_search_paginates():
+    c = Client(App())
+
+    response = c.get("/articles/search?q=fish&limit=1&offset=1")
+
+    assert titles(response) == ["Training dragons"]
+    assert response.json["articlesCount"] == 2
+
+    c.get("/articles/search?q=fish&offset=-1", status=400)
+
+
+def test_search_limit_is_capped():
+    with db_session:
+        for i in range(120):
+            Article(
+                title="Fish {}".format(i),
+                description="Fish",
+                body="Fish.",
+                author=User[1],
+            )
+
+    c = Client(App())
+
+    response = c.get("/articles/search?q=fish")
+    assert len(response.json["articles"]) == 10
+    assert response.json["articlesCount"] == 122
+
+    response = c.get("/articles/search?q=fish&limit=1000")
+    assert len(response.json["articles"]) == 100
+
+
+def test_search_ignores_query_syntax():
+    c = Client(App())
+
+    response = c.get('/articles/search?q="fish" OR -dragons*')
+    assert titles(response) == []
+
+    response = c.get("/articles/search?q=")
+    assert response.json == {"articles": [], "articlesCount": 0}
+
+
+def test_search_index_follows_changes():
+    c = Client(App())
+    headers = login(c)
+
+    response = c.post(
+        "/articles",
+        json.dumps(
+            {
+                "article": {
+                    "title": "Flying lessons",
+                    "description": "Up high",
+                    "body": "Hold on to the dragon.",
+                }
+            }
+        ),
+        headers=headers,
+        status=201,
+    )
+    slug = response.json["article"]["slug"]
+    assert "Flying lessons" in titles(c.get("/articles/search?q=dragon"))
+
+    c.put(
+        "/articles/" + slug,
+        json.dumps({"article": {"body": "Hold on to the griffin."}}),
+        headers=headers,
+    )
+    assert "Flying lessons" not in titles(c.get("/articles/search?q=dragon"))
+    assert titles(c.get("/articles/search?q=griffin")) == ["Flying lessons"]
+
+    c.delete("/articles/" + slug, headers=headers)
+    assert titles(c.get("/articles/search?q=griffin")) == []
+
+
+def test_favorite_keeps_search_index(monkeypatch):
+    c = Client(App())
+    headers = login(c)
+    indexed = []
+    monkeypatch.setattr(search, "index_article", indexed.append)
+
+    c.post("/articles/training-dragons/favorite", headers=headers)
+    c.delete("/articles/training-dragons/favorite", headers=headers)
+
+    assert indexed == []
+
+
+def test_search_is_not_an_article_slug():
+    with db_session:
+        article = Article(
+            title="Search", description="Finding", body="Things.", author=User[1]
+        )
+        article.flush()
+        assert article.slug == "search-1"
+
+
+def test_rebuild_search_index():
+    with db_session:
+        search.clear_index()
+
+    c = Client(App())
+    assert titles(c.get("/articles/search?q=gardening")) == []
+
+    rebuild_search_index(None)
+
+    assert titles(c.get("/articles/search?q=gardening")) == ["Gardening"]
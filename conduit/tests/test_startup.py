@@ -0,0 +1,30 @@
+from conduit.startup import StartupTimer, parse_import_times
+
+
+def test_startup_timer():
+    timer = StartupTimer()
+    with timer.phase("scan"):
+        pass
+    timer.phases.append(("commit", 0.25))
+
+    assert [name for name, duration in timer.phases] == ["scan", "commit"]
+    lines = timer.report().splitlines()
+    assert lines[0] == "startup time: self [us] | phase"
+    assert lines[2] == "startup time:    250000 | commit"
+    assert lines[3].endswith("| total")
+
+
+def test_parse_import_times():
+    output = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       120 |        120 |   _io",
+            "import time:       444 |     120944 | morepath",
+            "startup time:       563 | settings",
+        ]
+    )
+
+    assert parse_import_times(output) == [
+        ("_io", 120, None),
+        ("morepath", 444, 120944),
+    ]
@@ -1,3 +1,6 @@
+import json
+
+from argon2 import PasswordHasher
 import morepath
 from pony.orm import db_session
 from webtest import TestApp as Client
@@ -5,7 +8,9 @@ from webtest import TestApp as Client
 import conduit
 from conduit import TestApp as App
 from conduit.database import db
+from conduit.auth import User
 from conduit.blog.model import Tag
+from conduit.cli import repair_tag_counts
 
 
 def setup_module(module):
@@ -17,7 +22,15 @@ def setup_function(function):
     db.drop_all_tables(with_all_data=True)
     db.create_tables()
 
+    ph = PasswordHasher()
+
     with db_session:
+        User(
+            id=1,
+            username="Tester",
+            email="tester@example.com",
+            password=ph.hash("top_secret_1"),
+        )
         Tag(id=1, tagname="test")
         Tag(id=2, tagname="text")
 
@@ -29,3 +42,66 @@ def test_list_tags():
     assert len(response.json["tags"]) == 2
     assert "test" in response.json["tags"]
     assert "text" in response.json["tags"]
+
+    c.get("/tags?limit=-1", status=400)
+
+
+def test_get_or_create_tags():
+    with db_session:
+        db.merge_local_stats()
+        tags = Tag.get_or_create(["text", "news", "test", "news", "more"])
+        assert [tag.tagname for tag in tags] == ["text", "news", "test", "more"]
+        assert db.local_stats[None].db_count == 3
+
+    with db_session:
+        assert Tag.select().count() == 4
+        assert Tag.get_or_create([]) == []
+        assert Tag.get_or_create(["more"]) == [Tag.get(tagname="more")]
+
+
+def test_tag_cloud():
+    c = Client(App())
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    for title, tag_list in [
+        ("First", ["news", "test"]),
+        ("Second", ["news"]),
+        ("Third", ["news", "text"]),
+    ]:
+        article = {"title": title, "description": title, "body": title}
+        article["tagList"] = tag_list
+        c.post("/articles", json.dumps({"article": article}), headers=headers)
+
+    response = c.get("/tags?limit=2")
+    assert response.json["tags"] == ["news", "test"]
+    assert response.json["tagCounts"] == {"news": 3, "test": 1}
+
+    response = c.get("/tags")
+    assert response.json["tags"] == ["news", "test", "text"]
+    assert response.json["tagCounts"] == {"news": 3, "test": 1, "text": 1}
+
+    c.put(
+        "/articles/second",
+        json.dumps({"article": {"tagList": ["text"]}}),
+        headers=headers,
+    )
+    c.delete("/articles/first", headers=headers)
+
+    response = c.get("/tags?limit=2")
+    assert response.json["tags"] == ["text", "news"]
+    assert response.json["tagCounts"] == {"news": 1, "text": 2}
+
+    with db_session:
+        Tag[1].articles_count = 10
+
+    repair_tag_counts(None)
+
+    response = c.get("/tags")
+    assert response.json["tagCounts"] == {"news": 1, "test": 0, "text": 2}
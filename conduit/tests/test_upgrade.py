@@ -0,0 +1,101 @@
+import sqlite3
+
+from conduit.upgrade import upgrade
+
+# the tables of the earlier versions, without the new columns and indexes
+OLD_SCHEMA = """
+CREATE TABLE "users" ("id" INTEGER PRIMARY KEY, "username" TEXT);
+CREATE TABLE "articles" (
+  "id" INTEGER PRIMARY KEY, "title" TEXT, "author" INTEGER,
+  "created_at" DATETIME NOT NULL
+);
+CREATE TABLE "tags" ("id" INTEGER PRIMARY KEY, "tagname" TEXT NOT NULL);
+CREATE TABLE "Article_Tag" (
+  "article" INTEGER NOT NULL, "tag" INTEGER NOT NULL,
+  PRIMARY KEY ("article", "tag")
+);
+CREATE TABLE "Article_User" (
+  "article" INTEGER NOT NULL, "user" INTEGER NOT NULL,
+  PRIMARY KEY ("article", "user")
+);
+CREATE TABLE "comments" (
+  "id" INTEGER PRIMARY KEY, "body" TEXT, "created_at" DATETIME NOT NULL
+);
+CREATE TABLE "timeline" (
+  "id" INTEGER PRIMARY KEY, "user" INTEGER NOT NULL, "article" INTEGER NOT NULL
+);
+INSERT INTO "users" VALUES (1, 'Tester'), (2, 'Reader');
+INSERT INTO "articles" VALUES
+  (1, 'Dragons', 1, '2019-01-01 10:00:00'),
+  (2, 'Fish', 1, '2019-01-02 10:00:00');
+INSERT INTO "tags" VALUES (1, 'dragons'), (2, 'fish'), (3, 'dragons'), (4, 'dragons');
+INSERT INTO "Article_Tag" VALUES (1, 1), (1, 3), (2, 2), (2, 4);
+INSERT INTO "Article_User" VALUES (1, 1), (1, 2), (2, 2);
+INSERT INTO "timeline" VALUES (1, 2, 1), (2, 2, 2);
+"""
+
+
+def old_database(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(OLD_SCHEMA)
+    connection.commit()
+    connection.close()
+
+
+def test_upgrade(tmpdir):
+    path = str(tmpdir.join("conduit.db"))
+    old_database(path)
+    messages = []
+
+    upgrade({"provider": "sqlite", "filename": path}, messages.append)
+
+    assert messages == [
+        "Added articles.favorites_count",
+        "Added tags.articles_count",
+        "Added timeline.created_at",
+        "Merged 2 duplicate tags",
+        "The database is up to date",
+    ]
+    connection = sqlite3.connect(path)
+    assert connection.execute(
+        'SELECT "id", "favorites_count" FROM "articles" ORDER BY "id"'
+    ).fetchall() == [(1, 2), (2, 1)]
+    assert connection.execute(
+        'SELECT "id", "tagname", "articles_count" FROM "tags" ORDER BY "id"'
+    ).fetchall() == [(1, "dragons", 2), (2, "fish", 1)]
+    assert connection.execute(
+        'SELECT "article", "tag" FROM "Article_Tag" ORDER BY "article", "tag"'
+    ).fetchall() == [(1, 1), (2, 1), (2, 2)]
+    assert connection.execute(
+        'SELECT "article", "created_at" FROM "timeline" ORDER BY "id"'
+    ).fetchall() == [(1, "2019-01-01 10:00:00"), (2, "2019-01-02 10:00:00")]
+    indexes = {
+        row[0]
+        for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+    assert {
+        "unq_tags__tagname",
+        "idx_tags__articles_count",
+        "idx_articles__created_at_id",
+        "idx_comments__created_at_id",
+        "idx_timeline__user_created_at_article",
+    } <= indexes
+    connection.close()
+
+    # an upgraded database is left as it is
+    messages = []
+    upgrade({"provider": "sqlite", "filename": path}, messages.append)
+    assert messages == ["The database is up to date"]
+
+
+def test_upgrade_empty_database(tmpdir):
+    path = str(tmpdir.join("conduit.db"))
+    messages = []
+
+    upgrade(
+        {"provider": "sqlite", "filename": path, "create_db": True}, messages.append
+    )
+
+    assert messages == ["The database is empty, the app creates the tables"]
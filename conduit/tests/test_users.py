@@ -9,6 +9,7 @@ import conduit
 from conduit import TestApp as App
 from conduit.database import db
 from conduit.auth import User
+from conduit.auth.hashing import password_hasher
 
 
 def setup_module(module):
@@ -259,3 +260,82 @@ def test_update_user():
 
     with db_session:
         assert User[1].email == "guru@example.com"
+
+
+def test_current_user():
+    c = Client(App())
+
+    response = c.post(
+        "/users/login",
+        json.dumps(
+            {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+        ),
+    )
+
+    headers = {"Authorization": response.headers["Authorization"]}
+
+    db.merge_local_stats()
+    c.get("/articles/feed", headers=headers)
+    # the path and the view share the user loaded once
+    user_queries = [
+        stat.db_count
+        for sql, stat in db.local_stats.items()
+        if sql and '"users"' in sql
+    ]
+    assert user_queries == [1]
+
+    update_user_json = json.dumps({"user": {"email": "guru@example.com"}})
+    c.put("/user", update_user_json, headers=headers)
+
+    c.get("/user", headers=headers, status=404)
+
+    with db_session:
+        User[2].email = "tester@example.com"
+
+    response = c.get("/user", headers=headers)
+    assert response.json["user"]["username"] == "OtherUser"
+
+
+def test_hashing_busy():
+    c = Client(App())
+
+    password_hasher.configure(max_pending=0, timeout=0)
+    try:
+        response = c.post(
+            "/users/login",
+            json.dumps(
+                {"user": {"email": "tester@example.com", "password": "top_secret_1"}}
+            ),
+            status=503,
+        )
+    finally:
+        password_hasher.configure()
+
+    assert response.json == {"errors": {"server": ["is busy, please try again later"]}}
+    assert response.headers["Retry-After"] == "1"
+    assert password_hasher.stats()["rejected"] >= 1
+
+
+def test_hashing_process_pool():
+    password_hasher.configure(workers=1)
+    try:
+        password_hash = password_hasher.hash("top_secret_1")
+        assert password_hasher.verify(password_hash, "top_secret_1")
+        assert not password_hasher.verify(password_hash, "top_secret_2")
+    finally:
+        password_hasher.configure()
+
+
+def test_hashing_broken_process_pool():
+    password_hasher.configure(workers=1)
+    try:
+        password_hash = password_hasher.hash("top_secret_1")
+        executor = password_hasher._executor
+        for process in list(executor._processes.values()):
+            process.kill()
+            process.join()
+
+        assert password_hasher.verify(password_hash, "top_secret_1")
+        assert password_hasher._executor is not executor
+    finally:
+        password_hasher.configure()
@@ -0,0 +1,166 @@
+"""Upgrade databases created by earlier versions to the current schema.
+
+Pony creates missing tables, but doesn't add new columns and indexes to
+existing tables. It checks the columns of the tables when the app
+starts, so the upgrade has to run before, on a database which isn't
+mapped to the entities. Every step is skipped when it was already done.
+"""
+from pony.orm import Database, commit, db_session
+
+COLUMN_TYPES = {
+    "SQLite": {"int": "INTEGER", "datetime": "DATETIME"},
+    "PostgreSQL": {"int": "INTEGER", "datetime": "TIMESTAMP"},
+}
+
+# (table, column, type, default, statement filling the column)
+COLUMNS = [
+    (
+        "articles",
+        "favorites_count",
+        "int",
+        "0",
+        'UPDATE "articles" SET "favorites_count" = ('
+        'SELECT COUNT(*) FROM "Article_User" '
+        'WHERE "Article_User"."article" = "articles"."id")',
+    ),
+    (
+        "tags",
+        "articles_count",
+        "int",
+        "0",
+        'UPDATE "tags" SET "articles_count" = ('
+        'SELECT COUNT(*) FROM "Article_Tag" '
+        'WHERE "Article_Tag"."tag" = "tags"."id")',
+    ),
+    (
+        "timeline",
+        "created_at",
+        "datetime",
+        "'1970-01-01 00:00:00'",
+        'UPDATE "timeline" SET "created_at" = ('
+        'SELECT "created_at" FROM "articles" '
+        'WHERE "articles"."id" = "timeline"."article")',
+    ),
+]
+
+# (table, statement) with the names Pony gives the indexes it creates
+INDEXES = [
+    (
+        "tags",
+        'CREATE UNIQUE INDEX IF NOT EXISTS "unq_tags__tagname" ON "tags" ("tagname")',
+    ),
+    (
+        "tags",
+        'CREATE INDEX IF NOT EXISTS "idx_tags__articles_count" '
+        'ON "tags" ("articles_count")',
+    ),
+    (
+        "articles",
+        'CREATE INDEX IF NOT EXISTS "idx_articles__created_at_id" '
+        'ON "articles" ("created_at", "id")',
+    ),
+    (
+        "comments",
+        'CREATE INDEX IF NOT EXISTS "idx_comments__created_at_id" '
+        'ON "comments" ("created_at", "id")',
+    ),
+    (
+        "timeline",
+        'CREATE INDEX IF NOT EXISTS "idx_timeline__user_created_at_article" '
+        'ON "timeline" ("user", "created_at", "article")',
+    ),
+]
+
+# the articles of duplicate tags move to the tag with the lowest id
+MERGE_DUPLICATE_TAGS = [
+    'INSERT INTO "Article_Tag" ("article", "tag") '
+    'SELECT DISTINCT "Article_Tag"."article", "kept"."id" '
+    'FROM "Article_Tag" JOIN "tags" ON "tags"."id" = "Article_Tag"."tag" '
+    'JOIN (SELECT MIN("id") AS "id", "tagname" FROM "tags" GROUP BY "tagname") '
+    '"kept" ON "kept"."tagname" = "tags"."tagname" '
+    'WHERE "Article_Tag"."tag" <> "kept"."id" AND NOT EXISTS ('
+    'SELECT 1 FROM "Article_Tag" "other" '
+    'WHERE "other"."article" = "Article_Tag"."article" '
+    'AND "other"."tag" = "kept"."id")',
+    'DELETE FROM "Article_Tag" WHERE "tag" NOT IN ('
+    'SELECT MIN("id") FROM "tags" GROUP BY "tagname")',
+    'DELETE FROM "tags" WHERE "id" NOT IN ('
+    'SELECT MIN("id") FROM "tags" GROUP BY "tagname")',
+]
+
+
+def _tables(database):
+    if database.provider.dialect == "PostgreSQL":  # pragma: no cover
+        return set(
+            database.select(
+                "SELECT table_name FROM information_schema.tables "
+                "WHERE table_schema = current_schema()"
+            )
+        )
+    return set(database.select("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+
+def _columns(database, table):
+    if database.provider.dialect == "PostgreSQL":  # pragma: no cover
+        return set(
+            database.select(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = $table",
+                {},
+                {"table": table},
+            )
+        )
+    return {row[1] for row in database.execute('PRAGMA table_info("{}")'.format(table))}
+
+
+def _duplicate_tags(database):
+    return database.select('SELECT COUNT(*) - COUNT(DISTINCT "tagname") FROM "tags"')[0]
+
+
+def upgrade_database(database, report=print):
+    """Add the missing columns and indexes to the tables of ``database``.
+
+    Tags with the same name are merged before their names get a unique
+    index. ``report`` is called with a message for each change.
+    """
+    types = COLUMN_TYPES[database.provider.dialect]
+    with db_session:
+        tables = _tables(database)
+        if "articles" not in tables:
+            report("The database is empty, the app creates the tables")
+            return
+
+        for table, column, type, default, fill in COLUMNS:
+            if table in tables and column not in _columns(database, table):
+                database.execute(
+                    'ALTER TABLE "{}" ADD COLUMN "{}" {} NOT NULL DEFAULT {}'.format(
+                        table, column, types[type], default
+                    )
+                )
+                database.execute(fill)
+                report("Added {}.{}".format(table, column))
+
+        if "tags" in tables:
+            duplicates = _duplicate_tags(database)
+            if duplicates:
+                for sql in MERGE_DUPLICATE_TAGS:
+                    database.execute(sql)
+                # the articles of the merged tags count for the kept tag
+                database.execute(COLUMNS[1][4])
+                report("Merged {} duplicate tags".format(duplicates))
+
+        for table, sql in INDEXES:
+            if table in tables:
+                database.execute(sql)
+        commit()
+    report("The database is up to date")
+
+
+def upgrade(params, report=print):
+    """Upgrade the database with the connection ``params`` of the settings."""
+    database = Database()
+    database.bind(**params)
+    try:
+        upgrade_database(database, report)
+    finally:
+        database.disconnect()
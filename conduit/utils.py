@@ -1,9 +1,54 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime
+import pkgutil
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader
+
+
+def load_yaml(package, resource):
+    """Load a YAML file from the package data of ``package``.
+
+    Uses the LibYAML parser when PyYAML was built with it.
+    """
+    return yaml.load(pkgutil.get_data(package, resource), Loader=SafeLoader)
 
 
 def datetime_to_isoformat(date_time):
-    return date_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    # isoformat truncates to milliseconds like slicing the strftime result,
+    # but is much faster
+    return date_time.isoformat(timespec="milliseconds") + "Z"
 
 
 def isoformat_to_datetime(isoformat):
     return datetime.strptime(isoformat[:-1] + "000Z", "%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def encode_cursor(created_at, id, direction="next"):
+    """Encode the position of a row as an opaque pagination cursor.
+
+    ``direction`` is ``"next"`` for seeking to older rows and ``"prev"``
+    for seeking to newer rows.
+    """
+    position = "{}|{}|{}".format(direction, created_at.isoformat(), id)
+    return urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into a ``(direction, created_at, id)`` tuple.
+
+    Raises ``ValueError`` if the cursor is malformed.
+    """
+    try:
+        position = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        direction, created_at, id = position.split("|")
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if direction not in ("next", "prev"):
+        raise ValueError("Invalid cursor")
+
+    return direction, datetime.fromisoformat(created_at), int(id)
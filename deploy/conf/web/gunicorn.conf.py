@@ -1,5 +1,14 @@
 import multiprocessing
+import shutil
 
 bind = "unix:/tmp/proxy_conduit.yacoma.it.sock"
 workers = multiprocessing.cpu_count() * 2 + 1
 forwarded_allow_ips = "127.0.0.1, 188.165.237.135"
+
+# the directory of the metrics files in conduit/settings/production.yml
+metrics_directory = "/tmp/conduit-metrics"
+
+
+def on_starting(server):
+    # the counters start from zero with each start of the server
+    shutil.rmtree(metrics_directory, ignore_errors=True)
@@ -15,6 +15,7 @@ setup(
     url="https://github.com/yacoma/morepath-realworld-example-app",
     packages=find_packages(),
     include_package_data=True,
+    package_data={"conduit": ["settings/*.yml", "auth/schema.yml", "blog/schema.yml"]},
     zip_safe=False,
     platforms="any",
     install_requires=[
@@ -33,12 +34,18 @@ setup(
             "pytest-remove-stale-bytecode",
             "pytest-env",
             "WebTest >= 2.0.14",
+            "orjson",
         ],
         pep8=["flake8", "black"],
         coverage=["pytest-cov"],
-        production=["psycopg2"],
+        production=["psycopg2", "orjson"],
+        fastjson=["orjson"],
+        asgi=["uvicorn"],
+    ),
+    entry_points=dict(
+        morepath=["scan = conduit"],
+        console_scripts=["conduit = conduit.cli:main"],
     ),
-    entry_points=dict(morepath=["scan = conduit"]),
     classifiers=[
         "License :: OSI Approved :: MIT License" "Intended Audience :: Developers",
         "Environment :: Web Environment",